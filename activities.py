@@ -0,0 +1,25 @@
+# Кнопки выбора активности -> тип активности в БД
+ACTIVITY_MAP = {
+    "💼 Работа": "work",
+    "😴 Сон": "sleep",
+    "🎯 Отдых": "rest",
+    "📚 Учеба": "study",
+    "🎮 Развлечения": "entertainment"
+}
+
+ACTIVITY_NAMES = {activity_type: name for name, activity_type in ACTIVITY_MAP.items()}
+
+# Тип активности по ключу БД, тексту кнопки или названию без эмодзи (в нижнем регистре)
+ACTIVITY_ALIASES = {}
+for _button, _activity_type in ACTIVITY_MAP.items():
+    ACTIVITY_ALIASES[_activity_type] = _activity_type
+    ACTIVITY_ALIASES[_button.lower()] = _activity_type
+    ACTIVITY_ALIASES[_button.split(' ', 1)[1].lower()] = _activity_type
+
+# Допустимая продолжительность одной записи, в минутах
+MIN_DURATION = 1
+MAX_DURATION = 1440
+
+
+def is_valid_duration(minutes):
+    return MIN_DURATION <= minutes <= MAX_DURATION
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+# Допуск обновлений к обработчикам.
+# - Повторно доставленные обновления (тот же update_id) отбрасываются.
+# - «Дорогие» запросы (отчеты, статистика) выполняются не больше одного
+#   одновременно на пользователя; такой же запрос, пришедший во время
+#   выполнения, дожидается его и не пересчитывается — пользователь получает
+#   уже отправленный ответ.
+# - Повторное нажатие той же inline-кнопки (например, quick_*) в пределах
+#   callback_window секунд отбрасывается, чтобы не добавить запись дважды.
+# - Если обновления в среднем ждут обработки дольше shed_threshold секунд,
+#   новые дорогие запросы отклоняются (on_shed сообщает пользователю),
+#   а добавление записей продолжает работать.
+class AdmissionMiddleware(BaseMiddleware):
+    def __init__(self, expensive_handlers=(), expensive_texts=(), callback_window=5.0,
+                 shed_threshold=10.0, latency_alpha=0.2, on_shed=None, remember_updates=1000):
+        super().__init__()
+        self.expensive_handlers = set(expensive_handlers)
+        self.expensive_texts = set(expensive_texts)
+        self.callback_window = callback_window
+        self.shed_threshold = shed_threshold
+        self.latency_alpha = latency_alpha
+        self.on_shed = on_shed
+        self.remember_updates = remember_updates
+
+        # user_id -> (ключ запроса, future завершения)
+        self.in_flight = {}
+        # (user_id, message_id, data) -> время нажатия
+        self.recent_callbacks = OrderedDict()
+        self.recent_updates = OrderedDict()
+        # Сглаженное время ожидания обновления (по дате сообщения), секунды
+        self.latency = 0.0
+
+        # Метрики
+        self.joined_total = 0
+        self.serialized_total = 0
+        self.callbacks_dropped_total = 0
+        self.updates_dropped_total = 0
+        self.shed_total = 0
+
+    def stats(self):
+        return {
+            'in_flight': len(self.in_flight),
+            'latency': self.latency,
+            'overloaded': int(self.is_overloaded()),
+            'joined_total': self.joined_total,
+            'serialized_total': self.serialized_total,
+            'callbacks_dropped_total': self.callbacks_dropped_total,
+            'updates_dropped_total': self.updates_dropped_total,
+            'shed_total': self.shed_total,
+        }
+
+    def is_overloaded(self):
+        return self.latency > self.shed_threshold
+
+    def _observe(self, message):
+        if message is None or message.date is None:
+            return
+        age = max(0.0, time.time() - message.date.timestamp())
+        self.latency += self.latency_alpha * (age - self.latency)
+
+    async def on_pre_process_update(self, update, data):
+        if update.update_id in self.recent_updates:
+            self.updates_dropped_total += 1
+            raise CancelHandler()
+        self.recent_updates[update.update_id] = None
+        if len(self.recent_updates) > self.remember_updates:
+            self.recent_updates.popitem(last=False)
+        self._observe(update.message)
+
+    # --- Дорогие запросы ---
+
+    def _request_key(self, message):
+        handler = current_handler.get()
+        name = getattr(handler, '__name__', None)
+        if name in self.expensive_handlers or message.text in self.expensive_texts:
+            return name, (message.text or '').strip().lower()
+        return None
+
+    async def on_process_message(self, message, data):
+        key = self._request_key(message)
+        if key is None:
+            return
+        user_id = message.from_user.id
+
+        if self.is_overloaded():
+            self.shed_total += 1
+            if self.on_shed:
+                await self.on_shed(message)
+            raise CancelHandler()
+
+        while True:
+            current = self.in_flight.get(user_id)
+            if current is None:
+                break
+            current_key, done = current
+            await asyncio.shield(done)
+            if current_key == key:
+                # Такой же запрос только что выполнен — ответ уже отправлен
+                self.joined_total += 1
+                raise CancelHandler()
+            self.serialized_total += 1
+
+        done = asyncio.get_running_loop().create_future()
+        self.in_flight[user_id] = (key, done)
+        data['_admission_done'] = (user_id, done)
+
+    async def on_post_process_message(self, message, results, data):
+        entry = data.pop('_admission_done', None)
+        if entry is None:
+            return
+        user_id, done = entry
+        if self.in_flight.get(user_id, (None, None))[1] is done:
+            del self.in_flight[user_id]
+        done.set_result(None)
+
+    # --- Повторные нажатия кнопок ---
+
+    async def on_pre_process_callback_query(self, callback_query, data):
+        message_id = callback_query.message.message_id if callback_query.message else None
+        key = (callback_query.from_user.id, message_id, callback_query.data)
+        now = time.monotonic()
+        while self.recent_callbacks:
+            oldest_key, pressed_at = next(iter(self.recent_callbacks.items()))
+            if now - pressed_at <= self.callback_window:
+                break
+            del self.recent_callbacks[oldest_key]
+
+        if key in self.recent_callbacks:
+            self.callbacks_dropped_total += 1
+            try:
+                await callback_query.answer()
+            except Exception as e:
+                logger.debug(f"Не удалось ответить на повторное нажатие: {e}")
+            raise CancelHandler()
+        self.recent_callbacks[key] = now
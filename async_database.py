@@ -0,0 +1,871 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import timedelta
+
+import aiomysql
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_TYPES = ('work', 'sleep', 'rest', 'study', 'entertainment')
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Асинхронный вариант Database поверх пула соединений aiomysql.
+# Повторяет методы Database, но не блокирует цикл событий aiogram.
+class AsyncDatabase:
+    def __init__(self, host, user, password, database, port=3306,
+                 pool_size=10, min_pool_size=1, acquire_timeout=5.0):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+        self.port = port
+        self.pool_size = pool_size
+        self.min_pool_size = min(min_pool_size, pool_size)
+        self.acquire_timeout = acquire_timeout
+        self.pool = None
+
+        # Метрики пула
+        self._waiting = 0
+        self._acquired_total = 0
+        self._timeouts_total = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    async def connect(self):
+        if self.pool is not None:
+            return
+        self.pool = await aiomysql.create_pool(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            db=self.database,
+            minsize=self.min_pool_size,
+            maxsize=self.pool_size,
+            charset='utf8mb4',
+            autocommit=False
+        )
+        await self._create_tables()
+        logger.info(f"Пул соединений создан (размер: {self.pool_size})")
+
+    async def close(self):
+        if self.pool is None:
+            return
+        self.pool.close()
+        await self.pool.wait_closed()
+        self.pool = None
+        logger.info("Пул соединений закрыт")
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self.pool is None:
+            raise RuntimeError("База данных не подключена")
+
+        started = time.monotonic()
+        self._waiting += 1
+        try:
+            conn = await asyncio.wait_for(self.pool.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self._timeouts_total += 1
+            raise PoolTimeout(
+                f"Не удалось получить соединение за {self.acquire_timeout} с"
+            )
+        finally:
+            self._waiting -= 1
+
+        waited = time.monotonic() - started
+        self._acquired_total += 1
+        self._wait_time_total += waited
+        self._wait_time_max = max(self._wait_time_max, waited)
+
+        try:
+            yield conn
+        finally:
+            self.pool.release(conn)
+
+    def pool_stats(self):
+        if self.pool is None:
+            size = idle = 0
+        else:
+            size = self.pool.size
+            idle = self.pool.freesize
+        acquired = self._acquired_total
+        return {
+            'max_size': self.pool_size,
+            'size': size,
+            'in_use': size - idle,
+            'idle': idle,
+            'waiting': self._waiting,
+            'acquired_total': acquired,
+            'timeouts_total': self._timeouts_total,
+            'wait_time_total': self._wait_time_total,
+            'wait_time_avg': self._wait_time_total / acquired if acquired else 0.0,
+            'wait_time_max': self._wait_time_max,
+        }
+
+    async def _create_tables(self):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS users (
+                        user_id BIGINT PRIMARY KEY,
+                        username VARCHAR(255),
+                        timezone VARCHAR(64) NULL,
+                        team VARCHAR(32) NULL,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        digest_daily TINYINT NOT NULL DEFAULT 0,
+                        digest_weekly TINYINT NOT NULL DEFAULT 0,
+                        INDEX idx_team (team)
+                    )
+                """)
+                await cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS time_entries (
+                        id INT AUTO_INCREMENT PRIMARY KEY,
+                        user_id BIGINT NOT NULL,
+                        activity_type VARCHAR(32) NOT NULL,
+                        duration_minutes INT NOT NULL,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        local_date DATE NOT NULL,
+                        import_key CHAR(40) NULL,
+                        INDEX idx_user_created (user_id, created_at),
+                        INDEX idx_user_local (user_id, local_date, created_at),
+                        UNIQUE KEY uq_user_import (user_id, import_key)
+                    )
+                """)
+                # Столбцы, появившиеся позже, добавляем в существующие таблицы
+                await self._ensure_column(
+                    cursor, 'time_entries', 'import_key',
+                    "ADD COLUMN import_key CHAR(40) NULL, "
+                    "ADD UNIQUE KEY uq_user_import (user_id, import_key)"
+                )
+                await self._ensure_column(
+                    cursor, 'users', 'digest_daily',
+                    "ADD COLUMN digest_daily TINYINT NOT NULL DEFAULT 0, "
+                    "ADD COLUMN digest_weekly TINYINT NOT NULL DEFAULT 0"
+                )
+                await self._ensure_column(
+                    cursor, 'users', 'timezone', "ADD COLUMN timezone VARCHAR(64) NULL"
+                )
+                await self._ensure_column(
+                    cursor, 'users', 'team',
+                    "ADD COLUMN team VARCHAR(32) NULL, ADD INDEX idx_team (team)"
+                )
+                # День записи в поясе пользователя; старые записи получают день сервера
+                if await self._ensure_column(
+                    cursor, 'time_entries', 'local_date',
+                    "ADD COLUMN local_date DATE NULL, "
+                    "ADD INDEX idx_user_local (user_id, local_date, created_at)"
+                ):
+                    await cursor.execute(
+                        "UPDATE time_entries SET local_date = DATE(created_at)"
+                    )
+                    await cursor.execute(
+                        "ALTER TABLE time_entries MODIFY local_date DATE NOT NULL"
+                    )
+                # Суточные агрегаты: пользователь × день × активность
+                await cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS daily_rollup (
+                        user_id BIGINT NOT NULL,
+                        day DATE NOT NULL,
+                        activity_type VARCHAR(32) NOT NULL,
+                        total_minutes INT NOT NULL DEFAULT 0,
+                        entries_count INT NOT NULL DEFAULT 0,
+                        PRIMARY KEY (user_id, day, activity_type),
+                        INDEX idx_day (day, user_id, activity_type, total_minutes)
+                    )
+                """)
+                # Недельные суммы всех пользователей (leaderboard.py) читаются по дням
+                await self._ensure_index(
+                    cursor, 'daily_rollup', 'idx_day',
+                    "ADD INDEX idx_day (day, user_id, activity_type, total_minutes)"
+                )
+                # Гистограммы недельных сумм процессов (leaderboard.py)
+                await cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS activity_sketches (
+                        shard VARCHAR(16) NOT NULL,
+                        week DATE NOT NULL,
+                        sketch VARCHAR(32) NOT NULL,
+                        counts BLOB NOT NULL,
+                        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                        PRIMARY KEY (shard, week, sketch)
+                    )
+                """)
+                # Запущенные таймеры (контрольная точка индекса из timers.py)
+                await cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS running_timers (
+                        user_id BIGINT PRIMARY KEY,
+                        activity_type VARCHAR(32) NOT NULL,
+                        started_at DATETIME NOT NULL
+                    )
+                """)
+                # Доставка сводок: строка на пользователя в каждом запуске (вид × период).
+                # pending -> claimed -> sending -> sent/failed/skipped
+                await cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS digest_deliveries (
+                        kind VARCHAR(8) NOT NULL,
+                        period DATE NOT NULL,
+                        user_id BIGINT NOT NULL,
+                        status VARCHAR(8) NOT NULL DEFAULT 'pending',
+                        claimed_by CHAR(32) NULL,
+                        claimed_at DATETIME NULL,
+                        sent_at DATETIME NULL,
+                        PRIMARY KEY (kind, period, user_id),
+                        INDEX idx_run_status (kind, period, status, user_id)
+                    )
+                """)
+            await conn.commit()
+
+    async def _ensure_column(self, cursor, table, column, alter):
+        await cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+            (table, column)
+        )
+        (exists,) = await cursor.fetchone()
+        if not exists:
+            await cursor.execute(f"ALTER TABLE {table} {alter}")
+        return not exists
+
+    async def _ensure_index(self, cursor, table, index, alter):
+        await cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+            (table, index)
+        )
+        (exists,) = await cursor.fetchone()
+        if not exists:
+            await cursor.execute(f"ALTER TABLE {table} {alter}")
+
+    # timezone сохраняется, только если у пользователя пояс еще не задан
+    async def create_user(self, user_id, username, timezone=None):
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        "INSERT INTO users (user_id, username, timezone) VALUES (%s, %s, %s) "
+                        "ON DUPLICATE KEY UPDATE username = VALUES(username), "
+                        "timezone = COALESCE(timezone, VALUES(timezone))",
+                        (user_id, username, timezone)
+                    )
+                await conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка создания пользователя {user_id}: {e}")
+            return False
+
+    async def get_user_timezone(self, user_id):
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        "SELECT timezone FROM users WHERE user_id = %s", (user_id,)
+                    )
+                    row = await cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Ошибка чтения часового пояса {user_id}: {e}")
+            return None
+        return row[0] if row else None
+
+    # Пользователь уже должен существовать (create_user)
+    async def set_user_timezone(self, user_id, timezone):
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        "UPDATE users SET timezone = %s WHERE user_id = %s",
+                        (timezone, user_id)
+                    )
+                await conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка изменения часового пояса {user_id}: {e}")
+            return False
+
+    # created_at задается для записей задним числом (например, часть таймера до полуночи).
+    # local_date — день записи в поясе пользователя; по умолчанию день сервера.
+    async def add_time_entry(self, user_id, activity_type, duration_minutes, created_at=None,
+                             local_date=None):
+        if local_date is None and created_at is not None:
+            local_date = created_at.date()
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    if created_at is None:
+                        await cursor.execute(
+                            "INSERT INTO time_entries "
+                            "(user_id, activity_type, duration_minutes, local_date) "
+                            "VALUES (%s, %s, %s, COALESCE(%s, CURDATE()))",
+                            (user_id, activity_type, duration_minutes, local_date)
+                        )
+                    else:
+                        await cursor.execute(
+                            "INSERT INTO time_entries "
+                            "(user_id, activity_type, duration_minutes, created_at, local_date) "
+                            "VALUES (%s, %s, %s, %s, %s)",
+                            (user_id, activity_type, duration_minutes, created_at, local_date)
+                        )
+                    entry_id = cursor.lastrowid
+                    # Агрегат обновляется в той же транзакции, что и запись
+                    await cursor.execute(
+                        "INSERT INTO daily_rollup "
+                        "(user_id, day, activity_type, total_minutes, entries_count) "
+                        "SELECT user_id, local_date, activity_type, duration_minutes, 1 "
+                        "FROM time_entries WHERE id = %s "
+                        "ON DUPLICATE KEY UPDATE "
+                        "total_minutes = total_minutes + VALUES(total_minutes), "
+                        "entries_count = entries_count + VALUES(entries_count)",
+                        (entry_id,)
+                    )
+                await conn.commit()
+            return entry_id
+        except Exception as e:
+            logger.error(f"Ошибка добавления записи для {user_id}: {e}")
+            return None
+
+    # Пакетная вставка: entries — список (user_id, activity_type, duration_minutes),
+    # local_dates — дни записей в поясах пользователей (по умолчанию день сервера).
+    # Все записи и их агрегаты фиксируются одной транзакцией.
+    # -> число сохраненных записей (0 при ошибке). id не возвращаются:
+    # последовательными их не гарантирует ни innodb_autoinc_lock_mode = 2,
+    # ни разбиение executemany на несколько INSERT
+    async def add_time_entries(self, entries, local_dates=None):
+        if not entries:
+            return 0
+
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("SELECT NOW()")
+                    (now,) = await cursor.fetchone()
+                    if local_dates is None:
+                        local_dates = [now.date()] * len(entries)
+
+                    await cursor.executemany(
+                        "INSERT INTO time_entries "
+                        "(user_id, activity_type, duration_minutes, created_at, local_date) "
+                        "VALUES (%s, %s, %s, %s, %s)",
+                        [entry + (now, day) for entry, day in zip(entries, local_dates)]
+                    )
+
+                    totals = {}
+                    for (user_id, activity_type, duration_minutes), day in zip(entries, local_dates):
+                        key = (user_id, day, activity_type)
+                        minutes, count = totals.get(key, (0, 0))
+                        totals[key] = (minutes + duration_minutes, count + 1)
+
+                    await cursor.executemany(
+                        "INSERT INTO daily_rollup "
+                        "(user_id, day, activity_type, total_minutes, entries_count) "
+                        "VALUES (%s, %s, %s, %s, %s) "
+                        "ON DUPLICATE KEY UPDATE "
+                        "total_minutes = total_minutes + VALUES(total_minutes), "
+                        "entries_count = entries_count + VALUES(entries_count)",
+                        [
+                            (user_id, day, activity_type, minutes, count)
+                            for (user_id, day, activity_type), (minutes, count) in totals.items()
+                        ]
+                    )
+                await conn.commit()
+            return len(entries)
+        except Exception as e:
+            logger.error(f"Ошибка пакетного добавления {len(entries)} записей: {e}")
+            return 0
+
+    # Записи за день пользователя: проход по индексу (user_id, local_date, created_at)
+    # без сортировки; created_at — datetime
+    async def get_user_entries_by_date(self, user_id, day):
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    await cursor.execute(
+                        "SELECT id, activity_type, duration_minutes, created_at "
+                        "FROM time_entries "
+                        "WHERE user_id = %s AND local_date = %s "
+                        "ORDER BY created_at",
+                        (user_id, day)
+                    )
+                    return await cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Ошибка получения записей {user_id} за {day}: {e}")
+            return []
+
+    async def get_daily_report(self, user_id, day):
+        report = {activity_type: 0 for activity_type in ACTIVITY_TYPES}
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        "SELECT activity_type, total_minutes FROM daily_rollup "
+                        "WHERE user_id = %s AND day = %s",
+                        (user_id, day)
+                    )
+                    rows = await cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Ошибка получения отчета {user_id} за {day}: {e}")
+            return {}
+
+        for activity_type, total in rows:
+            report[activity_type] = int(total or 0)
+        return report
+
+    async def get_user_statistics(self, user_id, start_date, end_date):
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        "SELECT day, activity_type, total_minutes FROM daily_rollup "
+                        "WHERE user_id = %s AND day BETWEEN %s AND %s "
+                        "ORDER BY day",
+                        (user_id, start_date, end_date)
+                    )
+                    rows = await cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Ошибка получения статистики {user_id}: {e}")
+            return []
+
+        # Группируем строки по дням
+        stats = {}
+        for day, activity_type, total in rows:
+            day_stats = stats.setdefault(day, {'date': day})
+            day_stats[activity_type] = int(total or 0)
+        return list(stats.values())
+
+    # Отчет за период одним запросом: суммы по корзинам из bucket_days дней
+    # считаются в MySQL, поэтому число строк ответа не зависит от длины периода
+    # (год при bucket_days=12 — не больше 31 × 5 строк).
+    # Формат как у get_user_statistics; 'date' — первый день корзины.
+    async def get_range_report(self, user_id, start_date, end_date, bucket_days=1):
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        "SELECT DATEDIFF(day, %s) DIV %s AS bucket, activity_type, "
+                        "SUM(total_minutes) FROM daily_rollup "
+                        "WHERE user_id = %s AND day BETWEEN %s AND %s "
+                        "GROUP BY bucket, activity_type ORDER BY bucket",
+                        (start_date, bucket_days, user_id, start_date, end_date)
+                    )
+                    rows = await cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Ошибка получения отчета {user_id} за {start_date} - {end_date}: {e}")
+            return []
+
+        stats = {}
+        for bucket, activity_type, total in rows:
+            day = start_date + timedelta(days=int(bucket) * bucket_days)
+            day_stats = stats.setdefault(day, {'date': day})
+            day_stats[activity_type] = int(total or 0)
+        return list(stats.values())
+
+    # Импорт истории: rows — список (activity_type, duration_minutes, created_at, import_key),
+    # local_dates — дни записей в поясе пользователя (по умолчанию дни created_at).
+    # Записи с уже известным import_key пропускаются (INSERT IGNORE по уникальному
+    # ключу), поэтому повторная загрузка того же файла ничего не удваивает.
+    # Агрегаты за затронутые дни пересчитываются одним запросом в той же транзакции.
+    # Возвращает число действительно добавленных записей.
+    async def import_entries(self, user_id, rows, local_dates=None):
+        if not rows:
+            return 0
+        if local_dates is None:
+            local_dates = [created_at.date() for _, _, created_at, _ in rows]
+
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(
+                    "INSERT IGNORE INTO time_entries "
+                    "(user_id, activity_type, duration_minutes, created_at, import_key, local_date) "
+                    "VALUES (%s, %s, %s, %s, %s, %s)",
+                    [(user_id,) + row + (day,) for row, day in zip(rows, local_dates)]
+                )
+                inserted = cursor.rowcount
+                if inserted:
+                    await cursor.execute(
+                        "INSERT INTO daily_rollup "
+                        "(user_id, day, activity_type, total_minutes, entries_count) "
+                        "SELECT user_id, local_date, activity_type, "
+                        "SUM(duration_minutes), COUNT(*) "
+                        "FROM time_entries "
+                        "WHERE user_id = %s AND local_date BETWEEN %s AND %s "
+                        "GROUP BY user_id, local_date, activity_type "
+                        "ON DUPLICATE KEY UPDATE "
+                        "total_minutes = VALUES(total_minutes), "
+                        "entries_count = VALUES(entries_count)",
+                        (user_id, min(local_dates), max(local_dates))
+                    )
+            await conn.commit()
+        return inserted
+
+    # Потоковое чтение всей истории пользователя для выгрузки.
+    # Серверный курсор (SSCursor) не загружает результат целиком:
+    # строки приходят пачками по chunk_size, память не зависит от объема истории.
+    # Пока генератор не исчерпан, он держит одно соединение пула.
+    async def iter_user_entries(self, user_id, chunk_size=1000):
+        async with self.acquire() as conn:
+            async with conn.cursor(aiomysql.SSCursor) as cursor:
+                await cursor.execute(
+                    "SELECT id, activity_type, duration_minutes, created_at "
+                    "FROM time_entries WHERE user_id = %s "
+                    "ORDER BY created_at, id",
+                    (user_id,)
+                )
+                while True:
+                    rows = await cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+
+    # Записи пользователя по id (для импорта собственной выгрузки /export):
+    # {id: (activity_type, duration_minutes, created_at)}
+    async def get_entries_by_ids(self, user_id, entry_ids):
+        if not entry_ids:
+            return {}
+        placeholders = ', '.join(['%s'] * len(entry_ids))
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT id, activity_type, duration_minutes, created_at FROM time_entries "
+                    f"WHERE user_id = %s AND id IN ({placeholders})",
+                    (user_id,) + tuple(entry_ids)
+                )
+                rows = await cursor.fetchall()
+        return {entry_id: (activity_type, duration_minutes, created_at)
+                for entry_id, activity_type, duration_minutes, created_at in rows}
+
+    # Агрегаты сразу для пачки пользователей одним запросом:
+    # {user_id: [{'date': d, 'work': 60, ...}, ...]} в формате get_user_statistics
+    async def get_users_statistics(self, user_ids, start_date, end_date):
+        if not user_ids:
+            return {}
+        placeholders = ', '.join(['%s'] * len(user_ids))
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT user_id, day, activity_type, total_minutes FROM daily_rollup "
+                    f"WHERE user_id IN ({placeholders}) AND day BETWEEN %s AND %s "
+                    "ORDER BY user_id, day",
+                    tuple(user_ids) + (start_date, end_date)
+                )
+                rows = await cursor.fetchall()
+
+        stats = {}
+        for user_id, day, activity_type, total in rows:
+            user_days = stats.setdefault(user_id, {})
+            day_stats = user_days.setdefault(day, {'date': day})
+            day_stats[activity_type] = int(total or 0)
+        return {user_id: list(user_days.values()) for user_id, user_days in stats.items()}
+
+    # Недельные суммы всех пользователей по суточным агрегатам (индекс idx_day):
+    # [(понедельник, user_id, activity_type, минуты)]
+    async def get_weekly_totals(self, start_date, end_date):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT SUBDATE(day, WEEKDAY(day)) AS week, user_id, activity_type, "
+                    "SUM(total_minutes) FROM daily_rollup "
+                    "WHERE day BETWEEN %s AND %s "
+                    "GROUP BY week, user_id, activity_type",
+                    (start_date, end_date)
+                )
+                rows = await cursor.fetchall()
+        return [(week, user_id, activity_type, int(total or 0))
+                for week, user_id, activity_type, total in rows]
+
+    # --- Команды ---
+
+    async def get_user_team(self, user_id):
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("SELECT team FROM users WHERE user_id = %s", (user_id,))
+                    row = await cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Ошибка чтения команды {user_id}: {e}")
+            return None
+        return row[0] if row else None
+
+    # team=None — выйти из команды; пользователь уже должен существовать (create_user)
+    async def set_user_team(self, user_id, team):
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        "UPDATE users SET team = %s WHERE user_id = %s", (team, user_id)
+                    )
+                await conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка изменения команды {user_id}: {e}")
+            return False
+
+    async def get_team_members(self, team, limit=100):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT user_id, username FROM users WHERE team = %s "
+                    "ORDER BY user_id LIMIT %s",
+                    (team, limit)
+                )
+                return await cursor.fetchall()
+
+    # --- Гистограммы рейтинга ---
+
+    # rows — список (понедельник, ключ гистограммы, counts); недели раньше keep_from удаляются
+    async def save_sketches(self, shard, rows, keep_from):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                if rows:
+                    await cursor.executemany(
+                        "INSERT INTO activity_sketches (shard, week, sketch, counts) "
+                        "VALUES (%s, %s, %s, %s) "
+                        "ON DUPLICATE KEY UPDATE counts = VALUES(counts)",
+                        [(shard,) + row for row in rows]
+                    )
+                await cursor.execute(
+                    "DELETE FROM activity_sketches WHERE shard = %s AND week < %s",
+                    (shard, keep_from)
+                )
+            await conn.commit()
+
+    async def load_sketches(self, since):
+        # -> [(shard, понедельник, ключ гистограммы, counts)]
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT shard, week, sketch, counts FROM activity_sketches WHERE week >= %s",
+                    (since,)
+                )
+                return await cursor.fetchall()
+
+    # --- Таймеры ---
+
+    async def load_running_timers(self):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("SELECT user_id, activity_type, started_at FROM running_timers")
+                return await cursor.fetchall()
+
+    async def save_running_timers(self, rows):
+        # rows — список (user_id, activity_type, started_at)
+        if not rows:
+            return
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(
+                    "INSERT INTO running_timers (user_id, activity_type, started_at) "
+                    "VALUES (%s, %s, %s) "
+                    "ON DUPLICATE KEY UPDATE "
+                    "activity_type = VALUES(activity_type), started_at = VALUES(started_at)",
+                    rows
+                )
+            await conn.commit()
+
+    async def delete_running_timers(self, user_ids):
+        if not user_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(user_ids))
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    f"DELETE FROM running_timers WHERE user_id IN ({placeholders})",
+                    tuple(user_ids)
+                )
+            await conn.commit()
+
+    # --- Подписка на сводки ---
+
+    async def get_digest_settings(self, user_id):
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        "SELECT digest_daily, digest_weekly FROM users WHERE user_id = %s",
+                        (user_id,)
+                    )
+                    row = await cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Ошибка чтения подписки {user_id}: {e}")
+            return None
+        if row is None:
+            return {'daily': False, 'weekly': False}
+        return {'daily': bool(row[0]), 'weekly': bool(row[1])}
+
+    async def set_digest_settings(self, user_id, daily, weekly):
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        "UPDATE users SET digest_daily = %s, digest_weekly = %s "
+                        "WHERE user_id = %s",
+                        (int(daily), int(weekly), user_id)
+                    )
+                    updated = cursor.rowcount
+                await conn.commit()
+            return updated > 0
+        except Exception as e:
+            logger.error(f"Ошибка изменения подписки {user_id}: {e}")
+            return False
+
+    # --- Доставка сводок ---
+
+    # Строки доставки для всех подписчиков одним INSERT ... SELECT.
+    # Повторный вызов добавляет только новых подписчиков.
+    async def digest_prepare(self, kind, period, keep_days=30):
+        column = {'daily': 'digest_daily', 'weekly': 'digest_weekly'}[kind]
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "INSERT IGNORE INTO digest_deliveries (kind, period, user_id) "
+                    f"SELECT %s, %s, user_id FROM users WHERE {column} = 1",
+                    (kind, period)
+                )
+                added = cursor.rowcount
+                await cursor.execute(
+                    "DELETE FROM digest_deliveries WHERE period < %s",
+                    (period - timedelta(days=keep_days),)
+                )
+            await conn.commit()
+        return added
+
+    # Возврат строк процесса, который упал, не успев их обработать.
+    # Захваченные, но не начатые строки снова ждут отправки; строки в состоянии
+    # sending могли уже уйти в Telegram, поэтому они не повторяются.
+    async def digest_recover(self, kind, period, lease_seconds):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "UPDATE digest_deliveries SET status = 'pending', claimed_by = NULL "
+                    "WHERE kind = %s AND period = %s AND status = 'claimed' "
+                    "AND claimed_at < NOW() - INTERVAL %s SECOND",
+                    (kind, period, lease_seconds)
+                )
+                await cursor.execute(
+                    "UPDATE digest_deliveries SET status = 'failed' "
+                    "WHERE kind = %s AND period = %s AND status = 'sending' "
+                    "AND claimed_at < NOW() - INTERVAL %s SECOND",
+                    (kind, period, lease_seconds)
+                )
+            await conn.commit()
+
+    # Атомарный захват пачки ожидающих строк; token отличает процессы
+    async def digest_claim(self, kind, period, token, limit):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "UPDATE digest_deliveries "
+                    "SET status = 'claimed', claimed_by = %s, claimed_at = NOW() "
+                    "WHERE kind = %s AND period = %s AND status = 'pending' "
+                    "ORDER BY user_id LIMIT %s",
+                    (token, kind, period, limit)
+                )
+                await conn.commit()
+                await cursor.execute(
+                    "SELECT user_id FROM digest_deliveries "
+                    "WHERE kind = %s AND period = %s AND status = 'claimed' AND claimed_by = %s "
+                    "ORDER BY user_id",
+                    (kind, period, token)
+                )
+                rows = await cursor.fetchall()
+        return [user_id for (user_id,) in rows]
+
+    # Строки, которые еще предстоит отправить (ожидают или захвачены)
+    async def digest_remaining(self, kind, period):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT COUNT(*) FROM digest_deliveries "
+                    "WHERE kind = %s AND period = %s AND status IN ('pending', 'claimed')",
+                    (kind, period)
+                )
+                (count,) = await cursor.fetchone()
+        return count
+
+    # Переход claimed -> sending непосредственно перед отправкой.
+    # False, если строку уже забрал другой процесс.
+    async def digest_begin_send(self, kind, period, user_id, token):
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "UPDATE digest_deliveries SET status = 'sending' "
+                    "WHERE kind = %s AND period = %s AND user_id = %s "
+                    "AND status = 'claimed' AND claimed_by = %s",
+                    (kind, period, user_id, token)
+                )
+                started = cursor.rowcount
+            await conn.commit()
+        return started > 0
+
+    async def digest_finish(self, kind, period, user_ids, status):
+        if not user_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(user_ids))
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "UPDATE digest_deliveries SET status = %s, sent_at = NOW() "
+                    f"WHERE kind = %s AND period = %s AND user_id IN ({placeholders})",
+                    (status, kind, period) + tuple(user_ids)
+                )
+            await conn.commit()
+
+    # Полная пересборка агрегатов по сырым записям (для существующих данных)
+    async def rebuild_rollup(self, user_id=None):
+        where = "WHERE user_id = %s" if user_id is not None else ""
+        params = (user_id,) if user_id is not None else ()
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(f"DELETE FROM daily_rollup {where}", params)
+                await cursor.execute(
+                    "INSERT INTO daily_rollup "
+                    "(user_id, day, activity_type, total_minutes, entries_count) "
+                    "SELECT user_id, local_date, activity_type, "
+                    "SUM(duration_minutes), COUNT(*) "
+                    f"FROM time_entries {where} "
+                    "GROUP BY user_id, local_date, activity_type",
+                    params
+                )
+                rows = cursor.rowcount
+            await conn.commit()
+        logger.info(f"Агрегаты пересобраны: {rows} строк")
+        return rows
+
+    # Сверка агрегатов с сырыми записями.
+    # Возвращает расхождения: (user_id, day, activity_type, ожидалось, в агрегате)
+    async def check_rollup(self, user_id=None):
+        where = "WHERE user_id = %s" if user_id is not None else ""
+        rollup_where = "AND r.user_id = %s" if user_id is not None else ""
+        params = (user_id,) if user_id is not None else ()
+        aggregated = (
+            "SELECT user_id, local_date AS day, activity_type, "
+            "SUM(duration_minutes) AS total "
+            f"FROM time_entries {where} "
+            "GROUP BY user_id, local_date, activity_type"
+        )
+        async with self.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT r.user_id, r.day, r.activity_type, e.total, r.total_minutes "
+                    f"FROM daily_rollup r LEFT JOIN ({aggregated}) e "
+                    "ON e.user_id = r.user_id AND e.day = r.day "
+                    "AND e.activity_type = r.activity_type "
+                    "WHERE (e.total IS NULL OR e.total <> r.total_minutes) "
+                    f"{rollup_where} "
+                    "UNION ALL "
+                    "SELECT e.user_id, e.day, e.activity_type, e.total, NULL "
+                    f"FROM ({aggregated}) e LEFT JOIN daily_rollup r "
+                    "ON e.user_id = r.user_id AND e.day = r.day "
+                    "AND e.activity_type = r.activity_type "
+                    "WHERE r.user_id IS NULL",
+                    params + params + params
+                )
+                rows = await cursor.fetchall()
+
+        return [
+            (row_user, day, activity_type, int(expected or 0), int(actual or 0))
+            for row_user, day, activity_type, expected, actual in rows
+        ]
@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+from async_database import ACTIVITY_TYPES, AsyncDatabase
+from benchmarks.fakes import MemoryDatabase
+from benchmarks.load_test import percentile, seed_entries, seed_mysql
+from sqlite_database import SQLiteDatabase
+
+USER_BASE = 2000000
+
+
+# --- Операции: одна и та же нагрузка через публичный интерфейс базы ---
+
+async def op_add_entry(db, user_id, rng):
+    await db.add_time_entry(user_id, rng.choice(ACTIVITY_TYPES), rng.randint(5, 120))
+
+
+async def op_add_batch(db, user_id, rng):
+    await db.add_time_entries([
+        (user_id, rng.choice(ACTIVITY_TYPES), rng.randint(5, 120)) for _ in range(50)
+    ])
+
+
+async def op_entries_by_date(db, user_id, rng):
+    await db.get_user_entries_by_date(user_id, date.today() - timedelta(days=rng.randint(1, 30)))
+
+
+async def op_daily_report(db, user_id, rng):
+    await db.get_daily_report(user_id, date.today() - timedelta(days=rng.randint(1, 30)))
+
+
+async def op_statistics(db, user_id, rng):
+    end_date = date.today()
+    await db.get_user_statistics(user_id, end_date - timedelta(days=29), end_date)
+
+
+async def op_range_year(db, user_id, rng):
+    end_date = date.today()
+    await db.get_range_report(user_id, end_date - timedelta(days=364), end_date, 12)
+
+
+async def op_export(db, user_id, rng):
+    async for _ in db.iter_user_entries(user_id, 1000):
+        pass
+
+
+OPERATIONS = {
+    'add_entry': (op_add_entry, 1),
+    'add_batch_50': (op_add_batch, 0.1),
+    'entries_by_date': (op_entries_by_date, 1),
+    'daily_report': (op_daily_report, 1),
+    'statistics_30d': (op_statistics, 1),
+    'range_year': (op_range_year, 0.5),
+    'export': (op_export, 0.05),
+}
+
+
+def create_backend(name, args, directory):
+    if name == 'memory':
+        return MemoryDatabase(latency=0.0, max_connections=args.concurrency)
+    if name == 'sqlite':
+        return SQLiteDatabase(f"{directory}/bench.db", readers=args.sqlite_readers)
+    import config
+    return AsyncDatabase(
+        host=config.MYSQL_HOST,
+        user=config.MYSQL_USER,
+        password=config.MYSQL_PASSWORD,
+        database=config.MYSQL_DATABASE,
+        pool_size=args.concurrency
+    )
+
+
+async def run_operation(db, func, count, users, args):
+    # count вызовов с concurrency одновременными клиентами
+    rng = random.Random(args.seed)
+    latencies = []
+    remaining = list(range(count))
+
+    async def client():
+        while remaining:
+            remaining.pop()
+            user_id = rng.choice(users)
+            started = time.perf_counter()
+            await func(db, user_id, rng)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'ops_per_sec': count / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+    }
+
+
+async def bench_backend(name, args):
+    users = [USER_BASE + i for i in range(args.users)]
+    with tempfile.TemporaryDirectory() as directory:
+        db = create_backend(name, args, directory)
+        await db.connect()
+        try:
+            started = time.perf_counter()
+            if name == 'mysql':
+                await seed_mysql(db, users, args.days, args.entries, args.seed)
+            elif name == 'memory':
+                for user_id in users:
+                    db.seed(user_id, args.days, args.entries)
+            else:
+                await seed_entries(db, users, args.days, args.entries, args.seed)
+            print(f"{name}: история {args.users} × {args.days} дн. загружена "
+                  f"за {time.perf_counter() - started:.1f} с")
+
+            results = {}
+            for op_name in args.ops:
+                func, share = OPERATIONS[op_name]
+                results[op_name] = await run_operation(
+                    db, func, max(1, int(args.count * share)), users, args
+                )
+            return results
+        finally:
+            await db.close()
+
+
+def print_results(all_results):
+    backends = list(all_results)
+    header = f"{'операция':>16}" + ''.join(f" {name + ' ops/s':>14} {'p95, мс':>8}" for name in backends)
+    print('\n' + header)
+    for op_name in next(iter(all_results.values())):
+        line = f"{op_name:>16}"
+        for name in backends:
+            result = all_results[name][op_name]
+            line += f" {result['ops_per_sec']:>14.0f} {result['p95_ms']:>8.2f}"
+        print(line)
+
+
+async def main(args):
+    all_results = {}
+    for name in args.backend:
+        try:
+            all_results[name] = await bench_backend(name, args)
+        except Exception as e:
+            print(f"{name}: пропущен ({e})")
+    if not all_results:
+        return 1
+    print_results(all_results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': all_results}, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Сравнение движков базы на одной нагрузке")
+    parser.add_argument('--backend', nargs='+', choices=('memory', 'sqlite', 'mysql'),
+                        default=['sqlite', 'mysql'],
+                        help="mysql — база из config (данные тестовых пользователей перезаписываются)")
+    parser.add_argument('--ops', nargs='+', choices=list(OPERATIONS), default=list(OPERATIONS))
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--days', type=int, default=365, help="Дней истории пользователя")
+    parser.add_argument('--entries', type=int, default=5, help="Записей в день")
+    parser.add_argument('--count', type=int, default=2000, help="Вызовов основной операции")
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--sqlite-readers', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(main(args)))
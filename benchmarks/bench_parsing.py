@@ -0,0 +1,162 @@
+import argparse
+import random
+import re
+import timeit
+from datetime import date, datetime, timedelta
+
+from activities import ACTIVITY_MAP, is_valid_duration
+from parsing import RELATIVE_DAYS, parse_date, parse_duration, parse_entries
+from reports import format_duration
+
+# Прежние функции из activities.py — эталон для сравнения и проверки
+LEGACY_DATE_FORMATS = ('%d.%m.%Y', '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%y', '%d-%m-%y', '%d/%m/%y')
+
+
+def legacy_parse_duration(text):
+    text = text.strip()
+    if ':' in text:
+        parts = text.split(':')
+        if len(parts) == 2:
+            hours = int(parts[0]) if parts[0] else 0
+            minutes = int(parts[1]) if parts[1] else 0
+            return hours * 60 + minutes
+        return int(text)
+    if '.' in text or ',' in text:
+        return int(float(text.replace(',', '.')) * 60)
+    return int(text)
+
+
+def legacy_parse_date(text):
+    text = text.strip().lower()
+    if text in RELATIVE_DAYS:
+        return date.today() - timedelta(days=RELATIVE_DAYS[text])
+    for date_format in LEGACY_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError("Неверный формат даты")
+
+
+DURATION_SAMPLES = ('90', '1.5', '1,5', '1:30', ' 45 ', '120', 'abc', '1:2:3')
+DATE_SAMPLES = ('25.12.2023', '25/12/23', '1-1-2024', 'вчера', 'сегодня', '31.02.2023', 'завтра')
+
+
+def _call(func, text):
+    try:
+        return func(text)
+    except ValueError:
+        return ValueError
+
+
+# --- Бенчмарк ---
+
+def measure(func, samples, repeat):
+    # Лучшее из repeat измерений, микросекунды на один разбор
+    def run():
+        for text in samples:
+            _call(func, text)
+    number = 2000
+    best = min(timeit.repeat(run, number=number, repeat=repeat))
+    return best / number / len(samples) * 1e6
+
+
+def bench(args):
+    line = 'работа 2ч, учеба 45м, отдых 1:30'
+    print(f"{'разбор':>14} {'было, мкс':>10} {'стало, мкс':>11} {'ускорение':>10}")
+    for name, legacy, current, samples in (
+        ('duration', legacy_parse_duration, parse_duration, DURATION_SAMPLES),
+        ('date', legacy_parse_date, parse_date, DATE_SAMPLES),
+    ):
+        before = measure(legacy, samples, args.repeat)
+        after = measure(current, samples, args.repeat)
+        print(f"{name:>14} {before:>10.2f} {after:>11.2f} {before / after:>10.2f}")
+    entries = measure(parse_entries, (line,), args.repeat)
+    print(f"{'entries (3)':>14} {'-':>10} {entries:>11.2f}")
+
+
+# --- Фаззинг ---
+
+ALPHABET = '0123456789.,:/- чмhm' + 'вчерасегодняпоз'
+UNITS_RE = re.compile('[чмhm]')
+
+
+def random_text(rng):
+    # Смесь случайных символов и почти правильного ввода
+    kind = rng.random()
+    if kind < 0.3:
+        return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 12)))
+    if kind < 0.6:
+        sep = rng.choice('./-')
+        year = rng.choice((f"{rng.randint(0, 99):02d}", str(rng.randint(1900, 2099))))
+        return f"{rng.randint(0, 32)}{sep}{rng.randint(0, 13)}{sep}{year}"
+    hours, minutes = rng.randint(0, 30), rng.randint(0, 99)
+    return rng.choice((
+        f"{hours}", f"{hours}:{minutes}", f"{hours}.{minutes}", f"{hours},{minutes}",
+        f" {minutes} ", f"{hours}:", f":{minutes}", f".{minutes}",
+    ))
+
+
+def random_line(rng):
+    # Строка из нескольких записей и ожидаемый результат разбора
+    names = list(ACTIVITY_MAP)
+    entries = []
+    parts = []
+    for _ in range(rng.randint(1, 5)):
+        button = rng.choice(names)
+        activity = rng.choice((button, button.split(' ', 1)[1], ACTIVITY_MAP[button]))
+        minutes = rng.randint(1, 1440)
+        text = rng.choice((format_duration(minutes), f"{minutes}", f"{minutes // 60}:{minutes % 60:02d}"))
+        if rng.random() < 0.5:
+            activity = activity.upper()
+        entries.append((ACTIVITY_MAP[button], minutes))
+        parts.append(f"{activity}{rng.choice((' ', ': ', ' - '))}{text}")
+    return rng.choice((', ', '; ', '\n', ',')).join(parts), entries
+
+
+def _duration_outcome(func, text):
+    # Бот одинаково отклоняет неверный формат и время вне диапазона
+    minutes = _call(func, text)
+    if minutes is ValueError or not is_valid_duration(minutes):
+        return ValueError
+    return minutes
+
+
+def fuzz(args):
+    rng = random.Random(args.seed)
+    mismatches = 0
+    for _ in range(args.iterations):
+        text = random_text(rng)
+        checks = [(legacy_parse_date, parse_date, _call)]
+        # «1ч», «45м» прежняя функция не понимала — сравнивать не с чем
+        if not UNITS_RE.search(text):
+            checks.append((legacy_parse_duration, parse_duration, _duration_outcome))
+        for legacy, current, outcome in checks:
+            expected, actual = outcome(legacy, text), outcome(current, text)
+            if expected != actual:
+                mismatches += 1
+                if mismatches <= 20:
+                    print(f"{current.__name__}({text!r}): было {expected!r}, стало {actual!r}")
+
+        line, expected = random_line(rng)
+        actual = _call(parse_entries, line)
+        if actual != expected:
+            mismatches += 1
+            if mismatches <= 20:
+                print(f"parse_entries({line!r}): ожидалось {expected!r}, получено {actual!r}")
+
+    print(f"Проверено {args.iterations} наборов, расхождений: {mismatches}")
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Скорость и проверка разбора ввода")
+    parser.add_argument('--fuzz', action='store_true',
+                        help="Сравнить с прежними функциями на случайном вводе")
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    if args.fuzz:
+        raise SystemExit(1 if fuzz(args) else 0)
+    bench(args)
@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import bisect
+import random
+import time
+from datetime import date
+
+from async_database import ACTIVITY_TYPES
+from benchmarks.fakes import MemoryDatabase
+from leaderboard import TOTAL, ActivityRanking
+
+
+# Поток записей за неделю: у пользователей разная активность (лог-нормальное
+# число записей), чтобы распределение недельных сумм было неравномерным
+def generate_entries(users, entries, seed):
+    rng = random.Random(seed)
+    weights = [rng.lognormvariate(0, 1) for _ in range(users)]
+    user_ids = rng.choices(range(1, users + 1), weights=weights, k=entries)
+    return [
+        (user_id, rng.choice(ACTIVITY_TYPES), rng.randint(5, 240))
+        for user_id in user_ids
+    ]
+
+
+def exact_percent(sorted_totals, minutes):
+    # Та же формула, что и в ActivityRanking.rank, но по точным суммам
+    below = bisect.bisect_left(sorted_totals, minutes)
+    equal = bisect.bisect_right(sorted_totals, minutes) - below
+    return min(100.0, max(0.0, (below + equal / 2 - 0.5) * 100 / max(len(sorted_totals) - 1, 1)))
+
+
+async def main(args):
+    today = date.today()
+    ranking = ActivityRanking(MemoryDatabase())
+    entries = generate_entries(args.users, args.entries, args.seed)
+
+    started = time.perf_counter()
+    for user_id, activity_type, minutes in entries:
+        ranking.entry_added(user_id, activity_type, minutes, today)
+    elapsed = time.perf_counter() - started
+    print(f"обновление: {len(entries) / elapsed:,.0f} записей/с")
+
+    week = ranking.weeks[max(ranking.weeks)]
+    user_ids = list(week.totals)
+    rng = random.Random(args.seed)
+    lookups = [rng.choice(user_ids) for _ in range(args.lookups)]
+    started = time.perf_counter()
+    for user_id in lookups:
+        ranking.rank(user_id, today)
+    elapsed = time.perf_counter() - started
+    print(f"запрос /rank: {len(lookups) / elapsed:,.0f} в секунду")
+
+    # Погрешность процента по сравнению с точным расчетом по всем суммам
+    totals = {user_id: sum(values.values()) for user_id, values in week.totals.items()}
+    sorted_totals = sorted(totals.values())
+    errors = sorted(
+        abs(ranking.rank(user_id, today)[1][TOTAL][1] - exact_percent(sorted_totals, totals[user_id]))
+        for user_id in user_ids
+    )
+    print(f"пользователей: {len(user_ids)}, ошибка процента: "
+          f"медиана {errors[len(errors) // 2]:.2f}, максимум {errors[-1]:.2f} п.п.")
+    if args.max_error is not None and errors[-1] > args.max_error:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Скорость и точность рейтинга /rank")
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--entries', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-error', type=float, help="Код 1, если ошибка процента больше (п.п.)")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(main(args)))
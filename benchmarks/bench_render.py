@@ -0,0 +1,98 @@
+import argparse
+import json
+import random
+import timeit
+from datetime import datetime, timedelta
+
+from async_database import ACTIVITY_TYPES
+from reports import today_text
+
+
+def make_entries(count, seed=0):
+    # Записи за сегодня в виде результата get_user_entries_by_date
+    rng = random.Random(seed)
+    start = datetime.combine(datetime.now().date(), datetime.min.time())
+    entries = []
+    for i in range(count):
+        created_at = start + timedelta(seconds=rng.randint(0, 86399))
+        entries.append({
+            'id': i + 1,
+            'activity_type': rng.choice(ACTIVITY_TYPES),
+            'duration_minutes': rng.randint(1, 240),
+            'created_at': created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        })
+    entries.sort(key=lambda entry: entry['created_at'])
+    return entries
+
+
+# Прежний код cmd_today для сравнения: словарь названий на каждый вызов,
+# разбор времени через strptime и сборка строки через +=
+def legacy_today_text(entries):
+    message_text = "📊 <b>Сегодняшние активности:</b>\n\n"
+    total_minutes = 0
+
+    activity_names = {
+        "work": "💼 Работа",
+        "sleep": "😴 Сон",
+        "rest": "🎯 Отдых",
+        "study": "📚 Учеба",
+        "entertainment": "🎮 Развлечения"
+    }
+
+    for entry in entries:
+        activity_type = entry['activity_type']
+        duration = entry['duration_minutes']
+        created_at = entry['created_at']
+
+        hours = duration // 60
+        minutes = duration % 60
+
+        activity_name = activity_names.get(activity_type, activity_type)
+        time_str = f"{hours}ч {minutes}м" if hours > 0 else f"{minutes}м"
+
+        try:
+            created_time = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S')
+            time_display = created_time.strftime('%H:%M')
+        except:
+            time_display = created_at.split(' ')[1][:5] if ' ' in created_at else created_at[:5]
+
+        message_text += f"• {activity_name}: <b>{time_str}</b> (в {time_display})\n"
+        total_minutes += duration
+
+    total_hours = total_minutes // 60
+    total_minutes_remain = total_minutes % 60
+
+    message_text += f"\n⏱️ <b>Всего:</b> {total_hours}ч {total_minutes_remain}м"
+    return message_text
+
+
+def measure(func, entries, repeat):
+    # Лучшее из repeat измерений, микросекунды на один вызов
+    number = max(1, 20000 // len(entries))
+    best = min(timeit.repeat(lambda: func(entries), number=number, repeat=repeat))
+    return best / number * 1e6
+
+
+def main(args):
+    results = []
+    print(f"{'записей':>8} {'было, мкс':>10} {'стало, мкс':>11} {'ускорение':>10}")
+    for count in args.entries:
+        entries = make_entries(count)
+        assert legacy_today_text(entries) == today_text(entries)
+        legacy = measure(legacy_today_text, entries, args.repeat)
+        current = measure(today_text, entries, args.repeat)
+        results.append({'entries': count, 'legacy_us': legacy, 'current_us': current})
+        print(f"{count:>8} {legacy:>10.1f} {current:>11.1f} {legacy / current:>10.2f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Стоимость построения текста /today")
+    parser.add_argument('--entries', type=int, nargs='+', default=[5, 500],
+                        help="Число записей за день")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help="Сохранить результаты в JSON")
+    main(parser.parse_args())
@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from supervisor import BotWorkerApp, Supervisor
+
+ACTIVITIES = ('work', 'sleep', 'rest', 'study', 'entertainment')
+
+
+# Воркер без Telegram и БД: имитирует CPU-нагрузку форматирования отчета
+class CpuWorkerApp:
+    async def startup(self):
+        pass
+
+    async def process(self, update):
+        rng = random.Random(update['update_id'])
+        lines = []
+        for day in range(update.get('days', 30)):
+            totals = {activity: rng.randint(0, 600) for activity in ACTIVITIES}
+            total = sum(totals.values()) or 1
+            for activity, minutes in sorted(totals.items(), key=lambda x: x[1], reverse=True):
+                lines.append(
+                    f"{day:02d} {activity}: <b>{minutes // 60}ч {minutes % 60}м</b> "
+                    f"({minutes / total * 100:.1f}%)"
+                )
+        return '\n'.join(lines)
+
+    async def shutdown(self):
+        pass
+
+
+# Настоящий воркер бота (on_startup с пулом отрисовки, таймерами и т.д.)
+# поверх фейкового Bot API и общего файла SQLite. Воркеры запускаются
+# через spawn, поэтому настройки передаются переменными окружения
+class BotBenchApp(BotWorkerApp):
+    async def startup(self):
+        import config
+        config.TELEGRAM_API_SERVER = os.environ['BENCH_API_SERVER']
+        config.DB_BACKEND = 'sqlite'
+        config.SQLITE_PATH = os.environ['BENCH_SQLITE_PATH']
+        config.FSM_STORAGE = 'memory'
+        config.METRICS_ENABLED = False
+        config.DIGEST_ENABLED = False
+        # Меряем бота, а не ограничения Telegram
+        config.SEND_GLOBAL_RATE = 100000
+        config.SEND_CHAT_RATE = 100000.0
+        config.SEND_CHAT_BURST = 100000
+        await super().startup()
+
+
+APPS = {
+    'cpu': 'benchmarks.bench_sharding:CpuWorkerApp',
+    'bot': 'benchmarks.bench_sharding:BotBenchApp',
+}
+
+
+def make_bot_updates(fake, count, users):
+    rng = random.Random(0)
+    commands = ('/stats', '/week', '/today', 'работа 30м')
+    updates = []
+    for update_id in range(count):
+        update = fake.message_update(rng.randint(1, users), rng.choice(commands))
+        update['update_id'] = update_id
+        updates.append(update)
+    return updates
+
+
+def make_updates(count, users, days):
+    updates = []
+    for update_id in range(count):
+        user_id = random.randint(1, users)
+        updates.append({
+            'update_id': update_id,
+            'days': days,
+            'message': {'from': {'id': user_id}, 'text': '/stats'},
+        })
+    return updates
+
+
+async def wait_ready(supervisor, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        supervisor.collect_status()
+        if len(supervisor.health) == supervisor.workers:
+            return
+        await asyncio.sleep(0.05)
+    raise TimeoutError("Воркеры не запустились")
+
+
+async def run_once(workers, updates, app_path):
+    supervisor = Supervisor(
+        workers=workers,
+        app_path=app_path,
+        heartbeat_interval=0.05
+    )
+    supervisor.start()
+    try:
+        await wait_ready(supervisor)
+        started = time.perf_counter()
+        for update in updates:
+            await supervisor.dispatch(update)
+        while True:
+            report = supervisor.check_workers()
+            if not all(state['alive'] for state in report):
+                raise RuntimeError("Воркер завершился во время прогона")
+            done = sum(state['processed'] + state['failed'] for state in supervisor.health.values())
+            if done >= len(updates):
+                break
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        failed = sum(state['failed'] for state in supervisor.health.values())
+    finally:
+        supervisor.stop()
+    return elapsed, failed
+
+
+async def main(args):
+    fake = None
+    if args.app == 'bot':
+        from fake_telegram import FakeTelegram
+        fake = FakeTelegram(port=args.api_port)
+        await fake.start()
+        sqlite_dir = tempfile.TemporaryDirectory()
+        os.environ['BENCH_API_SERVER'] = fake.base_url
+        os.environ['BENCH_SQLITE_PATH'] = f"{sqlite_dir.name}/bench_sharding.db"
+        updates = make_bot_updates(fake, args.updates, args.users)
+    else:
+        updates = make_updates(args.updates, args.users, args.days)
+
+    results = []
+    baseline = None
+    status = 0
+    print(f"{'воркеры':>8} {'время, с':>10} {'upd/s':>10} {'ускорение':>10} {'ошибки':>7}")
+    try:
+        for workers in range(1, args.max_workers + 1):
+            elapsed, failed = await run_once(workers, updates, APPS[args.app])
+            throughput = len(updates) / elapsed
+            baseline = baseline or throughput
+            results.append({'workers': workers, 'elapsed': elapsed, 'throughput': throughput,
+                            'failed': failed})
+            print(f"{workers:>8} {elapsed:>10.2f} {throughput:>10.1f} "
+                  f"{throughput / baseline:>10.2f} {failed:>7}")
+            if failed:
+                status = 1
+    finally:
+        if fake is not None:
+            await fake.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return status
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Масштабирование супервизора по числу воркеров")
+    parser.add_argument('--app', choices=sorted(APPS), default='cpu',
+                        help="bot — настоящий запуск bot.py (фейковый Bot API и SQLite)")
+    parser.add_argument('--max-workers', type=int, default=4)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=30, help="Дней в «отчете» одного обновления")
+    parser.add_argument('--api-port', type=int, default=8082)
+    parser.add_argument('--output', help="Сохранить результаты в JSON")
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
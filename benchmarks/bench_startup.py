@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+USER_ID = 1000
+
+
+# --- Холодный запуск: выполняется в отдельном процессе ---
+# Тяжелые модули импортируются внутри функций, чтобы «import bot»
+# измерялся в чистом процессе
+
+async def measure_first_requests(app, fake):
+    from aiogram import types
+
+    # Первые запросы сразу после запуска: отчет с диаграммой и статистика
+    await app.db.add_time_entry(USER_ID, 'work', 90)
+    timings = {}
+    for label, texts in (
+        ('first_report', ('/report', 'сегодня')),
+        ('first_stats', ('/stats',)),
+        ('second_stats', ('/stats',)),
+    ):
+        started = time.perf_counter()
+        for text in texts:
+            update = fake.message_update(USER_ID, text)
+            await asyncio.create_task(app.dp.updates_handler.notify(types.Update(**update)))
+        timings[label] = time.perf_counter() - started
+    return timings
+
+
+async def cold_start(args):
+    import config
+    config.TELEGRAM_API_SERVER = f"http://127.0.0.1:{args.api_port}"
+    config.FSM_STORAGE = 'memory'
+    config.METRICS_ENABLED = False
+    # Меряем бота, а не ограничения Telegram
+    config.SEND_GLOBAL_RATE = 100000
+    config.SEND_CHAT_RATE = 100000.0
+    config.SEND_CHAT_BURST = 100000
+
+    started = time.perf_counter()
+    import bot as app
+    timings = {'import': time.perf_counter() - started}
+
+    from aiogram import Bot, Dispatcher
+    from benchmarks.fakes import MemoryDatabase
+    from fake_telegram import FakeTelegram
+    fake = FakeTelegram(port=args.api_port)
+    await fake.start()
+    app.db.db = app.ranking.db = MemoryDatabase()
+
+    Bot.set_current(app.dp.bot)
+    Dispatcher.set_current(app.dp)
+    started = time.perf_counter()
+    await app.on_startup(app.dp)
+    timings['on_startup'] = time.perf_counter() - started
+    try:
+        # Пауза до первых запросов: за нее успевают прогреться процессы отрисовки
+        await asyncio.sleep(args.delay)
+        timings.update(await measure_first_requests(app, fake))
+    finally:
+        await app.on_shutdown(app.dp)
+        session = await app.bot.get_session()
+        await session.close()
+        await fake.stop()
+    return timings
+
+
+def run_child(args):
+    command = [sys.executable, '-m', 'benchmarks.bench_startup', '--child',
+               '--api-port', str(args.api_port), '--delay', str(args.delay)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+# --- Профиль импорта: python -X importtime ---
+
+def import_profile(limit):
+    command = [sys.executable, '-X', 'importtime', '-c', 'import bot']
+    stderr = subprocess.run(command, check=True, capture_output=True, text=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # «import time:  свое | всего | модуль», вложенность — отступом имени
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((int(cumulative_us) / 1000, int(self_us) / 1000, depth, name.strip()))
+
+    total = next(cumulative for cumulative, _, _, name in modules if name == 'bot')
+    print(f"Импорт bot: {total:.0f} мс\n")
+    print(f"{'модуль':<40} {'всего, мс':>10} {'свой, мс':>9}")
+    # Модули, импортированные bot.py напрямую, — то, что можно отложить
+    direct = sorted((m for m in modules if m[2] == 1), reverse=True)
+    for cumulative, self_ms, _, name in direct[:limit]:
+        print(f"{name:<40} {cumulative:>10.1f} {self_ms:>9.1f}")
+
+
+def main(args):
+    if args.imports:
+        import_profile(args.limit)
+        return 0
+
+    runs = [run_child(args) for _ in range(args.runs)]
+    print(f"{'этап':>14} {'медиана, мс':>12} {'макс, мс':>9}")
+    for label in runs[0]:
+        values = [run[label] * 1000 for run in runs]
+        print(f"{label:>14} {statistics.median(values):>12.1f} {max(values):>9.1f}")
+    cold = statistics.median(run['import'] + run['on_startup'] for run in runs)
+    print(f"\nХолодный запуск (импорт + on_startup): {cold:.2f} с")
+    if args.max_seconds and cold > args.max_seconds:
+        print(f"❌ Дольше {args.max_seconds} с")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Время запуска бота и первых запросов")
+    parser.add_argument('--imports', action='store_true',
+                        help="Профиль импорта модулей (python -X importtime)")
+    parser.add_argument('--limit', type=int, default=20, help="Строк в профиле импорта")
+    parser.add_argument('--runs', type=int, default=5, help="Холодных запусков")
+    parser.add_argument('--max-seconds', type=float, default=0.0,
+                        help="Код возврата 1, если запуск дольше")
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help="Секунд между запуском и первыми запросами")
+    parser.add_argument('--api-port', type=int, default=8094)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(asyncio.run(cold_start(args))))
+        raise SystemExit(0)
+    raise SystemExit(main(args))
@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+
+from aiogram.utils.exceptions import RetryAfter
+
+from benchmarks.fakes import MemoryDatabase
+from exporter import export_user_entries
+from importer import import_csv
+from sender import OutboundScheduler
+from sqlite_database import SQLiteDatabase
+from timers import TimerService
+from timezones import get_zone, to_server
+from user_cache import UserDataCache
+
+USER_ID = 3000000
+
+
+# База, чтение которой отдает снимок сразу, а возвращает его с задержкой:
+# запись успевает пройти между снимком и сохранением его в кэш
+class SlowReadDatabase(MemoryDatabase):
+    def __init__(self, read_delay):
+        super().__init__()
+        self.read_delay = read_delay
+
+    async def get_daily_report(self, user_id, day):
+        report = await super().get_daily_report(user_id, day)
+        await asyncio.sleep(self.read_delay)
+        return report
+
+    async def get_user_entries_by_date(self, user_id, day):
+        entries = await super().get_user_entries_by_date(user_id, day)
+        await asyncio.sleep(self.read_delay)
+        return entries
+
+    async def get_user_statistics(self, user_id, start_date, end_date):
+        stats = await super().get_user_statistics(user_id, start_date, end_date)
+        await asyncio.sleep(self.read_delay)
+        return stats
+
+
+# База, в которой запись времени перестает проходить после fail_after записей
+class FailingEntryDatabase(MemoryDatabase):
+    def __init__(self, fail_after):
+        super().__init__()
+        self.fail_after = fail_after
+
+    async def add_time_entry(self, user_id, activity_type, duration_minutes, created_at=None,
+                             local_date=None):
+        if self.fail_after <= 0:
+            return None
+        self.fail_after -= 1
+        return await super().add_time_entry(user_id, activity_type, duration_minutes,
+                                            created_at, local_date)
+
+
+# Бот, который на первую отправку отвечает флуд-лимитом
+class FloodOnceBot:
+    def __init__(self):
+        self.sent = []
+        self.attempt = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if not self.attempt.is_set():
+            self.attempt.set()
+            await self.release.wait()
+            raise RetryAfter(1)
+        self.sent.append(text)
+        return text
+
+
+# --- Проверки: None — без расхождений, иначе текст ошибки ---
+
+async def check_cache_race():
+    # Промах кэша не должен затирать запись, сделанную во время чтения
+    today = date.today()
+    readers = {
+        'daily_report': lambda cache: cache.get_daily_report(USER_ID, today),
+        'entries_by_date': lambda cache: cache.get_user_entries_by_date(USER_ID, today),
+        'statistics': lambda cache: cache.get_user_statistics(USER_ID, today, today),
+    }
+    for name, read in readers.items():
+        database = SlowReadDatabase(read_delay=0.05)
+        cache = UserDataCache(database)
+        await cache.create_user(USER_ID, 'check')
+        await cache.add_time_entry(USER_ID, 'work', 30)
+
+        in_flight = asyncio.create_task(read(cache))
+        await asyncio.sleep(0.01)
+        await cache.add_time_entry(USER_ID, 'work', 30)
+        await in_flight
+
+        cached = (await cache.get_daily_report(USER_ID, today))['work']
+        stored = (await database.get_daily_report(USER_ID, today))['work']
+        if cached != stored:
+            return f"{name}: в кэше {cached} мин, в базе {stored} мин"
+    return None
+
+
+async def check_export_roundtrip():
+    # Импорт собственной выгрузки /export не должен удваивать историю
+    with tempfile.TemporaryDirectory() as directory:
+        backends = {
+            'memory': MemoryDatabase(),
+            'sqlite': SQLiteDatabase(os.path.join(directory, 'check.db')),
+        }
+        for name, database in backends.items():
+            await database.connect()
+            try:
+                cache = UserDataCache(database)
+                await cache.create_user(USER_ID, 'check')
+                await cache.add_time_entry(USER_ID, 'work', 30)
+                await cache.add_time_entry(USER_ID, 'work', 30)
+                await cache.add_time_entry(USER_ID, 'study', 45,
+                                           datetime.now() - timedelta(days=3))
+                end_date = date.today()
+                start_date = end_date - timedelta(days=7)
+                before = await database.get_user_statistics(USER_ID, start_date, end_date)
+
+                path, _, _ = await export_user_entries(cache, USER_ID)
+                try:
+                    progress = await import_csv(cache, USER_ID, path)
+                finally:
+                    os.remove(path)
+                after = await database.get_user_statistics(USER_ID, start_date, end_date)
+                if progress.inserted or after != before:
+                    return f"{name}: добавлено {progress.inserted}, было {before}, стало {after}"
+            finally:
+                await database.close()
+    return None
+
+
+async def check_retry_coalesce():
+    # Сообщение, отложенное флуд-лимитом, по-прежнему заменяется новым с тем же ключом
+    for newer_during_attempt in (True, False):
+        bot = FloodOnceBot()
+        scheduler = OutboundScheduler(bot, global_rate=1000, chat_rate=1000.0, chat_burst=1000)
+        old = asyncio.create_task(scheduler.send_message(USER_ID, 'old', key='timer'))
+        await bot.attempt.wait()
+        if newer_during_attempt:
+            new = asyncio.create_task(scheduler.send_message(USER_ID, 'new', key='timer'))
+            await asyncio.sleep(0)
+            bot.release.set()
+        else:
+            bot.release.set()
+            await asyncio.sleep(0.05)
+            new = asyncio.create_task(scheduler.send_message(USER_ID, 'new', key='timer'))
+        results = await asyncio.gather(old, new)
+        await scheduler.close()
+        if results != [None, 'new'] or bot.sent != ['new']:
+            return (f"новое сообщение {'во время' if newer_during_attempt else 'после'} попытки: "
+                    f"результаты {results}, отправлено {bot.sent}")
+    return None
+
+
+async def check_timer_midnight():
+    # Таймер через полночь в поясе пользователя (не сервера) делится по его дням
+    zone = get_zone('+10:00')
+    day = date.today() - timedelta(days=3)
+    local_start = datetime.combine(day, datetime.min.time()).replace(hour=23, tzinfo=zone)
+    expected = {day: 60, day + timedelta(days=1): 90}
+
+    async def zone_for(user_id):
+        return zone
+
+    with tempfile.TemporaryDirectory() as directory:
+        backends = {
+            'memory': MemoryDatabase(),
+            'sqlite': SQLiteDatabase(os.path.join(directory, 'check.db')),
+        }
+        for name, database in backends.items():
+            await database.connect()
+            try:
+                await database.create_user(USER_ID, 'check', '+10:00')
+                timers = TimerService(database, zone_for=zone_for)
+                await timers.start_timer(USER_ID, 'work', to_server(local_start))
+                stopped = await timers.stop_timer(
+                    USER_ID, to_server(local_start + timedelta(hours=2, minutes=30))
+                )
+                split = {local_day: minutes for _, local_day, minutes in stopped.segments}
+                stored = {
+                    local_day: (await database.get_daily_report(USER_ID, local_day))['work']
+                    for local_day in expected
+                }
+                if split != expected or stored != expected:
+                    return f"{name}: ожидалось {expected}, по частям {split}, в базе {stored}"
+            finally:
+                await database.close()
+    return None
+
+
+async def check_timer_write_failure():
+    # Неудачная запись времени не теряет его и не удваивает уже записанные части
+    day = date.today() - timedelta(days=3)
+    started_at = datetime.combine(day, datetime.min.time()).replace(hour=23)
+    stopped_at = started_at + timedelta(hours=2, minutes=30)
+    expected = {day: 60, day + timedelta(days=1): 90}
+
+    database = FailingEntryDatabase(fail_after=1)
+    timers = TimerService(database)
+    await timers.start_timer(USER_ID, 'work', started_at)
+    try:
+        await timers.stop_timer(USER_ID, stopped_at)
+        return "сбой записи не дошел до вызывающего"
+    except RuntimeError:
+        pass
+    if timers.get(USER_ID) is None:
+        return "таймер потерян после сбоя записи"
+
+    database.fail_after = 1
+    await timers.stop_timer(USER_ID, stopped_at)
+    stored = {
+        local_day: (await database.get_daily_report(USER_ID, local_day))['work']
+        for local_day in expected
+    }
+    if stored != expected:
+        return f"ожидалось {expected}, в базе {stored}"
+    return None
+
+
+CHECKS = {
+    'cache_race': check_cache_race,
+    'export_roundtrip': check_export_roundtrip,
+    'retry_coalesce': check_retry_coalesce,
+    'timer_midnight': check_timer_midnight,
+    'timer_write_failure': check_timer_write_failure,
+}
+
+
+async def main(args):
+    failed = 0
+    for name in args.checks:
+        error = await CHECKS[name]()
+        print(f"{name}: {'OK' if error is None else 'ОШИБКА — ' + error}")
+        failed += error is not None
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Проверки согласованности кэша и данных")
+    parser.add_argument('--checks', nargs='+', choices=list(CHECKS), default=list(CHECKS))
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(main(args)))
@@ -0,0 +1,315 @@
+import asyncio
+import itertools
+import random
+from datetime import datetime, timedelta
+
+from async_database import ACTIVITY_TYPES
+
+KINDS_INDEX = {'daily': 0, 'weekly': 1}
+
+
+# Замена AsyncDatabase в памяти для нагрузочных тестов.
+# Повторяет публичные методы базы; latency имитирует сетевой
+# круг до MySQL, max_connections — ограниченный пул соединений.
+class MemoryDatabase:
+    def __init__(self, latency=0.0, max_connections=10):
+        self.latency = latency
+        self.max_connections = max_connections
+        self.semaphore = None
+
+        self.users = {}
+        self.timezones = {}
+        self.teams = {}
+        self.entries = {}
+        self.rollup = {}
+        self.import_keys = set()
+        self.digest_settings = {}
+        self.deliveries = {}
+        self.running_timers = {}
+        self.sketches = {}
+        self.ids = itertools.count(1)
+
+        self.queries_total = 0
+
+    async def connect(self):
+        self.semaphore = asyncio.Semaphore(self.max_connections)
+
+    async def close(self):
+        pass
+
+    async def _query(self):
+        self.queries_total += 1
+        if self.semaphore is None:
+            await self.connect()
+        async with self.semaphore:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+
+    def pool_stats(self):
+        return {
+            'max_size': self.max_connections,
+            'queries_total': self.queries_total,
+        }
+
+    # --- Наполнение ---
+
+    def _insert(self, user_id, activity_type, duration_minutes, created_at, local_date=None):
+        # Записи и агрегаты по дню в поясе пользователя, как local_date в БД
+        local_date = local_date or created_at.date()
+        entry_id = next(self.ids)
+        self.entries.setdefault((user_id, local_date), []).append({
+            'id': entry_id,
+            'activity_type': activity_type,
+            'duration_minutes': duration_minutes,
+            'created_at': created_at,
+        })
+        day = self.rollup.setdefault((user_id, local_date), {})
+        day[activity_type] = day.get(activity_type, 0) + duration_minutes
+        return entry_id
+
+    def seed(self, user_id, days, entries_per_day, rng=None):
+        # История пользователя за последние days дней
+        rng = rng or random.Random(user_id)
+        self.users[user_id] = f"user{user_id}"
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        for offset in range(1, days + 1):
+            day_start = today - timedelta(days=offset)
+            for _ in range(entries_per_day):
+                self._insert(
+                    user_id,
+                    rng.choice(ACTIVITY_TYPES),
+                    rng.randint(5, 120),
+                    day_start + timedelta(minutes=rng.randint(0, 1439))
+                )
+
+    # --- Интерфейс AsyncDatabase ---
+
+    async def create_user(self, user_id, username, timezone=None):
+        await self._query()
+        self.users.setdefault(user_id, username)
+        if self.timezones.get(user_id) is None:
+            self.timezones[user_id] = timezone
+        return True
+
+    async def get_user_timezone(self, user_id):
+        await self._query()
+        return self.timezones.get(user_id)
+
+    async def set_user_timezone(self, user_id, timezone):
+        await self._query()
+        self.timezones[user_id] = timezone
+        return True
+
+    async def add_time_entry(self, user_id, activity_type, duration_minutes, created_at=None,
+                             local_date=None):
+        await self._query()
+        return self._insert(user_id, activity_type, duration_minutes,
+                            created_at or datetime.now(), local_date)
+
+    async def add_time_entries(self, entries, local_dates=None):
+        if not entries:
+            return 0
+        await self._query()
+        now = datetime.now()
+        local_dates = local_dates or [None] * len(entries)
+        for (user_id, activity_type, duration_minutes), day in zip(entries, local_dates):
+            self._insert(user_id, activity_type, duration_minutes, now, day)
+        return len(entries)
+
+    async def get_user_entries_by_date(self, user_id, day):
+        await self._query()
+        rows = sorted(self.entries.get((user_id, day), []), key=lambda entry: entry['created_at'])
+        return [dict(row) for row in rows]
+
+    async def get_daily_report(self, user_id, day):
+        await self._query()
+        report = dict.fromkeys(ACTIVITY_TYPES, 0)
+        report.update(self.rollup.get((user_id, day), {}))
+        return report
+
+    async def get_user_statistics(self, user_id, start_date, end_date):
+        await self._query()
+        stats = []
+        day = start_date
+        while day <= end_date:
+            totals = self.rollup.get((user_id, day))
+            if totals:
+                day_stats = {'date': day}
+                day_stats.update(totals)
+                stats.append(day_stats)
+            day += timedelta(days=1)
+        return stats
+
+    async def get_range_report(self, user_id, start_date, end_date, bucket_days=1):
+        await self._query()
+        stats = {}
+        day = start_date
+        while day <= end_date:
+            totals = self.rollup.get((user_id, day))
+            if totals:
+                bucket = start_date + timedelta(days=(day - start_date).days // bucket_days * bucket_days)
+                day_stats = stats.setdefault(bucket, {'date': bucket})
+                for activity_type, minutes in totals.items():
+                    day_stats[activity_type] = day_stats.get(activity_type, 0) + minutes
+            day += timedelta(days=1)
+        return list(stats.values())
+
+    async def import_entries(self, user_id, rows, local_dates=None):
+        await self._query()
+        inserted = 0
+        local_dates = local_dates or [None] * len(rows)
+        for (activity_type, duration_minutes, created_at, key), day in zip(rows, local_dates):
+            if (user_id, key) in self.import_keys:
+                continue
+            self.import_keys.add((user_id, key))
+            self._insert(user_id, activity_type, duration_minutes, created_at, day)
+            inserted += 1
+        return inserted
+
+    async def iter_user_entries(self, user_id, chunk_size=1000):
+        await self._query()
+        rows = [
+            (entry['id'], entry['activity_type'], entry['duration_minutes'], entry['created_at'])
+            for (entry_user, _), entries in self.entries.items() if entry_user == user_id
+            for entry in entries
+        ]
+        rows.sort(key=lambda row: (row[3], row[0]))
+        for i in range(0, len(rows), chunk_size):
+            yield rows[i:i + chunk_size]
+
+    async def get_entries_by_ids(self, user_id, entry_ids):
+        await self._query()
+        wanted = set(entry_ids)
+        return {
+            entry['id']: (entry['activity_type'], entry['duration_minutes'], entry['created_at'])
+            for (entry_user, _), entries in self.entries.items() if entry_user == user_id
+            for entry in entries if entry['id'] in wanted
+        }
+
+    async def load_running_timers(self):
+        await self._query()
+        return [(user_id,) + row for user_id, row in self.running_timers.items()]
+
+    async def save_running_timers(self, rows):
+        await self._query()
+        for user_id, activity_type, started_at in rows:
+            self.running_timers[user_id] = (activity_type, started_at)
+
+    async def delete_running_timers(self, user_ids):
+        await self._query()
+        for user_id in user_ids:
+            self.running_timers.pop(user_id, None)
+
+    async def get_users_statistics(self, user_ids, start_date, end_date):
+        stats = {}
+        for user_id in user_ids:
+            rows = await self.get_user_statistics(user_id, start_date, end_date)
+            if rows:
+                stats[user_id] = rows
+        return stats
+
+    async def get_weekly_totals(self, start_date, end_date):
+        await self._query()
+        totals = {}
+        for (user_id, day), day_totals in self.rollup.items():
+            if start_date <= day <= end_date:
+                week = day - timedelta(days=day.weekday())
+                for activity_type, minutes in day_totals.items():
+                    key = (week, user_id, activity_type)
+                    totals[key] = totals.get(key, 0) + minutes
+        return [key + (minutes,) for key, minutes in totals.items()]
+
+    # --- Команды ---
+
+    async def get_user_team(self, user_id):
+        await self._query()
+        return self.teams.get(user_id)
+
+    async def set_user_team(self, user_id, team):
+        await self._query()
+        self.teams[user_id] = team
+        return True
+
+    async def get_team_members(self, team, limit=100):
+        await self._query()
+        members = sorted(user_id for user_id, user_team in self.teams.items() if user_team == team)
+        return [(user_id, self.users.get(user_id)) for user_id in members[:limit]]
+
+    # --- Гистограммы рейтинга ---
+
+    async def save_sketches(self, shard, rows, keep_from):
+        await self._query()
+        for week, sketch, counts in rows:
+            self.sketches[(shard, week, sketch)] = counts
+        for key in [key for key in self.sketches if key[0] == shard and key[1] < keep_from]:
+            del self.sketches[key]
+
+    async def load_sketches(self, since):
+        await self._query()
+        return [key + (counts,) for key, counts in self.sketches.items() if key[1] >= since]
+
+    # --- Сводки ---
+
+    async def get_digest_settings(self, user_id):
+        await self._query()
+        daily, weekly = self.digest_settings.get(user_id, (False, False))
+        return {'daily': daily, 'weekly': weekly}
+
+    async def set_digest_settings(self, user_id, daily, weekly):
+        await self._query()
+        if user_id not in self.users:
+            return False
+        self.digest_settings[user_id] = (bool(daily), bool(weekly))
+        return True
+
+    async def digest_prepare(self, kind, period, keep_days=30):
+        await self._query()
+        index = KINDS_INDEX[kind]
+        added = 0
+        for user_id, settings in self.digest_settings.items():
+            key = (kind, period, user_id)
+            if settings[index] and key not in self.deliveries:
+                self.deliveries[key] = {'status': 'pending', 'claimed_by': None, 'claimed_at': None}
+                added += 1
+        return added
+
+    async def digest_recover(self, kind, period, lease_seconds):
+        await self._query()
+        expired = datetime.now() - timedelta(seconds=lease_seconds)
+        for (row_kind, row_period, _), row in self.deliveries.items():
+            if (row_kind, row_period) != (kind, period) or row['claimed_at'] is None:
+                continue
+            if row['claimed_at'] < expired and row['status'] == 'claimed':
+                row.update(status='pending', claimed_by=None)
+            elif row['claimed_at'] < expired and row['status'] == 'sending':
+                row['status'] = 'failed'
+
+    async def digest_claim(self, kind, period, token, limit):
+        await self._query()
+        claimed = []
+        for (row_kind, row_period, user_id), row in sorted(self.deliveries.items()):
+            if len(claimed) >= limit:
+                break
+            if (row_kind, row_period) == (kind, period) and row['status'] == 'pending':
+                row.update(status='claimed', claimed_by=token, claimed_at=datetime.now())
+                claimed.append(user_id)
+        return claimed
+
+    async def digest_remaining(self, kind, period):
+        await self._query()
+        return sum(1 for (row_kind, row_period, _), row in self.deliveries.items()
+                   if (row_kind, row_period) == (kind, period)
+                   and row['status'] in ('pending', 'claimed'))
+
+    async def digest_begin_send(self, kind, period, user_id, token):
+        await self._query()
+        row = self.deliveries.get((kind, period, user_id))
+        if row is None or row['status'] != 'claimed' or row['claimed_by'] != token:
+            return False
+        row['status'] = 'sending'
+        return True
+
+    async def digest_finish(self, kind, period, user_ids, status):
+        await self._query()
+        for user_id in user_ids:
+            self.deliveries[(kind, period, user_id)]['status'] = status
@@ -0,0 +1,409 @@
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from aiogram import Bot, Dispatcher, types
+
+from async_database import ACTIVITY_TYPES
+from benchmarks.fakes import MemoryDatabase
+from fake_telegram import FakeTelegram
+from sqlite_database import SQLiteDatabase
+
+ACTIVITY_BUTTONS = ("💼 Работа", "😴 Сон", "🎯 Отдых", "📚 Учеба", "🎮 Развлечения")
+QUICK_BUTTONS = ('quick_15', 'quick_30', 'quick_45', 'quick_60', 'quick_90', 'quick_120')
+STATS_COMMANDS = ('/stats', '/week', '/month', '/year', '/rank')
+
+LIGHT_USER_BASE = 1000
+HEAVY_USER_BASE = 1000000
+
+
+# --- Сценарии: последовательность шагов одного диалога ---
+# Шаг — (метка, обновление); шаги одного диалога идут строго по очереди
+
+def add_session(fake, user_id, rng, history_days):
+    steps = [
+        ('add', fake.message_update(user_id, '/add')),
+        ('add.activity', fake.message_update(user_id, rng.choice(ACTIVITY_BUTTONS))),
+    ]
+    if rng.random() < 0.7:
+        steps.append(('add.quick', fake.callback_update(user_id, rng.choice(QUICK_BUTTONS))))
+    else:
+        steps.append(('add.duration', fake.message_update(user_id, str(rng.randint(5, 240)))))
+    return steps
+
+
+def report_session(fake, user_id, rng, history_days):
+    report_date = date.today() - timedelta(days=rng.randint(1, history_days))
+    steps = [('report', fake.message_update(user_id, '/report'))]
+    if rng.random() < 0.3:
+        # Отчет за период до report_date
+        start_date = report_date - timedelta(days=rng.choice((6, 13, 29, 364)))
+        text = f"{start_date.strftime('%d.%m.%Y')}-{report_date.strftime('%d.%m.%Y')}"
+        steps.append(('report.range', fake.message_update(user_id, text)))
+    else:
+        steps.append(('report.date', fake.message_update(user_id, report_date.strftime('%d.%m.%Y'))))
+    return steps
+
+
+def stats_session(fake, user_id, rng, history_days):
+    command = rng.choice(STATS_COMMANDS)
+    return [(command.lstrip('/'), fake.message_update(user_id, command))]
+
+
+def export_session(fake, user_id, rng, history_days):
+    return [('export', fake.message_update(user_id, rng.choice(('/export', '/export jsonl gz'))))]
+
+
+# Смеси: (сценарий, вес, нужен ли «тяжелый» пользователь с длинной историей)
+MIXES = {
+    'add': [(add_session, 1.0, False)],
+    'report': [(report_session, 1.0, False)],
+    'stats': [(stats_session, 1.0, True)],
+    'export': [(export_session, 1.0, True)],
+    'mixed': [
+        (add_session, 0.7, False),
+        (report_session, 0.1, False),
+        (stats_session, 0.2, True),
+    ],
+}
+
+
+# --- Измерения ---
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': values[-1] if values else 0.0,
+    }
+
+
+# Задержка цикла событий: насколько позже положенного просыпается sleep
+class LoopLagMonitor:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self.task = None
+
+    def start(self):
+        self.samples = []
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        return summarize(self.samples)
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+
+class LoadRunner:
+    def __init__(self, app, fake, args):
+        self.app = app
+        self.fake = fake
+        self.args = args
+        self.heavy_users = [HEAVY_USER_BASE + i for i in range(args.heavy_users)]
+
+    async def send(self, update):
+        # Тот же путь, что у polling и webhook: с middleware уровня update.
+        # Каждое обновление — отдельная задача, как в цикле polling aiogram:
+        # иначе контекстные переменные (состояние FSM из StateFilter)
+        # протекают в следующее обновление этого воркера
+        await asyncio.create_task(self.app.dp.updates_handler.notify(types.Update(**update)))
+
+    async def run_worker(self, index, mix, sessions, latencies, errors):
+        rng = random.Random(self.args.seed * 1000 + index)
+        scenarios = [scenario for scenario, _, _ in mix]
+        weights = [weight for _, weight, _ in mix]
+        heavy = {scenario: needs_heavy for scenario, _, needs_heavy in mix}
+        # Свои пользователи у каждого воркера, чтобы не смешивать состояния FSM
+        own_users = [LIGHT_USER_BASE + index + i * self.args.concurrency
+                     for i in range(self.args.users_per_worker)]
+
+        while sessions:
+            sessions.pop()
+            scenario = rng.choices(scenarios, weights)[0]
+            if heavy[scenario]:
+                user_id, history_days = rng.choice(self.heavy_users), self.args.heavy_days
+            else:
+                user_id, history_days = rng.choice(own_users), self.args.light_days
+            for label, update in scenario(self.fake, user_id, rng, history_days):
+                started = time.perf_counter()
+                try:
+                    await self.send(update)
+                except Exception as e:
+                    errors.append(f"{label}: {e}")
+                latencies.setdefault(label, []).append(time.perf_counter() - started)
+
+    async def run_mix(self, name, session_count):
+        mix = MIXES[name]
+        sessions = list(range(session_count))
+        latencies = {}
+        errors = []
+        calls_before = len(self.fake.calls)
+
+        monitor = LoopLagMonitor()
+        monitor.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self.run_worker(index, mix, sessions, latencies, errors)
+            for index in range(self.args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+        loop_lag = await monitor.stop()
+
+        all_latencies = [value for values in latencies.values() for value in values]
+        return {
+            'mix': name,
+            'sessions': session_count,
+            'updates': len(all_latencies),
+            'elapsed': elapsed,
+            'throughput': len(all_latencies) / elapsed if elapsed else 0.0,
+            'latency': summarize(all_latencies),
+            'steps': {label: summarize(values) for label, values in sorted(latencies.items())},
+            'loop_lag': loop_lag,
+            'api_calls': len(self.fake.calls) - calls_before,
+            'errors': len(errors),
+            'error_samples': errors[:5],
+        }
+
+
+# --- Подготовка бота ---
+
+def configure(args, fake):
+    import config
+    # Бот ходит в фейковый Bot API; остальное — до импорта bot
+    config.TELEGRAM_API_SERVER = fake.base_url
+    config.FSM_STORAGE = 'memory'
+    config.METRICS_ENABLED = args.metrics
+    config.USER_CACHE_ENABLED = not args.no_cache
+    config.WRITE_BEHIND = args.write_behind
+    if not args.telegram_limits:
+        # Меряем бота, а не ограничения Telegram
+        config.SEND_GLOBAL_RATE = 100000
+        config.SEND_CHAT_RATE = 100000.0
+        config.SEND_CHAT_BURST = 100000
+
+
+async def seed_mysql(database, user_ids, days, entries_per_day, seed):
+    rng = random.Random(seed)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    for user_id in user_ids:
+        rows = []
+        for offset in range(1, days + 1):
+            day_start = today - timedelta(days=offset)
+            for _ in range(entries_per_day):
+                rows.append((user_id, rng.choice(ACTIVITY_TYPES), rng.randint(5, 120),
+                             day_start + timedelta(minutes=rng.randint(0, 1439))))
+        await database.create_user(user_id, f"user{user_id}")
+        async with database.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("DELETE FROM time_entries WHERE user_id = %s", (user_id,))
+                await cursor.executemany(
+                    "INSERT INTO time_entries "
+                    "(user_id, activity_type, duration_minutes, created_at) "
+                    "VALUES (%s, %s, %s, %s)",
+                    rows
+                )
+            await conn.commit()
+        await database.rebuild_rollup(user_id)
+
+
+# История через публичный интерфейс базы (пустой файл SQLite)
+async def seed_entries(database, user_ids, days, entries_per_day, seed):
+    rng = random.Random(seed)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    for user_id in user_ids:
+        rows = []
+        for offset in range(1, days + 1):
+            day_start = today - timedelta(days=offset)
+            for _ in range(entries_per_day):
+                rows.append((rng.choice(ACTIVITY_TYPES), rng.randint(5, 120),
+                             day_start + timedelta(minutes=rng.randint(0, 1439)), None))
+        await database.create_user(user_id, f"user{user_id}")
+        await database.import_entries(user_id, rows)
+
+
+async def prepare_data(app, args):
+    light_users = [LIGHT_USER_BASE + i for i in range(args.concurrency * args.users_per_worker)]
+    heavy_users = [HEAVY_USER_BASE + i for i in range(args.heavy_users)]
+    if args.db == 'memory':
+        for user_id in light_users:
+            app.db.db.seed(user_id, args.light_days, 3)
+        for user_id in heavy_users:
+            app.db.db.seed(user_id, args.heavy_days, args.heavy_entries)
+    elif args.db == 'sqlite':
+        await seed_entries(app.db.db, light_users, args.light_days, 3, args.seed)
+        await seed_entries(app.db.db, heavy_users, args.heavy_days, args.heavy_entries, args.seed)
+    else:
+        await seed_mysql(app.database, light_users, args.light_days, 3, args.seed)
+        await seed_mysql(app.database, heavy_users, args.heavy_days, args.heavy_entries, args.seed)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+# --- Вывод и сравнение ---
+
+def print_result(result):
+    latency = result['latency']
+    lag = result['loop_lag']
+    print(
+        f"{result['mix']:>8} {result['updates']:>8} {result['throughput']:>10.1f} "
+        f"{latency['p50'] * 1000:>8.1f} {latency['p95'] * 1000:>8.1f} {latency['p99'] * 1000:>8.1f} "
+        f"{lag['p99'] * 1000:>8.1f} {lag['max'] * 1000:>8.1f} {result['errors']:>6}"
+    )
+    if result['error_samples']:
+        for sample in result['error_samples']:
+            print(f"{'':>8} ошибка: {sample}")
+
+
+def compare(results, baseline_path, max_regression):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {result['mix']: result for result in baseline['results']}
+    print(f"\nСравнение с {baseline_path} ({baseline.get('git') or '?'}):")
+    print(f"{'смесь':>8} {'upd/s':>10} {'p95':>10} {'p99':>10}")
+
+    regressed = False
+    for result in results:
+        old = before.get(result['mix'])
+        if old is None:
+            continue
+        changes = [
+            result['throughput'] / old['throughput'] - 1 if old['throughput'] else 0.0,
+            result['latency']['p95'] / old['latency']['p95'] - 1 if old['latency']['p95'] else 0.0,
+            result['latency']['p99'] / old['latency']['p99'] - 1 if old['latency']['p99'] else 0.0,
+        ]
+        print(f"{result['mix']:>8} " + ' '.join(f"{change * 100:>+9.1f}%" for change in changes))
+        # Регрессия — падение пропускной способности или рост p95
+        if -changes[0] * 100 > max_regression or changes[1] * 100 > max_regression:
+            regressed = True
+    return regressed
+
+
+async def main(args):
+    fake = FakeTelegram(port=args.api_port, latency=args.api_latency)
+    await fake.start()
+    configure(args, fake)
+
+    import bot as app
+    # Рейтинг (/rank) читает базу напрямую, мимо кэша: подменяем обе ссылки
+    if args.db == 'memory':
+        app.db.db = app.ranking.db = MemoryDatabase(
+            latency=args.db_latency, max_connections=args.db_connections
+        )
+    elif args.db == 'sqlite':
+        # Каталог с файлом базы удаляется при завершении процесса
+        sqlite_dir = tempfile.TemporaryDirectory()
+        app.db.db = app.ranking.db = SQLiteDatabase(f"{sqlite_dir.name}/load_test.db")
+
+    Bot.set_current(app.dp.bot)
+    Dispatcher.set_current(app.dp)
+    await app.on_startup(app.dp)
+    results = []
+    try:
+        await prepare_data(app, args)
+        runner = LoadRunner(app, fake, args)
+        # Прогрев: процессы отрисовки, соединения, кэши
+        for name in args.mix:
+            await runner.run_mix(name, args.warmup)
+
+        print(f"{'смесь':>8} {'updates':>8} {'upd/s':>10} {'p50, мс':>8} {'p95, мс':>8} "
+              f"{'p99, мс':>8} {'lag99':>8} {'lagmax':>8} {'ошибки':>6}")
+        for name in args.mix:
+            result = await runner.run_mix(name, args.sessions)
+            results.append(result)
+            print_result(result)
+    finally:
+        await app.on_shutdown(app.dp)
+        await app.dp.storage.close()
+        await app.dp.storage.wait_closed()
+        session = await app.bot.get_session()
+        await session.close()
+        await fake.stop()
+
+    report = {
+        'git': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'args': vars(args),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nРезультаты сохранены в {args.output}")
+
+    # Ошибки обработчиков делают все цифры прогона недостоверными
+    errors = sum(result['errors'] for result in results)
+    if errors:
+        print(f"\nОшибок при обработке обновлений: {errors}")
+        return 1
+    if args.compare and compare(results, args.compare, args.max_regression):
+        print(f"\nРегрессия больше {args.max_regression}%")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Нагрузочный тест диспетчера на синтетических обновлениях")
+    parser.add_argument('--mix', nargs='+', choices=sorted(MIXES), default=['add', 'report', 'stats', 'mixed'])
+    parser.add_argument('--sessions', type=int, default=500, help="Диалогов в каждой смеси")
+    parser.add_argument('--warmup', type=int, default=20, help="Диалогов прогрева (не учитываются)")
+    parser.add_argument('--concurrency', type=int, default=50, help="Одновременных пользователей")
+    parser.add_argument('--users-per-worker', type=int, default=4)
+    parser.add_argument('--light-days', type=int, default=30, help="Дней истории обычного пользователя")
+    parser.add_argument('--heavy-users', type=int, default=20)
+    parser.add_argument('--heavy-days', type=int, default=365, help="Дней истории «тяжелого» пользователя")
+    parser.add_argument('--heavy-entries', type=int, default=20, help="Записей в день у «тяжелого» пользователя")
+    parser.add_argument('--db', choices=('memory', 'sqlite', 'mysql'), default='memory',
+                        help="sqlite — временный файл; mysql — база из config "
+                             "(данные тестовых пользователей перезаписываются)")
+    parser.add_argument('--db-latency', type=float, default=0.001, help="Задержка запроса к базе в памяти, с")
+    parser.add_argument('--db-connections', type=int, default=10)
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--api-latency', type=float, default=0.0, help="Задержка фейкового Bot API, с")
+    parser.add_argument('--telegram-limits', action='store_true', help="Оставить лимиты отправки Telegram")
+    parser.add_argument('--no-cache', action='store_true', help="Отключить кэш пользователей")
+    parser.add_argument('--write-behind', action='store_true')
+    parser.add_argument('--metrics', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="Сохранить результаты в JSON")
+    parser.add_argument('--compare', help="JSON предыдущего прогона для сравнения")
+    parser.add_argument('--max-regression', type=float, default=10.0,
+                        help="Допустимое ухудшение при --compare, %%")
+    sys.exit(asyncio.run(main(parser.parse_args())))
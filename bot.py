@@ -1,17 +1,50 @@
 import asyncio
+import html
+import importlib
 import logging
 import os
-from datetime import datetime, date, timedelta
+import re
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
 from aiogram import Bot, Dispatcher, types
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.types import ParseMode
 from aiogram.utils import executor
 
-from database import Database
+from admission import AdmissionMiddleware
+from activities import (
+    ACTIVITY_ALIASES, ACTIVITY_MAP, MAX_DURATION, MIN_DURATION, is_valid_duration
+)
+from async_database import AsyncDatabase
 from keyboards import *
-from utils import generate_daily_report
+from leaderboard import TOTAL, ActivityRanking, team_leaderboard, week_start
+from chart_cache import ChartCache
+from digest import DigestScheduler
+from exporter import TELEGRAM_FILE_LIMIT, export_user_entries
+from fsm_storage import MySQLStorage
+from importer import CsvImportError, import_csv
+from metrics import (
+    MetricsMiddleware, MetricsServer, fsm_state_counts, instrument, instrument_bot, registry
+)
+from parsing import parse_duration, parse_entries, parse_period
+from webhook import WebhookServer, start_webhook
+from write_buffer import WriteBehindBuffer
+from render_pool import ChartRenderPool, RenderQueueFull, RenderTimeout
+from reports import (
+    activity_name, added_text, daily_report_text, format_duration, month_report_text,
+    range_bucket_days, range_report_text, rank_text, stats_text, team_text, today_text,
+    week_report_text, year_report_text
+)
+from sender import OutboundScheduler
+from sqlite_database import SQLiteDatabase
+from timers import TimerService
+from timezones import local_now, local_today, parse_timezone, to_local, zone_label
+from user_cache import UserDataCache
 import config
 
 # Настройка логирования
@@ -21,24 +54,214 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Клавиатуры не меняются: собираем их один раз, а не на каждый ответ
+MAIN_KEYBOARD = get_main_keyboard()
+ACTIVITIES_KEYBOARD = get_activities_keyboard()
+QUICK_TIME_KEYBOARD = get_quick_time_keyboard()
+REPORT_DATE_KEYBOARD = get_report_date_keyboard()
+
 # Инициализация бота
-bot = Bot(token=config.BOT_TOKEN)
-storage = MemoryStorage()
+# TELEGRAM_API_SERVER позволяет направить бота на локальный Bot API (fake_telegram.py)
+api_server = getattr(config, 'TELEGRAM_API_SERVER', None)
+if api_server:
+    bot = Bot(token=config.BOT_TOKEN, server=TelegramAPIServer.from_base(api_server))
+else:
+    bot = Bot(token=config.BOT_TOKEN)
+
+# Инициализация базы данных: пул соединений MySQL или файл SQLite (DB_BACKEND)
+DB_BACKEND = getattr(config, 'DB_BACKEND', 'mysql')
+if DB_BACKEND == 'sqlite':
+    database = SQLiteDatabase(
+        getattr(config, 'SQLITE_PATH', 'timetracker.db'),
+        readers=getattr(config, 'SQLITE_READERS', 4)
+    )
+else:
+    database = AsyncDatabase(
+        host=config.MYSQL_HOST,
+        user=config.MYSQL_USER,
+        password=config.MYSQL_PASSWORD,
+        database=config.MYSQL_DATABASE,
+        pool_size=getattr(config, 'DB_POOL_SIZE', 10),
+        acquire_timeout=getattr(config, 'DB_ACQUIRE_TIMEOUT', 5.0)
+    )
+
+# Пояс пользователей, которые не выбрали свой (/tz); None — время сервера
+DEFAULT_TIMEZONE = getattr(config, 'DEFAULT_TIMEZONE', None)
+if DEFAULT_TIMEZONE:
+    DEFAULT_TIMEZONE = parse_timezone(DEFAULT_TIMEZONE)
+
+# При запуске через supervisor.py процесс ведет таймеры и недельные
+# суммы рейтинга только своих пользователей
+# (тот же шард, что и у обновлений: user_id % число воркеров)
+WORKER_SHARD = os.environ.get('BOT_WORKER_SHARD')
+WORKER_INDEX, WORKERS = map(int, WORKER_SHARD.split('/')) if WORKER_SHARD else (0, 1)
+
+def owns_user(user_id):
+    return user_id % WORKERS == WORKER_INDEX
+
+# Рейтинг среди всех пользователей (/rank): недельные суммы и гистограммы
+# обновляются из потока новых записей, запрос не читает БД
+RANKING_ENABLED = getattr(config, 'RANKING_ENABLED', True)
+ranking = ActivityRanking(
+    database,
+    shard=WORKER_SHARD,
+    owns=owns_user,
+    sync_interval=getattr(config, 'RANKING_SYNC_INTERVAL', 60.0)
+)
+
+# Кэш последних дней активных пользователей поверх БД
+db = UserDataCache(
+    database,
+    days=getattr(config, 'USER_CACHE_DAYS', 31),
+    max_items=getattr(config, 'USER_CACHE_MAX_ITEMS', 200000),
+    enabled=getattr(config, 'USER_CACHE_ENABLED', True),
+    default_timezone=DEFAULT_TIMEZONE,
+    on_entry=ranking.entry_added if RANKING_ENABLED else None,
+    on_import=ranking.reload_user if RANKING_ENABLED else None
+)
+
+# Хранилище состояний FSM: в памяти или общее для нескольких процессов в MySQL
+if getattr(config, 'FSM_STORAGE', 'memory') == 'mysql':
+    if DB_BACKEND == 'sqlite':
+        raise RuntimeError("FSM_STORAGE = 'mysql' требует DB_BACKEND = 'mysql'")
+    storage = MySQLStorage(
+        database,
+        state_ttl=getattr(config, 'FSM_STATE_TTL', 24 * 3600),
+        cache_ttl=getattr(config, 'FSM_CACHE_TTL', 5.0)
+    )
+else:
+    storage = MemoryStorage()
 dp = Dispatcher(bot, storage=storage)
 
-# Инициализация базы данных
-db = Database(
-    host=config.MYSQL_HOST,
-    user=config.MYSQL_USER,
-    password=config.MYSQL_PASSWORD,
-    database=config.MYSQL_DATABASE
+# Буфер отложенной записи (включается WRITE_BEHIND в config)
+entry_writer = WriteBehindBuffer(
+    db,
+    max_batch=getattr(config, 'WRITE_BEHIND_BATCH', 200),
+    flush_interval=getattr(config, 'WRITE_BEHIND_INTERVAL', 0.05)
 )
 
+# Пул процессов для построения диаграмм
+render_pool = ChartRenderPool(
+    workers=getattr(config, 'RENDER_WORKERS', 2),
+    max_queue=getattr(config, 'RENDER_QUEUE_SIZE', 8),
+    timeout=getattr(config, 'RENDER_TIMEOUT', 30.0)
+)
+
+# Очередь исходящих сообщений с учетом ограничений Telegram. Общий лимит
+# Telegram один на токен бота, поэтому воркеры supervisor.py делят его поровну
+sender = OutboundScheduler(
+    bot,
+    global_rate=getattr(config, 'SEND_GLOBAL_RATE', 30) / WORKERS,
+    chat_rate=getattr(config, 'SEND_CHAT_RATE', 1.0),
+    chat_burst=getattr(config, 'SEND_CHAT_BURST', 3)
+)
+
+# Кэш готовых диаграмм (PNG и file_id)
+chart_cache = ChartCache(
+    max_entries=getattr(config, 'CHART_CACHE_ENTRIES', 1000),
+    max_bytes=getattr(config, 'CHART_CACHE_BYTES', 64 * 1024 * 1024)
+)
+
+# Автоматические сводки для подписчиков (/digest)
+digest_scheduler = DigestScheduler(
+    db,
+    sender,
+    render_pool,
+    chart_cache,
+    send_time=getattr(config, 'DIGEST_TIME', '08:00'),
+    window=getattr(config, 'DIGEST_WINDOW', 3600),
+    max_rate=getattr(config, 'DIGEST_MAX_RATE', 10.0),
+    batch_size=getattr(config, 'DIGEST_BATCH_SIZE', 200)
+)
+
+async def notify_expired_timer(user_id, stopped):
+    await sender.send_message(
+        user_id,
+        f"⏹ <b>Таймер остановлен автоматически</b>\n\n"
+        f"{activity_name(stopped.activity_type)} идет дольше "
+        f"{timers.max_duration // 3600}ч. Записано: <b>{format_duration(stopped.minutes)}</b>\n"
+        f"Если время другое, поправьте его через /add.",
+        parse_mode=ParseMode.HTML
+    )
+
+# Запущенные таймеры (/start_timer, /stop_timer)
+timers = TimerService(
+    db,
+    checkpoint_interval=getattr(config, 'TIMER_CHECKPOINT_INTERVAL', 10.0),
+    sweep_interval=getattr(config, 'TIMER_SWEEP_INTERVAL', 3600),
+    max_duration=getattr(config, 'TIMER_MAX_HOURS', 16) * 3600,
+    on_expired=notify_expired_timer,
+    owns=owns_user,
+    zone_for=db.user_zone
+)
+
+# Выгрузки истории: не больше одной на пользователя и EXPORT_CONCURRENCY всего
+exports_running = set()
+export_semaphore = asyncio.Semaphore(getattr(config, 'EXPORT_CONCURRENCY', 2))
+
+# Самый длинный период /report: длинные периоды агрегируются в БД, так что
+# ограничение защищает только от опечаток в годе
+REPORT_MAX_DAYS = getattr(config, 'REPORT_MAX_DAYS', 3 * 366)
+
+# Импорт CSV: не больше одного на пользователя; 20 МБ — предел загрузки файлов ботом
+imports_running = set()
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+
+# Допуск обновлений: один отчет на пользователя за раз, повторные запросы
+# присоединяются к выполняемому, двойные нажатия кнопок отбрасываются
+async def reject_overloaded(message):
+    await sender.answer(message, "⏳ Бот перегружен, попробуйте через минуту.")
+
+admission = AdmissionMiddleware(
+    expensive_handlers=(
+        'cmd_today', 'cmd_stats', 'cmd_week', 'cmd_month', 'cmd_year', 'process_report_date',
+        'cmd_team'
+    ),
+    expensive_texts=("📅 Сегодня", "📊 Статистика", "📅 Неделя"),
+    callback_window=getattr(config, 'ADMISSION_CALLBACK_WINDOW', 5.0),
+    shed_threshold=getattr(config, 'ADMISSION_SHED_THRESHOLD', 10.0),
+    on_shed=reject_overloaded
+)
+if getattr(config, 'ADMISSION_ENABLED', True):
+    dp.middleware.setup(admission)
+
+# Метрики Prometheus и трассировка медленных обновлений
+metrics_server = None
+if getattr(config, 'METRICS_ENABLED', False):
+    dp.middleware.setup(MetricsMiddleware(
+        trace_sample_rate=getattr(config, 'TRACE_SAMPLE_RATE', 0.0),
+        slow_threshold=getattr(config, 'TRACE_SLOW_THRESHOLD', 1.0)
+    ))
+    instrument(database, (
+        'create_user', 'add_time_entry', 'add_time_entries',
+        'get_user_entries_by_date', 'get_daily_report', 'get_user_statistics'
+    ), 'db')
+    instrument(render_pool, ('render_daily_report',), 'render')
+    instrument_bot(bot)
+    
+    registry.add_stats('db_pool', database.pool_stats)
+    registry.add_stats('user_cache', db.stats)
+    registry.add_stats('write_buffer', entry_writer.stats)
+    registry.add_stats('render_pool', render_pool.stats)
+    registry.add_stats('chart_cache', chart_cache.stats)
+    registry.add_stats('sender', sender.stats)
+    registry.add_stats('digest', digest_scheduler.stats)
+    registry.add_stats('timers', timers.stats)
+    registry.add_stats('admission', admission.stats)
+    registry.add_stats('ranking', ranking.stats)
+    registry.add_stats('fsm', lambda: {'states': fsm_state_counts(storage)})
+    
+    metrics_server = MetricsServer(
+        host=getattr(config, 'METRICS_HOST', '127.0.0.1'),
+        port=getattr(config, 'METRICS_PORT', 9100)
+    )
+
 # Состояния FSM
 class TimeTracking(StatesGroup):
     waiting_for_activity = State()
     waiting_for_duration = State()
     waiting_for_report_date = State()
+    waiting_for_timer_activity = State()
 
 # Команда /start
 @dp.message_handler(commands=['start'])
@@ -47,9 +270,10 @@ async def cmd_start(message: types.Message):
     username = message.from_user.username or message.from_user.first_name
     
     # Создаем пользователя
-    db.create_user(user_id, username)
+    await db.create_user(user_id, username)
     
-    await message.answer(
+    await sender.answer(
+        message,
         f"🕒 Привет, {username}!\n\n"
         "Я бот для учета времени.\n\n"
         "<b>Что я умею:</b>\n"
@@ -61,16 +285,17 @@ async def cmd_start(message: types.Message):
         "📚 Учеба | 🎮 Развлечения\n\n"
         "<i>Используйте кнопки ниже 👇</i>",
         parse_mode=ParseMode.HTML,
-        reply_markup=get_main_keyboard()
+        reply_markup=MAIN_KEYBOARD
     )
 
 # Команда /add - добавление активности
 @dp.message_handler(commands=['add'])
 async def cmd_add(message: types.Message):
-    await message.answer(
+    await sender.answer(
+        message,
         "📊 <b>Выберите тип активности:</b>",
         parse_mode=ParseMode.HTML,
-        reply_markup=get_activities_keyboard()
+        reply_markup=ACTIVITIES_KEYBOARD
     )
     await TimeTracking.waiting_for_activity.set()
 
@@ -78,22 +303,16 @@ async def cmd_add(message: types.Message):
 @dp.message_handler(state=TimeTracking.waiting_for_activity)
 async def process_activity(message: types.Message, state: FSMContext):
     activity_text = message.text
-    activity_map = {
-        "💼 Работа": "work",
-        "😴 Сон": "sleep",
-        "🎯 Отдых": "rest",
-        "📚 Учеба": "study",
-        "🎮 Развлечения": "entertainment"
-    }
     
-    if activity_text not in activity_map:
-        await message.answer("Пожалуйста, выберите активность из кнопок:")
+    if activity_text not in ACTIVITY_MAP:
+        await sender.answer(message, "Пожалуйста, выберите активность из кнопок:")
         return
     
-    activity_type = activity_map[activity_text]
+    activity_type = ACTIVITY_MAP[activity_text]
     await state.update_data(activity_type=activity_type)
     
-    await message.answer(
+    await sender.answer(
+        message,
         "⏱️ <b>Введите продолжительность в минутах:</b>\n\n"
         "<i>Примеры:</i>\n"
         "• <code>60</code> - 1 час\n"
@@ -101,7 +320,7 @@ async def process_activity(message: types.Message, state: FSMContext):
         "• <code>120</code> - 2 часа\n\n"
         "<i>Или выберите быстрый вариант:</i>",
         parse_mode=ParseMode.HTML,
-        reply_markup=get_quick_time_keyboard()
+        reply_markup=QUICK_TIME_KEYBOARD
     )
     await TimeTracking.waiting_for_duration.set()
 
@@ -123,32 +342,17 @@ async def process_quick_time(callback_query: types.CallbackQuery, state: FSMCont
     activity_type = data['activity_type']
     
     user_id = callback_query.from_user.id
-    entry_id = db.add_time_entry(user_id, activity_type, minutes)
+    entry_id = await entry_writer.add(user_id, activity_type, minutes)
     
     if entry_id:
-        activity_names = {
-            "work": "💼 Работа",
-            "sleep": "😴 Сон",
-            "rest": "🎯 Отдых",
-            "study": "📚 Учеба",
-            "entertainment": "🎮 Развлечения"
-        }
-        
-        activity_name = activity_names.get(activity_type, activity_type)
-        hours = minutes // 60
-        mins = minutes % 60
-        
-        await bot.send_message(
+        await sender.send_message(
             user_id,
-            f"✅ <b>Добавлено!</b>\n\n"
-            f"<b>Активность:</b> {activity_name}\n"
-            f"<b>Время:</b> {hours}ч {mins}м\n"
-            f"<b>Когда:</b> {datetime.now().strftime('%H:%M')}",
+            added_text(activity_type, minutes, local_now(await db.user_zone(user_id))),
             parse_mode=ParseMode.HTML,
-            reply_markup=get_main_keyboard()
+            reply_markup=MAIN_KEYBOARD
         )
     else:
-        await bot.send_message(
+        await sender.send_message(
             user_id,
             "❌ <b>Ошибка!</b> Попробуйте еще раз.",
             parse_mode=ParseMode.HTML
@@ -161,439 +365,791 @@ async def process_quick_time(callback_query: types.CallbackQuery, state: FSMCont
 @dp.message_handler(state=TimeTracking.waiting_for_duration)
 async def process_duration(message: types.Message, state: FSMContext):
     try:
-        duration_text = message.text.strip()
+        # Минуты, часы с дробью, ЧЧ:ММ или «1ч 30м»
+        duration_minutes = parse_duration(message.text)
         
-        # Обработка разных форматов
-        if ':' in duration_text:
-            # Формат ЧЧ:ММ
-            try:
-                parts = duration_text.split(':')
-                if len(parts) == 2:
-                    hours = int(parts[0]) if parts[0] else 0
-                    minutes = int(parts[1]) if parts[1] else 0
-                    duration_minutes = hours * 60 + minutes
-                else:
-                    duration_minutes = int(duration_text)
-            except:
-                duration_minutes = int(duration_text)
-        elif '.' in duration_text or ',' in duration_text:
-            # Формат с десятичной дробью
-            duration_text = duration_text.replace(',', '.')
-            try:
-                hours = float(duration_text)
-                duration_minutes = int(hours * 60)
-            except:
-                duration_minutes = int(duration_text)
-        else:
-            # Просто минуты
-            duration_minutes = int(duration_text)
-        
-        if duration_minutes <= 0 or duration_minutes > 1440:
-            await message.answer("❌ Некорректное время! Введите от 1 до 1440 минут:")
+        if not is_valid_duration(duration_minutes):
+            await sender.answer(
+                message,
+                f"❌ Некорректное время! Введите от {MIN_DURATION} до {MAX_DURATION} минут:"
+            )
             return
         
         data = await state.get_data()
         activity_type = data['activity_type']
         
         user_id = message.from_user.id
-        entry_id = db.add_time_entry(user_id, activity_type, duration_minutes)
+        entry_id = await entry_writer.add(user_id, activity_type, duration_minutes)
         
         if entry_id:
-            activity_names = {
-                "work": "💼 Работа",
-                "sleep": "😴 Сон",
-                "rest": "🎯 Отдых",
-                "study": "📚 Учеба",
-                "entertainment": "🎮 Развлечения"
-            }
-            
-            activity_name = activity_names.get(activity_type, activity_type)
-            hours = duration_minutes // 60
-            mins = duration_minutes % 60
-            
-            await message.answer(
-                f"✅ <b>Добавлено!</b>\n\n"
-                f"<b>Активность:</b> {activity_name}\n"
-                f"<b>Время:</b> {hours}ч {mins}м",
+            await sender.answer(
+                message,
+                added_text(activity_type, duration_minutes),
                 parse_mode=ParseMode.HTML,
-                reply_markup=get_main_keyboard()
+                reply_markup=MAIN_KEYBOARD
             )
         else:
-            await message.answer("❌ Ошибка! Попробуйте еще раз.")
+            await sender.answer(message, "❌ Ошибка! Попробуйте еще раз.")
         
         await state.finish()
         
     except ValueError:
-        await message.answer(
+        await sender.answer(
+            message,
             "❌ Неверный формат!\n"
             "Введите число минут или время в формате:\n"
             "• 60 (минут)\n"
             "• 1.5 (часа)\n"
-            "• 1:30 (часы:минуты)"
+            "• 1:30 (часы:минуты)\n"
+            "• 1ч 30м"
         )
 
+# «Сегодня» в поясе пользователя, а не сервера
+async def user_today(user_id):
+    return local_today(await db.user_zone(user_id))
+
 # Команда /today - сегодняшние активности
 @dp.message_handler(commands=['today'])
 async def cmd_today(message: types.Message):
     user_id = message.from_user.id
-    today = date.today()
+    zone = await db.user_zone(user_id)
+    today = local_today(zone)
     
-    entries = db.get_user_entries_by_date(user_id, today)
+    entries = await db.get_user_entries_by_date(user_id, today)
     
     if not entries:
-        await message.answer(
+        await sender.answer(
+            message,
             "📭 <b>Сегодня еще нет записей</b>\n\n"
             "Добавьте первую активность!",
             parse_mode=ParseMode.HTML
         )
         return
     
-    message_text = "📊 <b>Сегодняшние активности:</b>\n\n"
-    total_minutes = 0
-    
-    activity_names = {
-        "work": "💼 Работа",
-        "sleep": "😴 Сон",
-        "rest": "🎯 Отдых",
-        "study": "📚 Учеба",
-        "entertainment": "🎮 Развлечения"
-    }
-    
-    for entry in entries:
-        activity_type = entry['activity_type']
-        duration = entry['duration_minutes']
-        created_at = entry['created_at']
-        
-        hours = duration // 60
-        minutes = duration % 60
-        
-        activity_name = activity_names.get(activity_type, activity_type)
-        time_str = f"{hours}ч {minutes}м" if hours > 0 else f"{minutes}м"
-        
-        # Время создания
-        try:
-            created_time = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S')
-            time_display = created_time.strftime('%H:%M')
-        except:
-            time_display = created_at.split(' ')[1][:5] if ' ' in created_at else created_at[:5]
-        
-        message_text += f"• {activity_name}: <b>{time_str}</b> (в {time_display})\n"
-        total_minutes += duration
-    
-    total_hours = total_minutes // 60
-    total_minutes_remain = total_minutes % 60
-    
-    message_text += f"\n⏱️ <b>Всего:</b> {total_hours}ч {total_minutes_remain}м"
-    
-    await message.answer(message_text, parse_mode=ParseMode.HTML)
+    await sender.answer(message, today_text(entries, zone), parse_mode=ParseMode.HTML)
 
 # Команда /report - отчет с диаграммой
 @dp.message_handler(commands=['report'])
 async def cmd_report(message: types.Message):
-    await message.answer(
+    await sender.answer(
+        message,
         "📈 <b>Выберите дату для отчета:</b>\n\n"
         "Или введите дату в формате:\n"
         "<code>ДД.ММ.ГГГГ</code> (25.12.2023)\n"
         "<code>ДД-ММ-ГГГГ</code> (25-12-2023)\n"
-        "<code>ДД/ММ/ГГГГ</code> (25/12/2023)",
+        "<code>ДД/ММ/ГГГГ</code> (25/12/2023)\n\n"
+        "Или период:\n"
+        "<code>01.10.2026-15.10.2026</code>\n"
+        "<code>прошлая неделя</code>, <code>этот месяц</code>, <code>последние 10 дней</code>",
         parse_mode=ParseMode.HTML,
-        reply_markup=get_report_date_keyboard()
+        reply_markup=REPORT_DATE_KEYBOARD
     )
     await TimeTracking.waiting_for_report_date.set()
 
+# Отчет за период: данные одним запросом (длинные периоды агрегируются в БД),
+# одна диаграмма со столбцами по дням и итогами
+async def send_range_report(message, start_date, end_date):
+    user_id = message.from_user.id
+    wait_msg = sender.placeholder(
+        message.chat.id,
+        "⏳ <b>Генерирую отчет...</b>",
+        delay=getattr(config, 'PLACEHOLDER_DELAY', 1.0),
+        parse_mode=ParseMode.HTML
+    )
+    bucket_days = range_bucket_days(start_date, end_date)
+    rows = await db.get_range_report(user_id, start_date, end_date, bucket_days)
+    
+    if not rows:
+        await wait_msg.discard()
+        await sender.answer(
+            message,
+            f"📭 <b>Нет данных за {start_date.strftime('%d.%m.%Y')} - {end_date.strftime('%d.%m.%Y')}</b>",
+            parse_mode=ParseMode.HTML,
+            reply_markup=MAIN_KEYBOARD
+        )
+        return
+    
+    text = range_report_text(start_date, end_date, rows)
+    cache_key = ChartCache.make_range_key(user_id, start_date, end_date, rows)
+    cached = chart_cache.get(cache_key)
+    note = ""
+    photo = None
+    try:
+        if cached:
+            photo = cached.file_id or cached.png
+        else:
+            photo = await render_pool.render_range_report(rows, start_date, end_date, bucket_days)
+            if photo:
+                chart_cache.put(cache_key, photo)
+    except RenderQueueFull:
+        logger.warning("Очередь отрисовки переполнена, отправлен текстовый отчет")
+        note = "\n\n⚠️ <i>Бот перегружен, диаграмма будет доступна позже</i>"
+    except RenderTimeout as e:
+        logger.error(f"Таймаут генерации диаграммы: {e}")
+        note = "\n\n⚠️ <i>Диаграмма строилась слишком долго</i>"
+    except Exception as e:
+        logger.error(f"Ошибка генерации диаграммы: {e}")
+        chart_cache.discard(cache_key)
+        note = "\n\n⚠️ <i>Не удалось создать диаграмму</i>"
+    
+    await wait_msg.discard()
+    if photo:
+        sent = await sender.send_photo(
+            chat_id=message.chat.id,
+            photo=photo,
+            caption=text,
+            parse_mode=ParseMode.HTML,
+            reply_markup=MAIN_KEYBOARD
+        )
+        chart_cache.set_file_id(cache_key, sent.photo[-1].file_id)
+    else:
+        await sender.answer(message, text + note, parse_mode=ParseMode.HTML, reply_markup=MAIN_KEYBOARD)
+
 # Обработчик выбора даты для отчета
 @dp.message_handler(state=TimeTracking.waiting_for_report_date)
 async def process_report_date(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     
     try:
-        user_input = message.text.strip().lower()
-        
-        # Обработка специальных слов
-        if user_input == 'вчера':
-            report_date = date.today() - timedelta(days=1)
-        elif user_input == 'позавчера':
-            report_date = date.today() - timedelta(days=2)
-        elif user_input == 'сегодня':
-            report_date = date.today()
-        else:
-            # Пробуем разные форматы дат
-            date_formats = [
-                '%d.%m.%Y',  # 25.12.2023
-                '%d-%m-%Y',  # 25-12-2023
-                '%d/%m/%Y',  # 25/12/2023
-                '%d.%m.%y',  # 25.12.23
-                '%d-%m-%y',  # 25-12-23
-                '%d/%m/%y',  # 25/12/23
-            ]
-            
-            parsed_date = None
-            for date_format in date_formats:
-                try:
-                    parsed_date = datetime.strptime(user_input, date_format).date()
-                    break
-                except ValueError:
-                    continue
-            
-            if parsed_date is None:
-                raise ValueError("Неверный формат даты")
-            
-            report_date = parsed_date
+        # Специальные слова («вчера»), ДД.ММ.ГГГГ и похожие форматы или период
+        today = await user_today(user_id)
+        start_date, report_date = parse_period(message.text, today)
         
         # Проверяем, что дата не в будущем
-        if report_date > date.today():
-            await message.answer("❌ Дата не может быть в будущем!")
+        if start_date > today:
+            await sender.answer(message, "❌ Дата не может быть в будущем!")
             return
         
-        # Показываем ожидание
-        wait_msg = await message.answer("⏳ <b>Генерирую отчет...</b>", parse_mode=ParseMode.HTML)
+        if start_date != report_date:
+            end_date = min(report_date, today)
+            if (end_date - start_date).days >= REPORT_MAX_DAYS:
+                await sender.answer(message, f"❌ Период не может быть длиннее {REPORT_MAX_DAYS} дней!")
+                return
+            await send_range_report(message, start_date, end_date)
+            await state.finish()
+            return
         
-        # Получаем данные для отчета
-        report_data = db.get_daily_report(user_id, report_date)
+        # Показываем ожидание, только если отчет готовится дольше секунды
+        wait_msg = sender.placeholder(
+            message.chat.id,
+            "⏳ <b>Генерирую отчет...</b>",
+            delay=getattr(config, 'PLACEHOLDER_DELAY', 1.0),
+            parse_mode=ParseMode.HTML
+        )
         
-        await wait_msg.delete()  # Удаляем сообщение ожидания
+        # Получаем данные для отчета
+        report_data = await db.get_daily_report(user_id, report_date)
         
         if not report_data or sum(report_data.values()) == 0:
-            await message.answer(
+            await wait_msg.discard()
+            await sender.answer(
+                message,
                 f"📭 <b>Нет данных за {report_date.strftime('%d.%m.%Y')}</b>\n\n"
                 f"За этот день не было добавлено активностей.",
                 parse_mode=ParseMode.HTML,
-                reply_markup=get_main_keyboard()
+                reply_markup=MAIN_KEYBOARD
             )
             await state.finish()
             return
         
         # Формируем текстовую часть отчета
-        total_minutes = sum(report_data.values())
-        total_hours = total_minutes // 60
-        total_minutes_remain = total_minutes % 60
-        
-        activity_names = {
-            "work": "💼 Работа",
-            "sleep": "😴 Сон",
-            "rest": "🎯 Отдых",
-            "study": "📚 Учеба",
-            "entertainment": "🎮 Развлечения"
-        }
-        
-        text = f"📊 <b>Отчет за {report_date.strftime('%d.%m.%Y')}</b>\n\n"
+        text = daily_report_text(report_date, report_data)
         
-        # Сортируем по убыванию времени
-        sorted_activities = sorted(
-            [(k, v) for k, v in report_data.items() if v > 0],
-            key=lambda x: x[1],
-            reverse=True
-        )
+        # Диаграмма из кэша: по file_id без загрузки или готовый PNG
+        cache_key = ChartCache.make_key(user_id, report_date, report_data)
+        cached = chart_cache.get(cache_key)
         
-        for activity_type, duration in sorted_activities:
-            if duration > 0:
-                hours = duration // 60
-                minutes = duration % 60
-                activity_name = activity_names.get(activity_type, activity_type)
-                percentage = (duration / total_minutes) * 100 if total_minutes > 0 else 0
+        try:
+            if cached and cached.file_id:
+                photo = cached.file_id
+            elif cached and cached.png:
+                photo = cached.png
+            else:
+                # Генерируем диаграмму в пуле процессов
+                position = render_pool.queue_position()
+                if position > 0 and not render_pool.is_saturated():
+                    # Сообщение об очереди заменяет обычное ожидание
+                    await wait_msg.discard()
+                    wait_msg = sender.placeholder(
+                        message.chat.id,
+                        f"⏳ <b>Отчет в очереди</b> (перед вами: {position})",
+                        delay=0,
+                        parse_mode=ParseMode.HTML
+                    )
                 
-                if hours > 0:
-                    time_str = f"{hours}ч {minutes}м"
-                else:
-                    time_str = f"{minutes}м"
+                chart_png = await render_pool.render_daily_report(report_data, report_date, user_id)
                 
-                text += f"{activity_name}: <b>{time_str}</b> ({percentage:.1f}%)\n"
-        
-        text += f"\n⏱️ <b>Всего:</b> {total_hours}ч {total_minutes_remain}м"
-        
-        # Генерируем диаграмму
-        try:
-            chart_path = generate_daily_report(report_data, report_date, user_id)
+                photo = None
+                if chart_png:
+                    chart_cache.put(cache_key, chart_png)
+                    photo = chart_png
             
             # Проверяем, что диаграмма создана
-            if chart_path and os.path.exists(chart_path):
+            if photo:
                 # Отправляем диаграмму
-                with open(chart_path, 'rb') as photo:
-                    await bot.send_photo(
-                        chat_id=message.chat.id,
-                        photo=photo,
-                        caption=text,
-                        parse_mode=ParseMode.HTML,
-                        reply_markup=get_main_keyboard()
-                    )
-                logger.info(f"Отчет отправлен с диаграммой: {chart_path}")
+                await wait_msg.discard()
+                sent = await sender.send_photo(
+                    chat_id=message.chat.id,
+                    photo=photo,
+                    caption=text,
+                    parse_mode=ParseMode.HTML,
+                    reply_markup=MAIN_KEYBOARD
+                )
+                chart_cache.set_file_id(cache_key, sent.photo[-1].file_id)
+                logger.info(f"Отчет отправлен с диаграммой (пользователь {user_id}, {report_date})")
             else:
                 # Отправляем только текстовый отчет
-                await message.answer(
+                await sender.answer(
+                    message,
                     text + "\n\n⚠️ <i>Диаграмма не сгенерирована</i>",
                     parse_mode=ParseMode.HTML,
-                    reply_markup=get_main_keyboard()
+                    reply_markup=MAIN_KEYBOARD
                 )
                 logger.warning("Не удалось создать диаграмму, отправлен текстовый отчет")
                 
+        except RenderQueueFull:
+            logger.warning("Очередь отрисовки переполнена, отправлен текстовый отчет")
+            await sender.answer(
+                message,
+                text + "\n\n⚠️ <i>Бот перегружен, диаграмма будет доступна позже</i>",
+                parse_mode=ParseMode.HTML,
+                reply_markup=MAIN_KEYBOARD
+            )
+        except RenderTimeout as e:
+            logger.error(f"Таймаут генерации диаграммы: {e}")
+            await sender.answer(
+                message,
+                text + "\n\n⚠️ <i>Диаграмма строилась слишком долго</i>",
+                parse_mode=ParseMode.HTML,
+                reply_markup=MAIN_KEYBOARD
+            )
         except Exception as e:
             logger.error(f"Ошибка генерации диаграммы: {e}")
+            chart_cache.discard(cache_key)
             
             # Отправляем текстовый отчет
-            await message.answer(
+            await sender.answer(
+                message,
                 text + f"\n\n⚠️ <i>Не удалось создать диаграмму: {str(e)}</i>",
                 parse_mode=ParseMode.HTML,
-                reply_markup=get_main_keyboard()
+                reply_markup=MAIN_KEYBOARD
             )
         
+        await wait_msg.discard()
         await state.finish()
         
     except (ValueError, IndexError) as e:
-        await message.answer(
+        await sender.answer(
+            message,
             "❌ <b>Неверный формат даты!</b>\n\n"
             "Используйте один из форматов:\n"
             "• <code>25.12.2023</code>\n"
             "• <code>25-12-2023</code>\n"
-            "• <code>25/12/2023</code>\n\n"
+            "• <code>25/12/2023</code>\n"
+            "• <code>01.10.2026-15.10.2026</code>\n\n"
             "Или выберите вариант из кнопок",
             parse_mode=ParseMode.HTML
         )
     except Exception as e:
         logger.error(f"Ошибка обработки отчета: {e}")
-        await message.answer(
+        await sender.answer(
+            message,
             "❌ <b>Произошла ошибка при обработке запроса</b>\n\n"
             "Попробуйте еще раз позже.",
             parse_mode=ParseMode.HTML
         )
 
+# stats_engine тянет numpy — его импорт не задерживает запуск: модуль
+# подгружается в фоне после старта (prewarm_imports) или первым отчетом
+async def load_stats(user_id, start_date, end_date):
+    from stats_engine import load_period
+    return await load_period(db, user_id, start_date, end_date)
+
 # Команда /stats - статистика
 @dp.message_handler(commands=['stats'])
 async def cmd_stats(message: types.Message):
     user_id = message.from_user.id
     
     # Статистика за 30 дней
-    end_date = date.today()
+    end_date = await user_today(user_id)
     start_date = end_date - timedelta(days=29)
     
-    stats = db.get_user_statistics(user_id, start_date, end_date)
+    period = await load_stats(user_id, start_date, end_date)
     
-    if not stats:
-        await message.answer(
+    if period.is_empty():
+        await sender.answer(
+            message,
             "📭 <b>Нет данных за последние 30 дней</b>\n\n"
             "Добавьте первую активность!",
             parse_mode=ParseMode.HTML
         )
         return
     
-    # Суммируем время по типам
-    total_by_type = {
-        'work': 0,
-        'sleep': 0,
-        'rest': 0,
-        'study': 0,
-        'entertainment': 0
-    }
+    await sender.answer(message, stats_text(period), parse_mode=ParseMode.HTML)
+
+# Команда /week - неделя
+@dp.message_handler(commands=['week'])
+async def cmd_week(message: types.Message):
+    user_id = message.from_user.id
+    
+    # За последние 7 дней
+    end_date = await user_today(user_id)
+    start_date = end_date - timedelta(days=6)
+    
+    period = await load_stats(user_id, start_date, end_date)
+    
+    if period.is_empty():
+        await sender.answer(
+            message,
+            "📭 <b>Нет данных за последнюю неделю</b>\n\n"
+            "Добавьте первую активность!",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    await sender.answer(message, week_report_text(period), parse_mode=ParseMode.HTML)
+
+# Команда /month - текущий календарный месяц
+@dp.message_handler(commands=['month'])
+async def cmd_month(message: types.Message):
+    user_id = message.from_user.id
+    
+    end_date = await user_today(user_id)
+    start_date = end_date.replace(day=1)
+    
+    period = await load_stats(user_id, start_date, end_date)
     
-    total_minutes_all = 0
+    if period.is_empty():
+        await sender.answer(
+            message,
+            "📭 <b>Нет данных за этот месяц</b>\n\n"
+            "Добавьте первую активность!",
+            parse_mode=ParseMode.HTML
+        )
+        return
     
-    for day_stats in stats:
-        for activity_type in total_by_type.keys():
-            if activity_type in day_stats:
-                duration = day_stats[activity_type]
-                total_by_type[activity_type] += duration
-                total_minutes_all += duration
+    await sender.answer(message, month_report_text(period, end_date), parse_mode=ParseMode.HTML)
+
+# Команда /year - текущий календарный год
+@dp.message_handler(commands=['year'])
+async def cmd_year(message: types.Message):
+    user_id = message.from_user.id
     
-    # Формируем сообщение
-    message_text = "📈 <b>Статистика за 30 дней</b>\n\n"
+    end_date = await user_today(user_id)
+    start_date = end_date.replace(month=1, day=1)
     
-    activity_names = {
-        "work": "💼 Работа",
-        "sleep": "😴 Сон",
-        "rest": "🎯 Отдых",
-        "study": "📚 Учеба",
-        "entertainment": "🎮 Развлечения"
+    period = await load_stats(user_id, start_date, end_date)
+    
+    if period.is_empty():
+        await sender.answer(
+            message,
+            "📭 <b>Нет данных за этот год</b>\n\n"
+            "Добавьте первую активность!",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    await sender.answer(message, year_report_text(period, end_date.year), parse_mode=ParseMode.HTML)
+
+# Команда /digest - подписка на автоматические сводки
+@dp.message_handler(commands=['digest'])
+async def cmd_digest(message: types.Message):
+    user_id = message.from_user.id
+    choice = message.get_args().strip().lower()
+    options = {
+        'daily': (True, False),
+        'weekly': (False, True),
+        'all': (True, True),
+        'off': (False, False),
     }
     
-    # Сортируем по убыванию времени
-    sorted_activities = sorted(
-        [(k, v) for k, v in total_by_type.items() if v > 0],
-        key=lambda x: x[1],
-        reverse=True
+    if choice in options:
+        daily, weekly = options[choice]
+        username = message.from_user.username or message.from_user.first_name
+        await db.create_user(user_id, username)
+        if not await db.set_digest_settings(user_id, daily, weekly):
+            await sender.answer(message, "❌ Ошибка! Попробуйте еще раз.")
+            return
+        settings = {'daily': daily, 'weekly': weekly}
+    else:
+        settings = await db.get_digest_settings(user_id)
+        if settings is None:
+            await sender.answer(message, "❌ Ошибка! Попробуйте еще раз.")
+            return
+    
+    send_time = getattr(config, 'DIGEST_TIME', '08:00')
+    await sender.answer(
+        message,
+        "🔔 <b>Автоматические сводки</b>\n\n"
+        f"Итоги дня (в {send_time}): <b>{'вкл' if settings['daily'] else 'выкл'}</b>\n"
+        f"Итоги недели (по понедельникам): <b>{'вкл' if settings['weekly'] else 'выкл'}</b>\n\n"
+        "<code>/digest daily</code> - только итоги дня\n"
+        "<code>/digest weekly</code> - только итоги недели\n"
+        "<code>/digest all</code> - обе сводки\n"
+        "<code>/digest off</code> - отключить",
+        parse_mode=ParseMode.HTML
     )
+
+# Команда /tz - часовой пояс пользователя: по нему считаются «сегодня»,
+# дни записей и отчеты. /tz Europe/Moscow, /tz +3, /tz UTC-04:30
+@dp.message_handler(commands=['tz'])
+async def cmd_tz(message: types.Message):
+    user_id = message.from_user.id
+    args = message.get_args().strip()
     
-    for activity_type, total_duration in sorted_activities:
-        hours = total_duration // 60
-        minutes = total_duration % 60
-        activity_name = activity_names.get(activity_type, activity_type)
-        percentage = (total_duration / total_minutes_all) * 100 if total_minutes_all > 0 else 0
-        
-        if hours > 0:
-            time_str = f"{hours}ч {minutes}м"
-        else:
-            time_str = f"{minutes}м"
-        
-        message_text += f"{activity_name}: <b>{time_str}</b> ({percentage:.1f}%)\n"
+    if args:
+        try:
+            timezone = parse_timezone(args)
+        except ValueError:
+            await sender.answer(
+                message,
+                f"❌ Неизвестный часовой пояс «{html.escape(args)}».\n"
+                "Например: <code>/tz Europe/Moscow</code> или <code>/tz +3</code>",
+                parse_mode=ParseMode.HTML
+            )
+            return
+        username = message.from_user.username or message.from_user.first_name
+        await db.create_user(user_id, username)
+        if not await db.set_user_timezone(user_id, timezone):
+            await sender.answer(message, "❌ Ошибка! Попробуйте еще раз.")
+            return
     
-    total_hours = total_minutes_all // 60
-    total_minutes = total_minutes_all % 60
+    zone = await db.user_zone(user_id)
+    await sender.answer(
+        message,
+        "🌍 <b>Часовой пояс</b>\n\n"
+        f"Сейчас: <b>{html.escape(zone_label(zone))}</b>, "
+        f"у вас {local_now(zone).strftime('%d.%m %H:%M')}\n\n"
+        "Изменить: <code>/tz Europe/Moscow</code>, <code>/tz +3</code>\n"
+        "<i>Уже добавленные записи остаются в своих днях.</i>",
+        parse_mode=ParseMode.HTML
+    )
+
+# Команда /rank - сравнение времени за текущую неделю со всеми пользователями
+@dp.message_handler(commands=['rank'])
+async def cmd_rank(message: types.Message):
+    if not RANKING_ENABLED:
+        await sender.answer(message, "Рейтинг отключен.")
+        return
+    user_id = message.from_user.id
+    today = await user_today(user_id)
+    users, ranks = ranking.rank(user_id, today)
+    total = ranks.pop(TOTAL, (0, 0.0))
+    await sender.answer(
+        message, rank_text(users, total, ranks, week_start(today)), parse_mode=ParseMode.HTML
+    )
+
+# Команда /team - командная таблица за текущую неделю
+# /team join <название>, /team leave, /team — таблица своей команды
+TEAM_NAME_RE = re.compile(r'[\w-]{2,32}')
+TEAM_MAX_MEMBERS = getattr(config, 'TEAM_MAX_MEMBERS', 100)
+
+@dp.message_handler(commands=['team'])
+async def cmd_team(message: types.Message):
+    user_id = message.from_user.id
+    args = message.get_args().split()
+    action = args[0].lower() if args else ''
     
-    message_text += f"\n⏱️ <b>Всего за 30 дней:</b> {total_hours}ч {total_minutes}м"
-    message_text += f"\n📅 <b>Период:</b> {start_date.strftime('%d.%m')} - {end_date.strftime('%d.%m.%Y')}"
+    if action == 'join':
+        team = args[1].lower() if len(args) == 2 else ''
+        if not TEAM_NAME_RE.fullmatch(team):
+            await sender.answer(
+                message,
+                "❌ Название команды — от 2 до 32 букв, цифр, «_» или «-».\n"
+                "Например: <code>/team join backend</code>",
+                parse_mode=ParseMode.HTML
+            )
+            return
+        username = message.from_user.username or message.from_user.first_name
+        await db.create_user(user_id, username)
+        if not await db.set_user_team(user_id, team):
+            await sender.answer(message, "❌ Ошибка! Попробуйте еще раз.")
+            return
+    elif action == 'leave':
+        if not await db.set_user_team(user_id, None):
+            await sender.answer(message, "❌ Ошибка! Попробуйте еще раз.")
+            return
+        await sender.answer(message, "👋 Вы вышли из команды.")
+        return
+    elif action:
+        await sender.answer(
+            message,
+            "👥 <b>Команды</b>\n\n"
+            "<code>/team join название</code> - вступить в команду\n"
+            "<code>/team leave</code> - выйти\n"
+            "<code>/team</code> - таблица команды за неделю",
+            parse_mode=ParseMode.HTML
+        )
+        return
     
-    await message.answer(message_text, parse_mode=ParseMode.HTML)
+    team = await db.get_user_team(user_id)
+    if not team:
+        await sender.answer(
+            message,
+            "Вы не в команде. Вступить: <code>/team join название</code>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    members = await db.get_team_members(team, TEAM_MAX_MEMBERS)
+    today = await user_today(user_id)
+    start_date = week_start(today)
+    rows = await team_leaderboard(db, [member_id for member_id, _ in members], start_date, today)
+    names = {member_id: html.escape(name or str(member_id)) for member_id, name in members}
+    await sender.answer(
+        message, team_text(html.escape(team), rows, names, start_date), parse_mode=ParseMode.HTML
+    )
 
-# Команда /week - неделя
-@dp.message_handler(commands=['week'])
-async def cmd_week(message: types.Message):
+# Команда /export - выгрузка всей истории файлом
+# Формат задается аргументами: /export, /export jsonl, /export csv gz
+@dp.message_handler(commands=['export'])
+async def cmd_export(message: types.Message):
     user_id = message.from_user.id
+    args = message.get_args().lower().split()
+    export_format = 'jsonl' if 'jsonl' in args or 'json' in args else 'csv'
+    compress = 'gz' in args or 'gzip' in args
     
-    # За последние 7 дней
-    end_date = date.today()
-    start_date = end_date - timedelta(days=6)
+    if user_id in exports_running:
+        await sender.answer(message, "⏳ Выгрузка уже готовится, подождите.")
+        return
+    exports_running.add(user_id)
     
-    stats = db.get_user_statistics(user_id, start_date, end_date)
+    wait_msg = sender.placeholder(
+        message.chat.id,
+        "⏳ <b>Готовлю выгрузку...</b>",
+        delay=getattr(config, 'PLACEHOLDER_DELAY', 1.0),
+        parse_mode=ParseMode.HTML
+    )
+    try:
+        # Каждая выгрузка держит соединение с БД, поэтому их число ограничено
+        async with export_semaphore:
+            path, filename, count = await export_user_entries(
+                db, user_id, export_format, compress,
+                chunk_size=getattr(config, 'EXPORT_CHUNK_SIZE', 1000)
+            )
+        try:
+            await wait_msg.discard()
+            if count == 0:
+                await sender.answer(
+                    message,
+                    "📭 <b>Нет данных для выгрузки</b>\n\n"
+                    "Добавьте первую активность!",
+                    parse_mode=ParseMode.HTML
+                )
+            elif os.path.getsize(path) > TELEGRAM_FILE_LIMIT:
+                await sender.answer(
+                    message,
+                    "❌ Файл слишком большой для Telegram. "
+                    "Попробуйте со сжатием: <code>/export csv gz</code>",
+                    parse_mode=ParseMode.HTML
+                )
+            else:
+                await sender.send_document(
+                    message.chat.id,
+                    Path(path),
+                    filename=filename,
+                    caption=f"📦 Выгрузка истории: {count} записей"
+                )
+        finally:
+            os.remove(path)
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки для {user_id}: {e}")
+        await wait_msg.discard()
+        await sender.answer(message, "❌ Не удалось подготовить выгрузку. Попробуйте позже.")
+    finally:
+        exports_running.discard(user_id)
+
+# Импорт истории из CSV-файла
+# Столбцы: дата, активность, продолжительность и (необязательно) время
+@dp.message_handler(content_types=types.ContentType.DOCUMENT)
+async def process_import_document(message: types.Message):
+    user_id = message.from_user.id
+    document = message.document
     
-    if not stats:
-        await message.answer(
-            "📭 <b>Нет данных за последнюю неделю</b>\n\n"
-            "Добавьте первую активность!",
+    if not (document.file_name or '').lower().endswith('.csv'):
+        await sender.answer(
+            message,
+            "📎 Для импорта истории пришлите файл <b>.csv</b> со столбцами:\n"
+            "<code>дата, активность, продолжительность[, время]</code>\n\n"
+            "Подходит и файл из /export.",
             parse_mode=ParseMode.HTML
         )
         return
     
-    message_text = "📅 <b>Недельная статистика</b>\n\n"
-    
-    total_minutes_week = 0
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await sender.answer(message, "❌ Файл слишком большой (максимум 20 МБ).")
+        return
     
-    # Русские названия дней недели
-    days_ru = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+    if user_id in imports_running:
+        await sender.answer(message, "⏳ Импорт уже идет, подождите.")
+        return
+    imports_running.add(user_id)
     
-    # Создаем словарь для всех дней недели
-    week_data = {}
-    for i in range(7):
-        current_date = start_date + timedelta(days=i)
-        week_data[current_date] = 0
+    progress_msg = await sender.answer(
+        message,
+        "📥 <b>Импорт...</b>",
+        parse_mode=ParseMode.HTML
+    )
+    last_edit = time.monotonic()
     
-    # Заполняем данными
-    for day_stats in stats:
-        day_date = day_stats['date']
-        day_total = sum([day_stats.get(k, 0) for k in ['work', 'sleep', 'rest', 'study', 'entertainment']])
-        week_data[day_date] = day_total
-        total_minutes_week += day_total
+    # Прогресс обновляется в одном сообщении, не чаще раза в пару секунд
+    async def report_progress(progress):
+        nonlocal last_edit
+        if time.monotonic() - last_edit < 2:
+            return
+        last_edit = time.monotonic()
+        await sender.edit_message_text(
+            message.chat.id,
+            progress_msg.message_id,
+            f"📥 <b>Импорт...</b>\n\nОбработано строк: {progress.rows}",
+            parse_mode=ParseMode.HTML
+        )
     
-    # Выводим по дням
-    for day_date, day_total in sorted(week_data.items()):
-        hours = day_total // 60
-        minutes = day_total % 60
-        
-        day_name = days_ru[day_date.weekday()]
+    fd, path = tempfile.mkstemp(prefix=f"import_{user_id}_")
+    os.close(fd)
+    try:
+        await bot.download_file_by_id(document.file_id, destination=path)
+        progress = await import_csv(
+            db, user_id, path,
+            batch_size=getattr(config, 'IMPORT_BATCH_SIZE', 1000),
+            max_rows=getattr(config, 'IMPORT_MAX_ROWS', 200000),
+            on_progress=report_progress
+        )
         
-        if day_total > 0:
-            message_text += f"<b>{day_name} {day_date.strftime('%d.%m')}:</b> {hours}ч {minutes}м\n"
-        else:
-            message_text += f"<b>{day_name} {day_date.strftime('%d.%m')}:</b> нет данных\n"
+        text = (
+            f"✅ <b>Импорт завершен</b>\n\n"
+            f"Строк в файле: {progress.rows}\n"
+            f"Добавлено записей: {progress.inserted}\n"
+        )
+        if progress.duplicates:
+            text += f"Уже были загружены: {progress.duplicates}\n"
+        if progress.invalid:
+            text += f"Пропущено с ошибками: {progress.invalid}\n"
+            for line, reason in progress.errors:
+                text += f"• строка {line}: {html.escape(reason)}\n"
+    except CsvImportError as e:
+        text = f"❌ <b>Импорт не выполнен:</b> {html.escape(str(e))}"
+    except Exception as e:
+        logger.error(f"Ошибка импорта для {user_id}: {e}")
+        text = "❌ Не удалось импортировать файл. Попробуйте позже."
+    finally:
+        os.remove(path)
+        imports_running.discard(user_id)
+    
+    await sender.edit_message_text(
+        message.chat.id,
+        progress_msg.message_id,
+        text,
+        parse_mode=ParseMode.HTML
+    )
+
+def timer_stopped_text(stopped, zone=None):
+    text = (
+        f"⏹ <b>Таймер остановлен</b>\n\n"
+        f"<b>Активность:</b> {activity_name(stopped.activity_type)}\n"
+        f"<b>Время:</b> {format_duration(stopped.minutes)} "
+        f"({to_local(stopped.started_at, zone).strftime('%H:%M')} - "
+        f"{to_local(stopped.stopped_at, zone).strftime('%H:%M')})"
+    )
+    if not stopped.segments:
+        text += "\n\n<i>Меньше минуты — не записано.</i>"
+    elif len(stopped.segments) > 1:
+        days = ", ".join(
+            f"{day.strftime('%d.%m')}: {format_duration(minutes)}"
+            for _, day, minutes in stopped.segments
+        )
+        text += f"\n<b>По дням:</b> {days}"
+    return text
+
+async def start_timer(message, user_id, activity_type):
+    try:
+        previous = await timers.start_timer(user_id, activity_type)
+    except Exception as e:
+        logger.error(f"Ошибка запуска таймера: {e}")
+        await sender.answer(message, "❌ Ошибка! Попробуйте еще раз.", reply_markup=MAIN_KEYBOARD)
+        return
     
-    avg_minutes = total_minutes_week // 7
-    avg_hours = avg_minutes // 60
-    avg_minutes_remain = avg_minutes % 60
+    zone = await db.user_zone(user_id)
+    text = ""
+    if previous:
+        text = timer_stopped_text(previous, zone) + "\n\n"
+    text += (
+        f"▶️ <b>Таймер запущен:</b> {activity_name(activity_type)}\n"
+        f"<b>Начало:</b> {local_now(zone).strftime('%H:%M')}\n\n"
+        "Остановить: /stop_timer"
+    )
+    await sender.answer(message, text, parse_mode=ParseMode.HTML, reply_markup=MAIN_KEYBOARD)
+
+# Команда /start_timer - запуск таймера активности
+# Активность можно указать сразу: /start_timer работа
+@dp.message_handler(commands=['start_timer'])
+async def cmd_start_timer(message: types.Message):
+    user_id = message.from_user.id
+    username = message.from_user.username or message.from_user.first_name
+    await db.create_user(user_id, username)
     
-    total_hours_week = total_minutes_week // 60
-    total_minutes_remain_week = total_minutes_week % 60
+    args = message.get_args().strip().lower()
+    if args:
+        activity_type = ACTIVITY_ALIASES.get(args)
+        if activity_type is None:
+            await sender.answer(
+                message,
+                f"❌ Неизвестная активность «{html.escape(args)}».\n"
+                "Например: <code>/start_timer работа</code>",
+                parse_mode=ParseMode.HTML
+            )
+            return
+        await start_timer(message, user_id, activity_type)
+        return
     
-    message_text += f"\n📊 <b>Среднее в день:</b> {avg_hours}ч {avg_minutes_remain}м"
-    message_text += f"\n⏱️ <b>Всего за неделю:</b> {total_hours_week}ч {total_minutes_remain_week}м"
+    text = "⏱ <b>Выберите активность для таймера:</b>"
+    running = timers.get(user_id)
+    if running:
+        activity_type, started_at = running
+        started_at = to_local(started_at, await db.user_zone(user_id))
+        text = (
+            f"⏱ Идет таймер: {activity_name(activity_type)} "
+            f"с {started_at.strftime('%H:%M')}\n\n"
+            "Выберите новую активность, чтобы переключиться, или /stop_timer:"
+        )
+    await sender.answer(
+        message, text, parse_mode=ParseMode.HTML, reply_markup=ACTIVITIES_KEYBOARD
+    )
+    await TimeTracking.waiting_for_timer_activity.set()
+
+@dp.message_handler(state=TimeTracking.waiting_for_timer_activity)
+async def process_timer_activity(message: types.Message, state: FSMContext):
+    if message.text == '/stop_timer':
+        await state.finish()
+        await cmd_stop_timer(message)
+        return
+    if message.text not in ACTIVITY_MAP:
+        await sender.answer(message, "Пожалуйста, выберите активность из кнопок:")
+        return
+    await state.finish()
+    await start_timer(message, message.from_user.id, ACTIVITY_MAP[message.text])
+
+# Команда /stop_timer - остановка таймера и запись времени
+@dp.message_handler(commands=['stop_timer'])
+async def cmd_stop_timer(message: types.Message):
+    user_id = message.from_user.id
+    try:
+        stopped = await timers.stop_timer(user_id)
+    except Exception as e:
+        logger.error(f"Ошибка остановки таймера: {e}")
+        await sender.answer(message, "❌ Ошибка! Попробуйте еще раз.")
+        return
     
-    await message.answer(message_text, parse_mode=ParseMode.HTML)
+    if stopped is None:
+        await sender.answer(
+            message,
+            "⏱ Таймер не запущен.\nЗапустить: /start_timer",
+            reply_markup=MAIN_KEYBOARD
+        )
+        return
+    await sender.answer(
+        message, timer_stopped_text(stopped, await db.user_zone(user_id)),
+        parse_mode=ParseMode.HTML, reply_markup=MAIN_KEYBOARD
+    )
 
 # Обработчик кнопок главного меню
 @dp.message_handler(lambda message: message.text in [
@@ -615,35 +1171,143 @@ async def handle_main_buttons(message: types.Message):
     elif message.text == "📅 Неделя":
         await cmd_week(message)
 
+# Быстрая запись строкой: «работа 2ч, учеба 45м» — все записи одной вставкой
+async def add_entries_line(message, entries):
+    user_id = message.from_user.id
+    username = message.from_user.username or message.from_user.first_name
+    await db.create_user(user_id, username)
+    try:
+        inserted = await db.add_time_entries(
+            [(user_id, activity_type, minutes) for activity_type, minutes in entries]
+        )
+    except Exception as e:
+        logger.error(f"Ошибка добавления записей: {e}")
+        inserted = 0
+    if not inserted:
+        await sender.answer(message, "❌ Ошибка! Попробуйте еще раз.")
+        return
+    
+    lines = [
+        f"• {activity_name(activity_type)}: <b>{format_duration(minutes, True)}</b>"
+        for activity_type, minutes in entries
+    ]
+    total = sum(minutes for _, minutes in entries)
+    await sender.answer(
+        message,
+        "✅ <b>Добавлено!</b>\n\n" + "\n".join(lines) +
+        f"\n\n⏱️ <b>Всего:</b> {format_duration(total)}",
+        parse_mode=ParseMode.HTML,
+        reply_markup=MAIN_KEYBOARD
+    )
+
 # Обработчик любых сообщений
 @dp.message_handler()
 async def handle_other_messages(message: types.Message):
     logger.info(f"Получено сообщение: {message.text}")
-    await message.answer(
+    try:
+        entries = parse_entries(message.text or '')
+    except ValueError as e:
+        await sender.answer(
+            message, f"❌ {e}! Продолжительность записи — от {MIN_DURATION} до {MAX_DURATION} минут."
+        )
+        return
+    if entries:
+        await add_entries_line(message, entries)
+        return
+    
+    await sender.answer(
+        message,
         "🤖 <b>Используйте кнопки или команды:</b>\n\n"
         "/start - Начало работы\n"
         "/add - Добавить активность\n"
         "/today - Сегодняшние активности\n"
         "/report - Отчет с диаграммой\n"
         "/stats - Статистика за 30 дней\n"
-        "/week - Недельная статистика",
+        "/week - Недельная статистика\n"
+        "/month - Статистика за месяц\n"
+        "/year - Статистика за год\n"
+        "/export - Выгрузка всей истории (csv, jsonl, gz)\n"
+        "/digest - Автоматические сводки за день и неделю\n"
+        "/tz - Часовой пояс\n"
+        "/rank - Рейтинг недели среди всех пользователей\n"
+        "/team - Командная таблица за неделю\n"
+        "/start_timer - Запустить таймер активности\n"
+        "/stop_timer - Остановить таймер и записать время\n\n"
+        "Несколько записей сразу: <code>работа 2ч, учеба 45м</code>\n"
+        "Чтобы импортировать историю, пришлите CSV-файл.",
         parse_mode=ParseMode.HTML,
-        reply_markup=get_main_keyboard()
+        reply_markup=MAIN_KEYBOARD
     )
 
+# Модули, импорт которых отложен до первого запроса; после запуска
+# подгружаются в фоновом потоке, чтобы первый отчет не ждал импорта
+DEFERRED_IMPORTS = ('stats_engine',)
+
+def prewarm_imports():
+    started = time.perf_counter()
+    for module_name in DEFERRED_IMPORTS:
+        importlib.import_module(module_name)
+    logger.info(f"Отложенные модули загружены за {time.perf_counter() - started:.2f} с")
+
+# Подключение к БД с повторами: без базы бот работать не может, поэтому
+# после DB_CONNECT_ATTEMPTS неудачных попыток запуск прерывается
+async def connect_database():
+    attempts = getattr(config, 'DB_CONNECT_ATTEMPTS', 5)
+    delay = getattr(config, 'DB_CONNECT_BACKOFF', 1.0)
+    for attempt in range(1, attempts + 1):
+        try:
+            await db.connect()
+            logger.info("✅ Подключение к БД установлено")
+            return
+        except Exception as e:
+            if attempt == attempts:
+                logger.error(f"❌ Не удалось подключиться к БД за {attempts} попыток: {e}")
+                raise
+            logger.warning(
+                f"Ошибка подключения к БД (попытка {attempt}/{attempts}): {e}. "
+                f"Повтор через {delay:.1f} с"
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
 # Запуск бота
 async def on_startup(dp):
-    logger.info("✅ Бот запущен")
-    # Проверяем подключение к БД
-    try:
-        db.connect()
-        logger.info("✅ Подключение к БД установлено")
-    except Exception as e:
-        logger.error(f"❌ Ошибка подключения к БД: {e}")
+    started = time.perf_counter()
+    await connect_database()
+
+    if RANKING_ENABLED:
+        await ranking.load()
+        ranking.start()
+    await timers.load()
+    timers.start()
+    if getattr(config, 'WRITE_BEHIND', False):
+        entry_writer.start()
+    render_pool.start()
+    # Только после запуска процессов отрисовки: fork во время импорта
+    # в другом потоке оставил бы воркеру захваченную блокировку импорта
+    asyncio.get_running_loop().run_in_executor(None, prewarm_imports)
+    sender.start()
+    if getattr(config, 'DIGEST_ENABLED', True):
+        digest_scheduler.start()
+    if metrics_server:
+        await metrics_server.start()
+    logger.info(f"✅ Бот запущен ({time.perf_counter() - started:.2f} с)")
 
 async def on_shutdown(dp):
     logger.info("🛑 Бот остановлен")
-    db.close()
+    if metrics_server:
+        await metrics_server.stop()
+    await digest_scheduler.close()
+    # Последняя контрольная точка таймеров
+    await timers.close()
+    await sender.close()
+    await render_pool.close()
+    # Сбрасываем накопленные записи до закрытия пула соединений
+    await entry_writer.close()
+    await storage.close()
+    # Последний обмен гистограммами, пока пул соединений открыт
+    await ranking.close()
+    await db.close()
 
 if __name__ == '__main__':
     print("=" * 50)
@@ -654,4 +1318,17 @@ if __name__ == '__main__':
     print("\nЛоги будут отображаться ниже:")
     print("-" * 50)
     
-    executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown, skip_updates=True)
+    if getattr(config, 'BOT_MODE', 'polling') == 'webhook':
+        server = WebhookServer(
+            dp,
+            url=config.WEBHOOK_URL,
+            path=getattr(config, 'WEBHOOK_PATH', '/webhook'),
+            secret_token=getattr(config, 'WEBHOOK_SECRET', None),
+            host=getattr(config, 'WEBAPP_HOST', '0.0.0.0'),
+            port=getattr(config, 'WEBAPP_PORT', 8080),
+            max_concurrency=getattr(config, 'WEBHOOK_MAX_CONCURRENCY', 100),
+            drain_timeout=getattr(config, 'WEBHOOK_DRAIN_TIMEOUT', 30.0)
+        )
+        start_webhook(server, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown, skip_updates=True)
@@ -0,0 +1,99 @@
+import hashlib
+from collections import OrderedDict
+
+
+class CachedChart:
+    __slots__ = ('png', 'file_id')
+
+    def __init__(self, png=None, file_id=None):
+        self.png = png
+        self.file_id = file_id
+
+    @property
+    def size(self):
+        return len(self.png) if self.png else 0
+
+
+# LRU-кэш готовых диаграмм: PNG в памяти и file_id из Telegram.
+# Ключ включает отпечаток данных отчета, поэтому изменившийся день
+# автоматически получает новый ключ, а старый вытесняется со временем.
+class ChartCache:
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.file_id_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(user_id, report_date, report_data):
+        fingerprint = hashlib.sha1(
+            repr(sorted(report_data.items())).encode('utf-8')
+        ).hexdigest()
+        return (user_id, report_date.isoformat(), fingerprint)
+
+    @staticmethod
+    def make_range_key(user_id, start_date, end_date, rows):
+        # rows — результат get_range_report (список словарей по дням или корзинам)
+        fingerprint = hashlib.sha1(
+            repr([sorted(day_stats.items()) for day_stats in rows]).encode('utf-8')
+        ).hexdigest()
+        return (user_id, f"{start_date.isoformat()}/{end_date.isoformat()}", fingerprint)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        if entry.file_id:
+            self.file_id_hits += 1
+        return entry
+
+    def put(self, key, png):
+        self.discard(key)
+        entry = CachedChart(png=png)
+        self.entries[key] = entry
+        self.total_bytes += entry.size
+        self._evict()
+
+    def set_file_id(self, key, file_id):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = CachedChart()
+            self.entries[key] = entry
+        # Telegram хранит файл у себя, байты больше не нужны
+        self.total_bytes -= entry.size
+        entry.png = None
+        entry.file_id = file_id
+        self._evict()
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def _evict(self):
+        while self.entries and (len(self.entries) > self.max_entries
+                                or self.total_bytes > self.max_bytes):
+            _, entry = self.entries.popitem(last=False)
+            self.total_bytes -= entry.size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'file_id_hits': self.file_id_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,103 @@
+import io
+from datetime import timedelta
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt  # noqa: E402
+
+from activities import ACTIVITY_MAP  # noqa: E402
+
+# Диаграммы отчетов: PNG строится в памяти и возвращается байтами.
+# Модуль импортируется только в процессах пула отрисовки (render_pool.py).
+
+ACTIVITY_COLORS = {
+    'work': '#4c72b0',
+    'sleep': '#8172b2',
+    'rest': '#55a868',
+    'study': '#dd8452',
+    'entertainment': '#c44e52',
+}
+# Названия без эмодзи: шрифты matplotlib их не содержат
+ACTIVITY_LABELS = {activity_type: name.split(' ', 1)[1] for name, activity_type in ACTIVITY_MAP.items()}
+
+
+def _png(fig):
+    buffer = io.BytesIO()
+    try:
+        fig.savefig(buffer, format='png', dpi=100)
+    finally:
+        plt.close(fig)
+    return buffer.getvalue()
+
+
+def daily_report_chart(report_data, report_date):
+    # report_data — {активность: минуты} из get_daily_report; None, если за день пусто
+    shown = [activity_type for activity_type in ACTIVITY_COLORS if report_data.get(activity_type)]
+    if not shown:
+        return None
+    minutes = [report_data[activity_type] for activity_type in shown]
+    total = sum(minutes)
+
+    fig, ax = plt.subplots(figsize=(7, 5))
+    ax.pie(
+        minutes,
+        labels=[f"{ACTIVITY_LABELS[activity_type]}\n{m // 60}ч {m % 60}м"
+                for activity_type, m in zip(shown, minutes)],
+        colors=[ACTIVITY_COLORS[activity_type] for activity_type in shown],
+        autopct='%1.0f%%', startangle=90, counterclock=False,
+        wedgeprops={'edgecolor': 'white'}
+    )
+    ax.set_title(f"{report_date.strftime('%d.%m.%Y')}, всего {total // 60}ч {total % 60}м", pad=20)
+    ax.axis('equal')
+    fig.tight_layout()
+    return _png(fig)
+
+
+def range_report_chart(rows, start_date, end_date, bucket_days):
+    # rows — результат get_range_report. Слева столбцы по дням (или корзинам
+    # из bucket_days дней) с разбивкой по активностям, справа итоги за период.
+    buckets = []
+    day = start_date
+    while day <= end_date:
+        buckets.append(day)
+        day += timedelta(days=bucket_days)
+    by_bucket = {day_stats['date']: day_stats for day_stats in rows}
+
+    fig, (ax_days, ax_totals) = plt.subplots(
+        1, 2, figsize=(12, 5), gridspec_kw={'width_ratios': [3, 1]}
+    )
+    positions = range(len(buckets))
+    bottom = [0.0] * len(buckets)
+    totals = {}
+    for activity_type, color in ACTIVITY_COLORS.items():
+        hours = [by_bucket.get(day, {}).get(activity_type, 0) / 60 for day in buckets]
+        totals[activity_type] = sum(hours)
+        if not any(hours):
+            continue
+        ax_days.bar(positions, hours, bottom=bottom, color=color,
+                    label=ACTIVITY_LABELS[activity_type], width=0.8)
+        bottom = [b + h for b, h in zip(bottom, hours)]
+
+    step = max(1, len(buckets) // 12)
+    ax_days.set_xticks(list(positions)[::step])
+    ax_days.set_xticklabels([day.strftime('%d.%m') for day in buckets[::step]], rotation=45)
+    unit = "день" if bucket_days == 1 else f"{bucket_days} дн."
+    ax_days.set_ylabel(f"Часы за {unit}")
+    ax_days.set_title(f"{start_date.strftime('%d.%m.%Y')} - {end_date.strftime('%d.%m.%Y')}")
+    ax_days.legend(loc='upper center', bbox_to_anchor=(0.5, -0.15), ncol=5, fontsize='small')
+    ax_days.grid(axis='y', alpha=0.3)
+
+    shown = [activity_type for activity_type in ACTIVITY_COLORS if totals[activity_type] > 0]
+    ax_totals.barh(
+        [ACTIVITY_LABELS[activity_type] for activity_type in shown],
+        [totals[activity_type] for activity_type in shown],
+        color=[ACTIVITY_COLORS[activity_type] for activity_type in shown]
+    )
+    for i, activity_type in enumerate(shown):
+        ax_totals.text(totals[activity_type], i, f" {totals[activity_type]:.1f}ч", va='center')
+    ax_totals.invert_yaxis()
+    ax_totals.set_title("Всего, часы")
+    ax_totals.margins(x=0.3)
+
+    fig.tight_layout()
+    return _png(fig)
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from aiogram.types import ParseMode
+from aiogram.utils.exceptions import BotBlocked, ChatNotFound, UserDeactivated
+
+from async_database import ACTIVITY_TYPES
+from chart_cache import ChartCache
+from reports import daily_report_text, week_report_text
+from sender import PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('daily', 'weekly')
+
+
+class DigestRun:
+    __slots__ = ('kind', 'start_date', 'end_date', 'scheduled_at')
+
+    def __init__(self, kind, start_date, end_date, scheduled_at):
+        self.kind = kind
+        self.start_date = start_date
+        self.end_date = end_date
+        self.scheduled_at = scheduled_at
+
+    @property
+    def period(self):
+        return self.start_date
+
+
+def current_run(kind, now, send_time):
+    # Последний запуск вида kind не позже now: ежедневная сводка — за вчера,
+    # еженедельная — в понедельник за прошлую неделю (Пн–Вс)
+    today = now.date()
+    if kind == 'daily':
+        day = today - timedelta(days=1)
+        return DigestRun(kind, day, day, datetime.combine(today, send_time))
+    monday = today - timedelta(days=today.weekday())
+    return DigestRun(
+        kind,
+        monday - timedelta(days=7),
+        monday - timedelta(days=1),
+        datetime.combine(monday, send_time)
+    )
+
+
+# Планировщик автоматических сводок для подписчиков (/digest).
+# Каждый запуск (вид × период) хранится в digest_deliveries строкой на
+# пользователя: подписчики выбираются одним INSERT ... SELECT, пачки
+# захватываются атомарно (можно запускать в нескольких процессах),
+# агрегаты пачки читаются одним запросом. Перед отправкой строка
+# переводится в sending, после — в sent, поэтому после перезапуска
+# рассылка продолжается с того же места и никому не приходит дважды.
+# Отправка растягивается на window секунд, но не медленнее min_rate
+# и не быстрее max_rate сообщений в секунду.
+class DigestScheduler:
+    def __init__(self, db, sender, render_pool, chart_cache=None, send_time='08:00',
+                 window=3600, min_rate=1.0, max_rate=10.0, max_delay=6 * 3600,
+                 batch_size=200, concurrency=10, lease=900, check_interval=60):
+        self.db = db
+        self.sender = sender
+        self.render_pool = render_pool
+        self.chart_cache = chart_cache
+        self.send_time = datetime.strptime(send_time, '%H:%M').time()
+        self.window = window
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.lease = lease
+        self.check_interval = check_interval
+
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.sending = set()
+        self.next_send_at = 0.0
+        self.prepared = set()
+        self.finished = set()
+        self.task = None
+
+        # Метрики
+        self.sent_total = 0
+        self.failed_total = 0
+        self.skipped_total = 0
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self, timeout=10.0):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        # Недоставленные строки останутся claimed и вернутся в очередь после lease
+        if self.sending:
+            await asyncio.wait(set(self.sending), timeout=timeout)
+
+    def stats(self):
+        return {
+            'in_flight': len(self.sending),
+            'sent_total': self.sent_total,
+            'failed_total': self.failed_total,
+            'skipped_total': self.skipped_total,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка рассылки сводок: {e}")
+            await asyncio.sleep(self.check_interval)
+
+    async def tick(self, now=None):
+        now = now or datetime.now()
+        for kind in KINDS:
+            run = current_run(kind, now, self.send_time)
+            key = (run.kind, run.period)
+            if key in self.finished:
+                continue
+            # Слишком поздно (бот долго не работал) — сводка уже неактуальна
+            if not run.scheduled_at <= now < run.scheduled_at + timedelta(seconds=self.max_delay):
+                continue
+            if await self.deliver(run):
+                self.finished.add(key)
+
+    # Один проход по запуску; True, если в нем не осталось необработанных строк
+    async def deliver(self, run):
+        key = (run.kind, run.period)
+        if key not in self.prepared:
+            added = await self.db.digest_prepare(run.kind, run.period)
+            self.prepared.add(key)
+            if added:
+                logger.info(f"Сводка {run.kind} за {run.period}: {added} получателей")
+        await self.db.digest_recover(run.kind, run.period, self.lease)
+
+        deadline = run.scheduled_at + timedelta(seconds=self.window)
+        while True:
+            token = uuid.uuid4().hex
+            user_ids = await self.db.digest_claim(run.kind, run.period, token, self.batch_size)
+            if not user_ids:
+                break
+            remaining = await self.db.digest_remaining(run.kind, run.period)
+
+            stats = await self.db.get_users_statistics(user_ids, run.start_date, run.end_date)
+            empty = [user_id for user_id in user_ids if user_id not in stats]
+            if empty:
+                await self.db.digest_finish(run.kind, run.period, empty, 'skipped')
+                self.skipped_total += len(empty)
+
+            for user_id in user_ids:
+                if user_id not in stats:
+                    continue
+                await self._pace(deadline, remaining)
+                remaining -= 1
+                await self.semaphore.acquire()
+                task = asyncio.create_task(self._deliver_one(run, token, user_id, stats[user_id]))
+                self.sending.add(task)
+                task.add_done_callback(self.sending.discard)
+
+        if self.sending:
+            await asyncio.wait(set(self.sending))
+        # Строки, захваченные другим (возможно, упавшим) процессом, ждут следующего прохода
+        return await self.db.digest_remaining(run.kind, run.period) == 0
+
+    async def _pace(self, deadline, remaining):
+        window_left = (deadline - datetime.now()).total_seconds()
+        interval = window_left / max(remaining, 1)
+        interval = min(max(interval, 1 / self.max_rate), 1 / self.min_rate)
+        now = time.monotonic()
+        if self.next_send_at > now:
+            await asyncio.sleep(self.next_send_at - now)
+        self.next_send_at = max(now, self.next_send_at) + interval
+
+    async def _deliver_one(self, run, token, user_id, rows):
+        try:
+            if not await self.db.digest_begin_send(run.kind, run.period, user_id, token):
+                return
+            status = 'sent'
+            try:
+                if run.kind == 'daily':
+                    await self._send_daily(user_id, run, rows)
+                else:
+                    await self._send_weekly(user_id, run, rows)
+                self.sent_total += 1
+            except (BotBlocked, ChatNotFound, UserDeactivated):
+                # Бот заблокирован или аккаунт удален: больше не пишем
+                status = 'failed'
+                self.failed_total += 1
+                await self.db.set_digest_settings(user_id, False, False)
+            except Exception as e:
+                status = 'failed'
+                self.failed_total += 1
+                logger.warning(f"Сводка {run.kind} для {user_id} не отправлена: {e}")
+            await self.db.digest_finish(run.kind, run.period, [user_id], status)
+        except Exception as e:
+            logger.error(f"Ошибка доставки сводки {run.kind} для {user_id}: {e}")
+        finally:
+            self.semaphore.release()
+
+    async def _send_daily(self, user_id, run, rows):
+        report_date = run.start_date
+        report_data = dict.fromkeys(ACTIVITY_TYPES, 0)
+        for day_stats in rows:
+            report_data.update({k: v for k, v in day_stats.items() if k != 'date'})
+        text = "🔔 <b>Итоги дня</b>\n\n" + daily_report_text(report_date, report_data)
+
+        photo = None
+        cache_key = ChartCache.make_key(user_id, report_date, report_data)
+        cached = self.chart_cache.get(cache_key) if self.chart_cache else None
+        if cached:
+            photo = cached.file_id or cached.png
+        elif not self.render_pool.is_saturated():
+            # Пользователи с запросами важнее: при занятом пуле — только текст
+            try:
+                photo = await self.render_pool.render_daily_report(report_data, report_date, user_id)
+            except Exception as e:
+                logger.warning(f"Диаграмма сводки для {user_id} не построена: {e}")
+            if photo and self.chart_cache:
+                self.chart_cache.put(cache_key, photo)
+
+        if photo:
+            sent = await self.sender.send_photo(
+                user_id, photo, caption=text, parse_mode=ParseMode.HTML, priority=PRIORITY_BULK
+            )
+            if self.chart_cache and sent is not None:
+                self.chart_cache.set_file_id(cache_key, sent.photo[-1].file_id)
+        else:
+            await self.sender.send_message(
+                user_id, text, parse_mode=ParseMode.HTML, priority=PRIORITY_BULK
+            )
+
+    async def _send_weekly(self, user_id, run, rows):
+        # numpy импортируется при первой сводке, а не при запуске бота
+        from stats_engine import PeriodStats
+        period = PeriodStats.from_rows(run.start_date, run.end_date, rows)
+        title = (
+            f"🔔 <b>Итоги недели</b> {run.start_date.strftime('%d.%m')} - "
+            f"{run.end_date.strftime('%d.%m.%Y')}"
+        )
+        await self.sender.send_message(
+            user_id, week_report_text(period, title=title),
+            parse_mode=ParseMode.HTML, priority=PRIORITY_BULK
+        )
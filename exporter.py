@@ -0,0 +1,71 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import date
+
+FORMATS = ('csv', 'jsonl')
+COLUMNS = ('id', 'created_at', 'activity_type', 'duration_minutes')
+
+# Ограничение Telegram на размер документа, отправляемого ботом
+TELEGRAM_FILE_LIMIT = 50 * 1024 * 1024
+
+
+def _format_row(row):
+    entry_id, activity_type, duration_minutes, created_at = row
+    return entry_id, created_at.strftime('%Y-%m-%d %H:%M:%S'), activity_type, duration_minutes
+
+
+def _csv_writer(text):
+    writer = csv.writer(text)
+    writer.writerow(COLUMNS)
+
+    def write(rows):
+        writer.writerows(_format_row(row) for row in rows)
+    return write
+
+
+def _jsonl_writer(text):
+    def write(rows):
+        text.writelines(
+            json.dumps(dict(zip(COLUMNS, _format_row(row))), ensure_ascii=False) + '\n'
+            for row in rows
+        )
+    return write
+
+
+def export_filename(user_id, fmt, compress):
+    name = f"timetracker_{user_id}_{date.today().strftime('%Y%m%d')}.{fmt}"
+    return name + '.gz' if compress else name
+
+
+# Выгрузка всей истории пользователя во временный файл.
+# Записи читаются пачками через db.iter_user_entries и сразу пишутся
+# (при необходимости через gzip), поэтому память не растет с объемом истории.
+# Возвращает (путь, имя файла, число записей); файл удаляет вызывающий.
+async def export_user_entries(db, user_id, fmt='csv', compress=False, chunk_size=1000):
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+    fd, path = tempfile.mkstemp(prefix=f"export_{user_id}_")
+    count = 0
+    try:
+        with open(fd, 'wb') as raw:
+            stream = gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) if compress else raw
+            # BOM в CSV нужен Excel, чтобы верно прочитать кириллицу
+            encoding = 'utf-8-sig' if fmt == 'csv' else 'utf-8'
+            with io.TextIOWrapper(stream, encoding=encoding, newline='') as text:
+                write = _csv_writer(text) if fmt == 'csv' else _jsonl_writer(text)
+                async for rows in db.iter_user_entries(user_id, chunk_size):
+                    write(rows)
+                    count += len(rows)
+                    # Отдаем управление другим пользователям между пачками
+                    await asyncio.sleep(0)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    return path, export_filename(user_id, fmt, compress), count
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+FAKE_BOT_ID = 100000
+
+
+# Локальная имитация Telegram Bot API для офлайн-проверок.
+# Бот направляется сюда через TELEGRAM_API_SERVER в config,
+# все вызовы методов запоминаются в self.calls.
+class FakeTelegram:
+    def __init__(self, host='127.0.0.1', port=8081, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls = []
+        self.runner = None
+        self.message_ids = itertools.count(1)
+        self.update_ids = itertools.count(1)
+        self.file_ids = itertools.count(1)
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def make_app(self):
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        return app
+
+    async def start(self):
+        self.runner = web.AppRunner(self.make_app())
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logger.info(f"Фейковый Bot API запущен на {self.base_url}")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        if request.content_type.startswith('multipart/'):
+            params = {}
+            async for part in await request.multipart():
+                if part.filename:
+                    params[part.name] = await part.read()
+                else:
+                    params[part.name] = await part.text()
+        else:
+            params = dict(await request.post())
+
+        self.calls.append((method, params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        result = self.make_result(method, params)
+        return web.json_response({'ok': True, 'result': result})
+
+    def make_result(self, method, params):
+        method = method.lower()
+        chat_id = int(params.get('chat_id', 0) or 0)
+        if method == 'getme':
+            return {'id': FAKE_BOT_ID, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+        if method in ('sendmessage', 'editmessagetext'):
+            return self.make_message(chat_id, text=params.get('text', ''))
+        if method == 'sendphoto':
+            message = self.make_message(chat_id, caption=params.get('caption', ''))
+            message['photo'] = [{
+                'file_id': f"photo-{next(self.file_ids)}",
+                'file_unique_id': 'u',
+                'width': 800,
+                'height': 600,
+            }]
+            return message
+        if method == 'senddocument':
+            message = self.make_message(chat_id, caption=params.get('caption', ''))
+            message['document'] = {'file_id': f"doc-{next(self.file_ids)}", 'file_unique_id': 'u'}
+            return message
+        return True
+
+    def make_message(self, chat_id, **fields):
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': FAKE_BOT_ID, 'is_bot': True, 'first_name': 'Fake'},
+        }
+        message.update(fields)
+        return message
+
+    def calls_of(self, method):
+        return [params for name, params in self.calls if name.lower() == method.lower()]
+
+    # Сборка входящих обновлений
+    def message_update(self, user_id, text):
+        user = {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}"}
+        return {
+            'update_id': next(self.update_ids),
+            'message': {
+                'message_id': next(self.message_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': user,
+                'text': text,
+                'entities': (
+                    [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+                    if text.startswith('/') else []
+                ),
+            },
+        }
+
+    def callback_update(self, user_id, data, message_id=None):
+        user = {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}"}
+        return {
+            'update_id': next(self.update_ids),
+            'callback_query': {
+                'id': str(next(self.update_ids)),
+                'from': user,
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': message_id or next(self.message_ids),
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': FAKE_BOT_ID, 'is_bot': True, 'first_name': 'Fake'},
+                    'text': '...',
+                },
+            },
+        }
+
+
+# Отправка обновления в webhook так же, как это делает Telegram
+async def post_update(session, webhook_url, update, secret_token):
+    async with session.post(
+        webhook_url,
+        json=update,
+        headers={'X-Telegram-Bot-Api-Secret-Token': secret_token}
+    ) as response:
+        return response.status
+
+
+async def _run_standalone(args):
+    fake = FakeTelegram(args.host, args.port, args.latency)
+    await fake.start()
+
+    if args.webhook:
+        # Простая проверка webhook: /start от нескольких пользователей
+        async with aiohttp.ClientSession() as session:
+            for user_id in range(1, args.users + 1):
+                status = await post_update(
+                    session, args.webhook, fake.message_update(user_id, '/start'), args.secret
+                )
+                print(f"update от {user_id}: HTTP {status}")
+        await asyncio.sleep(1)
+        print(f"Вызовы Bot API: {len(fake.calls)}")
+        await fake.stop()
+        return
+
+    print(f"Фейковый Bot API: {fake.base_url} (Ctrl+C для остановки)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await fake.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Локальная имитация Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="Задержка ответа, с")
+    parser.add_argument('--webhook', help="URL webhook бота для проверки")
+    parser.add_argument('--secret', default='', help="WEBHOOK_SECRET бота")
+    parser.add_argument('--users', type=int, default=3)
+    asyncio.run(_run_standalone(parser.parse_args()))
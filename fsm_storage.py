@@ -0,0 +1,318 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+
+from aiogram.dispatcher.storage import BaseStorage
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повтором неудачного сброса, с
+FLUSH_RETRY_DELAY = 1.0
+
+
+class _Record:
+    __slots__ = ('state', 'data', 'bucket', 'loaded_at')
+
+    def __init__(self, state=None, data=None, bucket=None):
+        self.state = state
+        self.data = data or {}
+        self.bucket = bucket or {}
+        self.loaded_at = time.monotonic()
+
+    def is_empty(self):
+        return self.state is None and not self.data and not self.bucket
+
+
+# Хранилище состояний FSM в MySQL, общее для нескольких процессов бота.
+#
+# Чтение: состояние, данные и bucket читаются одной строкой, а промахи
+# от одновременных обработчиков собираются в один SELECT ... IN (...).
+# Запись: изменения копятся в памяти и раз в flush_interval сбрасываются
+# одним многострочным upsert. Сброшенное состояние остается в памяти
+# пустой записью, пока DELETE не подтвержден, а записи в полете не
+# перечитываются из БД. Заброшенные состояния старше state_ttl считаются
+# пустыми и периодически удаляются.
+class MySQLStorage(BaseStorage):
+    def __init__(self, db, state_ttl=24 * 3600, cache_ttl=5.0,
+                 flush_interval=0.05, cleanup_interval=600):
+        self.db = db
+        self.state_ttl = state_ttl
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.cleanup_interval = cleanup_interval
+
+        self.records = {}
+        self.dirty = set()
+        # Ключи, которые сейчас записываются: ключ -> число сбросов в полете
+        self.flushing = {}
+        self.pending_reads = {}
+        self.flush_task = None
+        self.read_task = None
+        self.cleanup_task = None
+        self.table_ready = False
+        self.closed = False
+
+    async def _ensure_table(self):
+        if self.table_ready:
+            return
+        async with self.db.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS fsm_storage (
+                        chat BIGINT NOT NULL,
+                        user BIGINT NOT NULL,
+                        state VARCHAR(255) NULL,
+                        data TEXT NULL,
+                        bucket TEXT NULL,
+                        updated_at TIMESTAMP NOT NULL
+                            DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                        PRIMARY KEY (chat, user),
+                        INDEX idx_updated (updated_at)
+                    )
+                """)
+            await conn.commit()
+        self.table_ready = True
+        if self.cleanup_task is None and self.cleanup_interval:
+            self.cleanup_task = asyncio.create_task(self._cleanup_loop())
+
+    # --- Пакетное чтение ---
+
+    async def _get_record(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        key = (int(chat), int(user))
+
+        record = self.records.get(key)
+        if record is not None and (key in self.dirty or key in self.flushing
+                                   or time.monotonic() - record.loaded_at < self.cache_ttl):
+            return record
+
+        future = self.pending_reads.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.pending_reads[key] = future
+            if self.read_task is None:
+                self.read_task = asyncio.create_task(self._read_batch())
+        return await future
+
+    async def _read_batch(self):
+        # Даем остальным обработчикам этого цикла добавить свои ключи
+        await asyncio.sleep(0)
+        pending, self.pending_reads = self.pending_reads, {}
+        self.read_task = None
+
+        try:
+            await self._ensure_table()
+            keys = list(pending)
+            placeholders = ', '.join(['(%s, %s)'] * len(keys))
+            params = [value for key in keys for value in key]
+            async with self.db.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        "SELECT chat, user, state, data, bucket FROM fsm_storage "
+                        f"WHERE (chat, user) IN ({placeholders}) "
+                        "AND updated_at > NOW() - INTERVAL %s SECOND",
+                        params + [self.state_ttl]
+                    )
+                    rows = await cursor.fetchall()
+                await conn.commit()
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        found = {
+            (chat, user): _Record(state, json.loads(data or '{}'), json.loads(bucket or '{}'))
+            for chat, user, state, data, bucket in rows
+        }
+        for key, future in pending.items():
+            # Локальные несброшенные изменения важнее прочитанных
+            record = self.records.get(key) if key in self.dirty or key in self.flushing else None
+            if record is None:
+                record = found.get(key) or _Record()
+                self.records[key] = record
+            if not future.done():
+                future.set_result(record)
+
+    # --- Пакетная запись ---
+
+    def _mark_dirty(self, chat, user, record):
+        chat, user = self.check_address(chat=chat, user=user)
+        key = (int(chat), int(user))
+        self.records[key] = record
+        self.dirty.add(key)
+        if self.flush_task is None and not self.closed:
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self, delay=None):
+        await asyncio.sleep(self.flush_interval if delay is None else delay)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, set()
+        for key in dirty:
+            self.flushing[key] = self.flushing.get(key, 0) + 1
+        upserts = []
+        deletes = []
+        for key in dirty:
+            record = self.records[key]
+            if record.is_empty():
+                # Пустая запись остается до подтверждения DELETE
+                deletes.append(key)
+            else:
+                upserts.append(key + (
+                    record.state,
+                    json.dumps(record.data, ensure_ascii=False),
+                    json.dumps(record.bucket, ensure_ascii=False),
+                ))
+
+        try:
+            await self._ensure_table()
+            async with self.db.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    if upserts:
+                        await cursor.executemany(
+                            "INSERT INTO fsm_storage (chat, user, state, data, bucket) "
+                            "VALUES (%s, %s, %s, %s, %s) "
+                            "ON DUPLICATE KEY UPDATE state = VALUES(state), "
+                            "data = VALUES(data), bucket = VALUES(bucket), "
+                            "updated_at = CURRENT_TIMESTAMP",
+                            upserts
+                        )
+                    if deletes:
+                        placeholders = ', '.join(['(%s, %s)'] * len(deletes))
+                        await cursor.execute(
+                            f"DELETE FROM fsm_storage WHERE (chat, user) IN ({placeholders})",
+                            [value for key in deletes for value in key]
+                        )
+                await conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка записи состояний FSM ({len(dirty)} шт.): {e}")
+            # Вернем ключи в очередь и повторим, даже если новых изменений не будет
+            self.dirty |= dirty
+            if self.closed:
+                # После остановки повторять некому: пул соединений закрывается
+                logger.error(f"Состояния FSM не сохранены при остановке: {sorted(dirty)}")
+                return
+            if self.flush_task is None:
+                self.flush_task = asyncio.create_task(self._flush_later(FLUSH_RETRY_DELAY))
+            return
+        finally:
+            for key in dirty:
+                if self.flushing[key] == 1:
+                    del self.flushing[key]
+                else:
+                    self.flushing[key] -= 1
+
+        for key in deletes:
+            record = self.records.get(key)
+            if (record is not None and record.is_empty()
+                    and key not in self.dirty and key not in self.flushing):
+                del self.records[key]
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                async with self.db.acquire() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(
+                            "DELETE FROM fsm_storage "
+                            "WHERE updated_at < NOW() - INTERVAL %s SECOND",
+                            (self.state_ttl,)
+                        )
+                        removed = cursor.rowcount
+                    await conn.commit()
+                if removed:
+                    logger.info(f"Удалено заброшенных состояний FSM: {removed}")
+            except Exception as e:
+                logger.error(f"Ошибка очистки состояний FSM: {e}")
+
+            # Из локального кэша убираем давно прочитанные чистые записи
+            now = time.monotonic()
+            for key in [key for key, record in self.records.items()
+                        if key not in self.dirty and key not in self.flushing
+                        and now - record.loaded_at > self.cache_ttl]:
+                del self.records[key]
+
+    async def close(self):
+        # Вызывается и из on_shutdown, и executor'ом aiogram: второй вызов
+        # пришелся бы на уже закрытую базу
+        if self.closed:
+            return
+        self.closed = True
+        if self.cleanup_task is not None:
+            self.cleanup_task.cancel()
+            self.cleanup_task = None
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
+
+    async def wait_closed(self):
+        return True
+
+    def state_counts(self):
+        counts = {}
+        for record in self.records.values():
+            if record.state is not None:
+                counts[record.state] = counts.get(record.state, 0) + 1
+        return counts
+
+    # --- Интерфейс BaseStorage ---
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        record = await self._get_record(chat, user)
+        return record.state if record.state is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        record = await self._get_record(chat, user)
+        return copy.deepcopy(record.data) if record.data else (default or {})
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        record = await self._get_record(chat, user)
+        record.state = self.resolve_state(state)
+        self._mark_dirty(chat, user, record)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        record = await self._get_record(chat, user)
+        record.data = copy.deepcopy(data) if data else {}
+        self._mark_dirty(chat, user, record)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        record = await self._get_record(chat, user)
+        if data:
+            record.data.update(data)
+        record.data.update(kwargs)
+        self._mark_dirty(chat, user, record)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        record = await self._get_record(chat, user)
+        record.state = None
+        if with_data:
+            record.data = {}
+        self._mark_dirty(chat, user, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        record = await self._get_record(chat, user)
+        return copy.deepcopy(record.bucket) if record.bucket else (default or {})
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        record = await self._get_record(chat, user)
+        record.bucket = copy.deepcopy(bucket) if bucket else {}
+        self._mark_dirty(chat, user, record)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        record = await self._get_record(chat, user)
+        if bucket:
+            record.bucket.update(bucket)
+        record.bucket.update(kwargs)
+        self._mark_dirty(chat, user, record)
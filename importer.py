@@ -0,0 +1,223 @@
+import asyncio
+import csv
+import hashlib
+from datetime import date, datetime, time
+
+from activities import ACTIVITY_ALIASES, MAX_DURATION, MIN_DURATION, is_valid_duration
+from parsing import parse_date, parse_duration
+
+# Названия столбцов в заголовке CSV (в нижнем регистре)
+COLUMN_ALIASES = {
+    'date': ('date', 'дата', 'day', 'день', 'created_at'),
+    'time': ('time', 'время'),
+    'activity': ('activity', 'activity_type', 'активность', 'category', 'категория', 'type', 'тип'),
+    'duration': ('duration', 'duration_minutes', 'minutes', 'минуты', 'длительность', 'продолжительность'),
+    # Номер записи в выгрузке /export
+    'id': ('id',),
+}
+# Порядок столбцов в файле без заголовка
+DEFAULT_COLUMNS = {'date': 0, 'activity': 1, 'duration': 2, 'time': 3}
+
+# Кроме форматов /report принимаются ISO-даты «2023-12-25» (так выглядит
+# выгрузка /export) и время «18:30» или «18:30:00»
+# Запись без времени ставится на полдень, чтобы сдвиг часового пояса
+# не переносил ее на соседний день
+DEFAULT_TIME = time(12, 0)
+
+
+class CsvImportError(Exception):
+    pass
+
+
+class ImportProgress:
+    def __init__(self):
+        self.rows = 0
+        self.valid = 0
+        self.inserted = 0
+        self.invalid = 0
+        # Первые ошибки для ответа пользователю: (номер строки, причина)
+        self.errors = []
+
+    @property
+    def duplicates(self):
+        return self.valid - self.inserted
+
+    def add_error(self, line, reason):
+        self.invalid += 1
+        if len(self.errors) < 5:
+            self.errors.append((line, reason))
+
+
+def _detect_encoding(sample):
+    try:
+        sample.decode('utf-8')
+        return 'utf-8-sig'
+    except UnicodeDecodeError as e:
+        # Обрезанный на границе образца символ — все равно UTF-8
+        if e.start >= len(sample) - 3:
+            return 'utf-8-sig'
+        return 'cp1251'
+
+
+def _detect_delimiter(text):
+    try:
+        return csv.Sniffer().sniff(text, delimiters=',;\t').delimiter
+    except csv.Error:
+        return ','
+
+
+def _header_columns(row):
+    names = [cell.strip().lower() for cell in row]
+    columns = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        for i, name in enumerate(names):
+            if name in aliases:
+                columns[column] = i
+                break
+    if not columns:
+        return None
+    missing = {'date', 'activity', 'duration'} - set(columns)
+    if missing:
+        raise CsvImportError(f"В заголовке нет столбцов: {', '.join(sorted(missing))}")
+    return columns
+
+
+def _cell(row, columns, column):
+    index = columns.get(column)
+    if index is None or index >= len(row):
+        return ''
+    return row[index].strip()
+
+
+def parse_row(row, columns):
+    # Строка CSV -> (activity_type, duration_minutes, created_at); ValueError с причиной
+    date_text = _cell(row, columns, 'date')
+    time_text = _cell(row, columns, 'time')
+    if ' ' in date_text and not time_text:
+        # «2023-12-25 18:30:00» в одном столбце
+        date_text, time_text = date_text.split(None, 1)
+
+    try:
+        # ISO-дата разбирается быстро и не пересекается с форматами /report
+        day = date.fromisoformat(date_text)
+    except ValueError:
+        try:
+            day = parse_date(date_text)
+        except ValueError:
+            raise ValueError(f"неверная дата «{date_text}»")
+    if day > date.today():
+        raise ValueError("дата в будущем")
+
+    entry_time = DEFAULT_TIME
+    if time_text:
+        try:
+            entry_time = time.fromisoformat(time_text)
+        except ValueError:
+            raise ValueError(f"неверное время «{time_text}»")
+
+    activity_text = _cell(row, columns, 'activity')
+    activity_type = ACTIVITY_ALIASES.get(activity_text.lower())
+    if activity_type is None:
+        raise ValueError(f"неизвестная активность «{activity_text}»")
+
+    duration_text = _cell(row, columns, 'duration')
+    try:
+        duration_minutes = parse_duration(duration_text)
+    except ValueError:
+        raise ValueError(f"неверная продолжительность «{duration_text}»")
+    if not is_valid_duration(duration_minutes):
+        raise ValueError(f"продолжительность вне диапазона {MIN_DURATION}–{MAX_DURATION} минут")
+
+    return activity_type, duration_minutes, datetime.combine(day, entry_time)
+
+
+def exported_id(row, columns):
+    # id записи из выгрузки /export или None
+    text = _cell(row, columns, 'id')
+    return int(text) if text.isdigit() else None
+
+
+async def _skip_own_entries(db, user_id, batch, ids):
+    # Строки собственной выгрузки /export: записи с тем же id и тем же
+    # содержимым уже есть у пользователя (у обычных записей нет import_key,
+    # и INSERT IGNORE их не узнает)
+    wanted = [entry_id for entry_id in ids if entry_id is not None]
+    if not wanted:
+        return batch
+    existing = await db.get_entries_by_ids(user_id, wanted)
+    kept = []
+    for entry, entry_id in zip(batch, ids):
+        found = existing.get(entry_id)
+        if (found is not None and found[:2] == entry[:2]
+                and found[2].replace(microsecond=0) == entry[2]):
+            continue
+        kept.append(entry)
+    return kept
+
+
+async def _save_batch(db, user_id, batch, ids):
+    batch = await _skip_own_entries(db, user_id, batch, ids)
+    return await db.import_entries(user_id, batch) if batch else 0
+
+
+def import_key(activity_type, duration_minutes, created_at, occurrence):
+    # Одинаковые строки в одном файле различаются номером повторения,
+    # поэтому повторная загрузка файла дает те же ключи
+    raw = f"{created_at:%Y-%m-%d %H:%M:%S}|{activity_type}|{duration_minutes}|{occurrence}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+# Потоковый импорт CSV из файла path.
+# Строки читаются по одной и сохраняются пачками по batch_size через
+# db.import_entries; после каждой пачки вызывается on_progress(progress).
+async def import_csv(db, user_id, path, batch_size=1000, max_rows=200000, on_progress=None):
+    with open(path, 'rb') as raw:
+        sample = raw.read(64 * 1024)
+    encoding = _detect_encoding(sample)
+    delimiter = _detect_delimiter(sample.decode(encoding, errors='ignore'))
+
+    progress = ImportProgress()
+    occurrences = {}
+    batch = []
+    ids = []
+    with open(path, encoding=encoding, newline='') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        columns = None
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            if columns is None:
+                columns = _header_columns(row)
+                if columns is not None:
+                    continue
+                columns = DEFAULT_COLUMNS
+
+            progress.rows += 1
+            if progress.rows > max_rows:
+                raise CsvImportError(f"Слишком много строк (больше {max_rows})")
+            try:
+                entry = parse_row(row, columns)
+            except ValueError as e:
+                progress.add_error(reader.line_num, str(e))
+                continue
+
+            occurrence = occurrences.get(entry, 0)
+            occurrences[entry] = occurrence + 1
+            batch.append(entry + (import_key(*entry, occurrence),))
+            ids.append(exported_id(row, columns))
+            progress.valid += 1
+
+            if len(batch) >= batch_size:
+                progress.inserted += await _save_batch(db, user_id, batch, ids)
+                batch = []
+                ids = []
+                if on_progress:
+                    await on_progress(progress)
+                # Разбор следующей пачки не должен задерживать других пользователей
+                await asyncio.sleep(0)
+
+    if batch:
+        progress.inserted += await _save_batch(db, user_id, batch, ids)
+    if columns is None:
+        raise CsvImportError("Файл пуст")
+    return progress
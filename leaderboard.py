@@ -0,0 +1,338 @@
+import array
+import asyncio
+import logging
+import math
+from datetime import date, timedelta
+
+from async_database import ACTIVITY_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Корзины растут в GAMMA раз: ошибка значения внутри корзины не больше 5%
+GAMMA = 1.05
+LOG_GAMMA = math.log(GAMMA)
+# Больше недели в неделе не бывает; все, что выше, попадает в последнюю корзину
+MAX_MINUTES = 7 * 24 * 60
+BUCKETS = int(math.log(MAX_MINUTES) / LOG_GAMMA) + 2
+
+# Сумма всех активностей пользователя за неделю: ее счетчик — число активных пользователей
+TOTAL = 'total'
+SKETCH_KEYS = ACTIVITY_TYPES + (TOTAL,)
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def bucket_of(minutes):
+    if minutes <= 0:
+        return 0
+    return min(int(math.log(minutes) / LOG_GAMMA) + 1, BUCKETS - 1)
+
+
+# Гистограмма недельных сумм с логарифмическими корзинами.
+# Память постоянная (BUCKETS счетчиков и дерево Фенвика для префиксных
+# сумм), значение переносится между корзинами и ранг считается за
+# O(log BUCKETS) — при 190 корзинах это 8 шагов. Гистограммы с разных
+# процессов складываются поэлементно (merge).
+class QuantileSketch:
+    __slots__ = ('counts', 'tree', 'total')
+
+    def __init__(self, counts=None):
+        self.counts = list(counts) if counts is not None else [0] * BUCKETS
+        self.total = sum(self.counts)
+        self.tree = [0] * (BUCKETS + 1)
+        for bucket, count in enumerate(self.counts):
+            if count:
+                self._update_tree(bucket, count)
+
+    def _update_tree(self, bucket, delta):
+        i = bucket + 1
+        while i <= BUCKETS:
+            self.tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, bucket):
+        # Число значений в корзинах [0, bucket)
+        total = 0
+        i = bucket
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def add(self, minutes, count=1):
+        bucket = bucket_of(minutes)
+        self.counts[bucket] += count
+        self.total += count
+        self._update_tree(bucket, count)
+
+    def move(self, old_minutes, new_minutes):
+        # Сумма пользователя изменилась: переносим его в новую корзину
+        old_bucket, new_bucket = bucket_of(old_minutes), bucket_of(new_minutes)
+        if old_bucket != new_bucket:
+            self.counts[old_bucket] -= 1
+            self._update_tree(old_bucket, -1)
+            self.counts[new_bucket] += 1
+            self._update_tree(new_bucket, 1)
+
+    def rank(self, minutes):
+        # Сколько значений меньше minutes; равные (та же корзина) делятся пополам
+        bucket = bucket_of(minutes)
+        return self._prefix(bucket) + self.counts[bucket] / 2
+
+    def merge(self, other):
+        return QuantileSketch(a + b for a, b in zip(self.counts, other.counts))
+
+    def to_bytes(self):
+        return array.array('I', self.counts).tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        counts = array.array('I')
+        counts.frombytes(data)
+        if len(counts) != BUCKETS:
+            raise ValueError(f"Гистограмма на {len(counts)} корзин вместо {BUCKETS}")
+        return cls(counts)
+
+
+class _Week:
+    __slots__ = ('totals', 'sketches', 'remote', 'dirty')
+
+    def __init__(self):
+        # user_id -> {активность: минуты за неделю}; только свои пользователи
+        self.totals = {}
+        self.sketches = {key: QuantileSketch() for key in SKETCH_KEYS}
+        # Сумма гистограмм других процессов (при запуске через supervisor.py)
+        self.remote = {}
+        self.dirty = False
+
+    def add(self, user_id, activity_type, minutes):
+        user_totals = self.totals.get(user_id)
+        if user_totals is None:
+            user_totals = self.totals[user_id] = {}
+            self.sketches[TOTAL].add(0)
+        old = user_totals.get(activity_type, 0)
+        user_totals[activity_type] = old + minutes
+        if old:
+            self.sketches[activity_type].move(old, old + minutes)
+        else:
+            self.sketches[activity_type].add(old + minutes)
+        old_total = sum(user_totals.values()) - minutes
+        self.sketches[TOTAL].move(old_total, old_total + minutes)
+        self.dirty = True
+
+    def remove_user(self, user_id):
+        user_totals = self.totals.pop(user_id, None)
+        if user_totals is None:
+            return
+        for activity_type, minutes in user_totals.items():
+            if minutes:
+                self.sketches[activity_type].add(minutes, -1)
+        self.sketches[TOTAL].add(sum(user_totals.values()), -1)
+        self.dirty = True
+
+    def users(self):
+        remote = self.remote.get(TOTAL)
+        return self.sketches[TOTAL].total + (remote.total if remote else 0)
+
+    def rank(self, key, minutes):
+        remote = self.remote.get(key)
+        return self.sketches[key].rank(minutes) + (remote.rank(minutes) if remote else 0)
+
+    def active(self, key):
+        # Пользователей с ненулевым временем по активности
+        remote = self.remote.get(key)
+        return self.sketches[key].total + (remote.total if remote else 0)
+
+
+# Сравнение пользователя со всеми: доля активных за неделю пользователей,
+# у которых времени по активности меньше, чем у него. Недельные суммы своих
+# пользователей и гистограммы по ним обновляются из потока новых записей
+# (entry_added из UserDataCache), так что запрос /rank не обращается к БД.
+# При запуске гистограммы строятся одним запросом по суточным агрегатам
+# за две последние недели. Через supervisor.py каждый процесс ведет только
+# своих пользователей (owns) и раз в sync_interval секунд обменивается
+# гистограммами через таблицу activity_sketches: чужие складываются со своими.
+class ActivityRanking:
+    def __init__(self, db, shard=None, owns=None, sync_interval=60.0):
+        self.db = db
+        self.shard = shard
+        self.owns = owns or (lambda user_id: True)
+        self.sync_interval = sync_interval
+
+        # понедельник -> _Week; хранятся текущая и прошлая недели
+        self.weeks = {}
+        self.task = None
+
+        # Метрики
+        self.entries_total = 0
+        self.lookups_total = 0
+        self.syncs_total = 0
+
+    def _week(self, day, create=False):
+        monday = week_start(day)
+        week = self.weeks.get(monday)
+        if week is None and create:
+            newest = max(self.weeks, default=monday)
+            if monday < newest - timedelta(days=7):
+                return None
+            week = self.weeks[monday] = _Week()
+            # Позапрошлая неделя больше не нужна
+            for old in [old for old in self.weeks if old < max(newest, monday) - timedelta(days=7)]:
+                del self.weeks[old]
+        return week
+
+    def _keep_from(self):
+        # Первый день, с которого нужны данные: понедельник прошлой недели
+        # (пользователи западнее сервера могут быть еще во вчерашнем дне)
+        return week_start(date.today() - timedelta(days=1)) - timedelta(days=7)
+
+    async def load(self):
+        start_date = self._keep_from()
+        end_date = date.today() + timedelta(days=1)
+        try:
+            rows = await self.db.get_weekly_totals(start_date, end_date)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки недельных сумм: {e}")
+            return
+        self.weeks = {}
+        for monday, user_id, activity_type, minutes in rows:
+            if minutes > 0 and self.owns(user_id):
+                self._week(monday, create=True).add(user_id, activity_type, minutes)
+        users = sum(len(week.totals) for week in self.weeks.values())
+        logger.info(f"Недельные суммы загружены: {users} пользователей-недель")
+        await self.sync()
+
+    def start(self):
+        if self.task is None and self.shard:
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.sync()
+
+    def stats(self):
+        return {
+            'weeks': len(self.weeks),
+            'users': sum(len(week.totals) for week in self.weeks.values()),
+            'entries_total': self.entries_total,
+            'lookups_total': self.lookups_total,
+            'syncs_total': self.syncs_total,
+        }
+
+    # --- Поток записей ---
+
+    def entry_added(self, user_id, activity_type, minutes, day):
+        week = self._week(day, create=True)
+        if week is not None and minutes > 0:
+            week.add(user_id, activity_type, minutes)
+            self.entries_total += 1
+
+    async def reload_user(self, user_id):
+        # После импорта: записи могли лечь в любые дни, пересчитываем недели
+        # пользователя по агрегатам
+        start_date = self._keep_from()
+        try:
+            rows = await self.db.get_user_statistics(
+                user_id, start_date, date.today() + timedelta(days=1)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка пересчета недельных сумм {user_id}: {e}")
+            return
+        for week in self.weeks.values():
+            week.remove_user(user_id)
+        for day_stats in rows:
+            for activity_type in ACTIVITY_TYPES:
+                self.entry_added(user_id, activity_type, day_stats.get(activity_type, 0),
+                                 day_stats['date'])
+
+    # --- Запросы ---
+
+    def rank(self, user_id, today):
+        # -> (число активных пользователей, {ключ: (минуты, процент меньше)})
+        # за неделю, в которую входит today (дата в поясе пользователя)
+        self.lookups_total += 1
+        week = self._week(today)
+        if week is None:
+            return 0, {}
+        users = week.users()
+        user_totals = week.totals.get(user_id, {})
+        result = {}
+        for key in SKETCH_KEYS:
+            minutes = sum(user_totals.values()) if key == TOTAL else user_totals.get(key, 0)
+            if not users or not minutes:
+                result[key] = (minutes, 0.0)
+                continue
+            if key == TOTAL:
+                below = week.rank(TOTAL, minutes)
+            else:
+                # У неактивных по этой активности пользователей ноль минут — они ниже
+                below = users - week.active(key) + week.rank(key, minutes)
+            # Сам пользователь в гистограмме — не сравниваем его с собой
+            result[key] = (minutes, min(100.0, max(0.0, (below - 0.5) * 100 / max(users - 1, 1))))
+        return users, result
+
+    # --- Обмен гистограммами между процессами ---
+
+    async def sync(self):
+        if not self.shard or not self.weeks:
+            return
+        keep_from = self._keep_from()
+        rows = [
+            (monday, key, sketch.to_bytes())
+            for monday, week in self.weeks.items() if week.dirty
+            for key, sketch in week.sketches.items()
+        ]
+        try:
+            await self.db.save_sketches(self.shard, rows, keep_from)
+            for week in self.weeks.values():
+                week.dirty = False
+            stored = await self.db.load_sketches(keep_from)
+        except Exception as e:
+            logger.error(f"Ошибка обмена гистограммами: {e}")
+            return
+
+        # Процессы с другим числом воркеров — остатки прежней конфигурации
+        workers = self.shard.split('/')[1]
+        remote = {}
+        for shard, monday, key, data in stored:
+            if shard == self.shard or shard.split('/')[1:] != [workers]:
+                continue
+            try:
+                sketch = QuantileSketch.from_bytes(data)
+            except ValueError as e:
+                logger.warning(f"Гистограмма процесса {shard} пропущена: {e}")
+                continue
+            week_sketches = remote.setdefault(monday, {})
+            week_sketches[key] = week_sketches[key].merge(sketch) if key in week_sketches else sketch
+        for monday, week in self.weeks.items():
+            week.remote = remote.get(monday, {})
+        self.syncs_total += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания рейтинга: {e}")
+
+
+# Командная таблица за неделю: один запрос к суточным агрегатам на всю команду.
+# -> [(user_id, {активность: минуты}, всего)] по убыванию key (активность или TOTAL)
+async def team_leaderboard(db, members, start_date, end_date, key=TOTAL):
+    stats = await db.get_users_statistics(list(members), start_date, end_date)
+    rows = []
+    for user_id in members:
+        totals = dict.fromkeys(ACTIVITY_TYPES, 0)
+        for day_stats in stats.get(user_id, []):
+            for activity_type in ACTIVITY_TYPES:
+                totals[activity_type] += day_stats.get(activity_type, 0)
+        rows.append((user_id, totals, sum(totals.values())))
+    rows.sort(key=lambda row: row[2] if key == TOTAL else row[1][key], reverse=True)
+    return rows
@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import logging
+
+from async_database import AsyncDatabase
+from sqlite_database import SQLiteDatabase
+import config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def create_database():
+    if getattr(config, 'DB_BACKEND', 'mysql') == 'sqlite':
+        return SQLiteDatabase(getattr(config, 'SQLITE_PATH', 'timetracker.db'), readers=1)
+    return AsyncDatabase(
+        host=config.MYSQL_HOST,
+        user=config.MYSQL_USER,
+        password=config.MYSQL_PASSWORD,
+        database=config.MYSQL_DATABASE,
+        pool_size=2
+    )
+
+
+# python manage.py rebuild-rollup [--user ID]
+async def cmd_rebuild_rollup(db, args):
+    rows = await db.rebuild_rollup(args.user)
+    print(f"Пересобрано строк агрегатов: {rows}")
+
+
+# python manage.py check-rollup [--user ID] [--fix]
+async def cmd_check_rollup(db, args):
+    mismatches = await db.check_rollup(args.user)
+    if not mismatches:
+        print("✅ Агрегаты совпадают с записями")
+        return 0
+
+    print(f"❌ Найдено расхождений: {len(mismatches)}")
+    for user_id, day, activity_type, expected, actual in mismatches[:50]:
+        print(f"  {user_id} {day} {activity_type}: записи {expected}, агрегат {actual}")
+
+    if args.fix:
+        # Пересобираем только затронутых пользователей
+        for user_id in sorted({row[0] for row in mismatches}):
+            await db.rebuild_rollup(user_id)
+        print("Агрегаты исправлены")
+        return 0
+    return 1
+
+
+COMMANDS = {
+    'rebuild-rollup': cmd_rebuild_rollup,
+    'check-rollup': cmd_check_rollup,
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Служебные команды Time Tracker Bot")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    rebuild = subparsers.add_parser('rebuild-rollup', help="Пересобрать суточные агрегаты")
+    rebuild.add_argument('--user', type=int, help="Только для одного пользователя")
+
+    check = subparsers.add_parser('check-rollup', help="Сверить агрегаты с записями")
+    check.add_argument('--user', type=int, help="Только для одного пользователя")
+    check.add_argument('--fix', action='store_true', help="Пересобрать расходящиеся агрегаты")
+
+    return parser
+
+
+async def main(args):
+    db = create_database()
+    await db.connect()
+    try:
+        return await COMMANDS[args.command](db, args) or 0
+    finally:
+        await db.close()
+
+
+if __name__ == '__main__':
+    raise SystemExit(asyncio.run(main(build_parser().parse_args())))
@@ -0,0 +1,282 @@
+import contextvars
+import functools
+import logging
+import random
+import time
+
+from aiohttp import web
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Трассировка текущего обновления: список (название, длительность) или None
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label_values -> [счетчики по корзинам..., сумма, количество]
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            series = [0] * len(self.buckets) + [0.0, 0]
+            self.values[label_values] = series
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labels + ('le',), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels + ('le',), label_values + ('+Inf',))
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+# Набор метрик с выводом в текстовом формате Prometheus.
+# Кроме счетчиков и гистограмм принимает функции stats() компонентов:
+# каждое числовое поле становится gauge с указанным префиксом.
+class Registry:
+    def __init__(self, prefix='timetracker'):
+        self.prefix = prefix
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(f"{self.prefix}_{name}", help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(f"{self.prefix}_{name}", help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_stats(self, name, stats_func):
+        self.collectors.append((f"{self.prefix}_{name}", stats_func))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for name, stats_func in self.collectors:
+            try:
+                stats = stats_func()
+            except Exception as e:
+                logger.error(f"Ошибка сбора метрик {name}: {e}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, dict):
+                    # Вложенный словарь — одна метрика с меткой key
+                    lines.append(f"# TYPE {name}_{key} gauge")
+                    for label, item in value.items():
+                        lines.append(f"{name}_{key}{_format_labels(('key',), (label,))} {float(item)}")
+                elif isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {name}_{key} gauge")
+                    lines.append(f"{name}_{key} {float(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+handler_latency = registry.histogram(
+    'handler_seconds', "Время работы обработчика", labels=('handler',))
+update_latency = registry.histogram(
+    'update_seconds', "Полное время обработки обновления", labels=('type',))
+call_latency = registry.histogram(
+    'call_seconds', "Время вызовов БД, отрисовки и Bot API", labels=('kind', 'name'))
+slow_updates = registry.counter(
+    'slow_updates_total', "Обновления медленнее порога трассировки")
+
+
+def _record_span(kind, name, elapsed):
+    call_latency.observe(elapsed, kind, name)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.append((f"{kind}.{name}", elapsed))
+
+
+# Обертка корутин-методов объекта замером времени
+def instrument(obj, method_names, kind):
+    for method_name in method_names:
+        method = getattr(obj, method_name, None)
+        if method is None:
+            continue
+
+        def make_wrapper(method, method_name):
+            @functools.wraps(method)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    _record_span(kind, method_name, time.perf_counter() - started)
+            return wrapper
+
+        setattr(obj, method_name, make_wrapper(method, method_name))
+
+
+# Замер всех запросов к Bot API через единую точку Bot.request
+def instrument_bot(bot):
+    request = bot.request
+
+    @functools.wraps(request)
+    async def timed_request(method, data=None, files=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await request(method, data, files, **kwargs)
+        finally:
+            _record_span('api', method, time.perf_counter() - started)
+
+    bot.request = timed_request
+
+
+def fsm_state_counts(storage):
+    # MemoryStorage хранит состояния в storage.data[chat][user]['state']
+    if hasattr(storage, 'state_counts'):
+        return storage.state_counts()
+    counts = {}
+    for users in getattr(storage, 'data', {}).values():
+        for record in users.values():
+            state = record.get('state')
+            if state is not None:
+                counts[state] = counts.get(state, 0) + 1
+    return counts
+
+
+# Middleware для dp: время обработчиков и обновлений, выборочная трассировка
+class MetricsMiddleware(BaseMiddleware):
+    def __init__(self, trace_sample_rate=0.0, slow_threshold=1.0):
+        super().__init__()
+        self.trace_sample_rate = trace_sample_rate
+        self.slow_threshold = slow_threshold
+
+    async def on_pre_process_update(self, update, data):
+        data['_metrics_started'] = time.perf_counter()
+        if self.trace_sample_rate and random.random() < self.trace_sample_rate:
+            data['_metrics_trace_token'] = current_trace.set([])
+
+    async def on_post_process_update(self, update, results, data):
+        started = data.get('_metrics_started')
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        update_type = next((field for field in ('message', 'callback_query')
+                            if getattr(update, field, None)), 'other')
+        update_latency.observe(elapsed, update_type)
+
+        token = data.get('_metrics_trace_token')
+        if token is None:
+            return
+        trace = current_trace.get()
+        current_trace.reset(token)
+        if elapsed >= self.slow_threshold:
+            slow_updates.inc()
+            breakdown = ', '.join(f"{name}={duration * 1000:.1f}мс" for name, duration in trace)
+            logger.warning(
+                f"Медленное обновление {update.update_id}: {elapsed * 1000:.1f}мс "
+                f"[{breakdown or 'нет вложенных вызовов'}]"
+            )
+
+    async def _pre_handler(self, data):
+        from aiogram.dispatcher.handler import current_handler
+        handler = current_handler.get()
+        data['_metrics_handler'] = getattr(handler, '__name__', 'unknown')
+        data['_metrics_handler_started'] = time.perf_counter()
+
+    async def _post_handler(self, data):
+        name = data.get('_metrics_handler')
+        if name is None:
+            return
+        elapsed = time.perf_counter() - data['_metrics_handler_started']
+        handler_latency.observe(elapsed, name)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.append((f"handler.{name}", elapsed))
+
+    async def on_process_message(self, message, data):
+        await self._pre_handler(data)
+
+    async def on_post_process_message(self, message, results, data):
+        await self._post_handler(data)
+
+    async def on_process_callback_query(self, callback_query, data):
+        await self._pre_handler(data)
+
+    async def on_post_process_callback_query(self, callback_query, results, data):
+        await self._post_handler(data)
+
+
+class MetricsServer:
+    def __init__(self, host='127.0.0.1', port=9100):
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def handle(self, request):
+        return web.Response(
+            text=registry.render(),
+            content_type='text/plain',
+            charset='utf-8',
+            headers={'X-Prometheus-Format': '0.0.4'}
+        )
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
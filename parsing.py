@@ -0,0 +1,174 @@
+import re
+from datetime import date, timedelta
+
+from activities import ACTIVITY_ALIASES, is_valid_duration
+
+# Разбор пользовательского ввода: продолжительность, дата отчета и строка
+# из нескольких записей. Каждый вид ввода — одно заранее скомпилированное
+# регулярное выражение, поэтому промах стоит один match, а не серию
+# перехваченных ValueError.
+
+RELATIVE_DAYS = {
+    'сегодня': 0,
+    'вчера': 1,
+    'позавчера': 2,
+}
+
+_HOURS = r'(?:ч|час|часа|часов|h)'
+_MINUTES = r'(?:м|мин|минут|минуты|минута|m|min)'
+
+# Продолжительность: «90», «1.5» / «1,5» (часы), «1:30», «2ч», «45м», «1ч 30м», «1.5ч»
+_DURATION = (
+    r'(?P<minutes>\d+)'
+    r'|(?P<decimal>\d+[.,]\d*|[.,]\d+)'
+    r'|(?P<clock_h>\d*)\s*:\s*(?P<clock_m>\d*)'
+    rf'|(?:(?P<h>\d+(?:[.,]\d+)?)\s*{_HOURS}\.?)?\s*(?:(?P<m>\d+)\s*{_MINUTES}\.?)?'
+)
+DURATION_RE = re.compile(rf'\s*(?:{_DURATION})\s*', re.IGNORECASE)
+_DURATION_GROUPS = ('minutes', 'decimal', 'clock_h', 'clock_m', 'h', 'm')
+
+
+def _date_pattern(prefix=''):
+    # Дата: ДД.ММ.ГГГГ, ДД-ММ-ГГГГ, ДД/ММ/ГГГГ и то же с двузначным годом
+    return (
+        rf'(?P<{prefix}word>' + '|'.join(RELATIVE_DAYS) + r')'
+        rf'|(?P<{prefix}day>\d{{1,2}})(?P<{prefix}sep>[./-])(?P<{prefix}month>\d{{1,2}})'
+        rf'(?P={prefix}sep)(?P<{prefix}year>\d{{4}}|\d{{2}})'
+    )
+
+
+DATE_RE = re.compile(rf'\s*(?:{_date_pattern()})\s*', re.IGNORECASE)
+
+# Период отчета: «01.10.2026-15.10.2026», «с 01.10.2026 по 15.10.2026»,
+# «прошлая неделя», «этот месяц», «последние 10 дней»
+PERIOD_RE = re.compile(
+    r'\s*(?:'
+    r'(?P<week>эта|текущая|прошлая)\s+неделя'
+    r'|(?P<month>этот|текущий|прошлый)\s+месяц'
+    r'|последние\s+(?P<last>\d+)\s+(?:дня|дней|день)'
+    rf'|(?:с\s+)?(?:{_date_pattern("s_")})\s*(?:[-–—]|по|до)\s*(?:{_date_pattern("e_")})'
+    r')\s*',
+    re.IGNORECASE
+)
+
+# Одна запись в строке вида «работа 2ч, учеба 45м»
+_ACTIVITY = '|'.join(re.escape(alias) for alias in sorted(ACTIVITY_ALIASES, key=len, reverse=True))
+_ENTRY_DURATION = (
+    rf'(?:(?P<h>\d+(?:[.,]\d+)?)\s*{_HOURS}\.?)?\s*(?:(?P<m>\d+)\s*{_MINUTES}\.?)?'
+    r'|(?P<clock_h>\d+):(?P<clock_m>\d{2})'
+    r'|(?P<minutes>\d+)'
+)
+ENTRY_RE = re.compile(
+    rf'\s*(?P<activity>{_ACTIVITY})\s*[:\-—]?\s*(?:{_ENTRY_DURATION})\s*(?P<sep>[,;+\n]|$)',
+    re.IGNORECASE
+)
+
+
+def _hours(text):
+    return int(float(text.replace(',', '.')) * 60)
+
+
+def _duration(minutes, decimal, clock_h, clock_m, h, m):
+    # Группы DURATION_RE или ENTRY_RE -> минуты; None, если продолжительности нет
+    if minutes is not None:
+        return int(minutes)
+    if decimal is not None:
+        return _hours(decimal)
+    if clock_h is not None:
+        return int(clock_h or 0) * 60 + int(clock_m or 0)
+    if h is None and m is None:
+        return None
+    return (_hours(h) if h else 0) + int(m or 0)
+
+
+def parse_duration(text):
+    # Минуты: «90», часы с дробью: «1.5» / «1,5», часы и минуты: «1:30» или «1ч 30м».
+    # Неверный формат — ValueError; диапазон проверяет вызывающий.
+    text = text.strip()
+    if text.isdigit():
+        # Самый частый ввод — целое число минут
+        return int(text)
+    match = DURATION_RE.fullmatch(text)
+    minutes = _duration(*match.group(*_DURATION_GROUPS)) if match else None
+    if minutes is None:
+        raise ValueError("Неверный формат продолжительности")
+    return minutes
+
+
+def _match_date(match, prefix='', today=None):
+    word = match[prefix + 'word']
+    if word:
+        return (today or date.today()) - timedelta(days=RELATIVE_DAYS[word.lower()])
+    year_text = match[prefix + 'year']
+    year = int(year_text)
+    if len(year_text) == 2:
+        # Как %y в strptime: 69–99 — XX век, 00–68 — XXI
+        year += 1900 if year >= 69 else 2000
+    return date(year, int(match[prefix + 'month']), int(match[prefix + 'day']))
+
+
+def parse_date(text, today=None):
+    # Дата в формате ДД.ММ.ГГГГ (или через «-» и «/», год из двух или четырех
+    # цифр) либо слово «сегодня»/«вчера»/«позавчера» относительно today
+    match = DATE_RE.fullmatch(text)
+    if match is None:
+        raise ValueError("Неверный формат даты")
+    return _match_date(match, today=today)
+
+
+def parse_period(text, today=None):
+    # Дата или период -> (первый день, последний день); ValueError при ошибке
+    today = today or date.today()
+    match = PERIOD_RE.fullmatch(text)
+    if match is None:
+        day = parse_date(text, today)
+        return day, day
+
+    if match['week']:
+        monday = today - timedelta(days=today.weekday())
+        if match['week'].lower() == 'прошлая':
+            return monday - timedelta(days=7), monday - timedelta(days=1)
+        return monday, today
+    if match['month']:
+        first = today.replace(day=1)
+        if match['month'].lower() == 'прошлый':
+            last = first - timedelta(days=1)
+            return last.replace(day=1), last
+        return first, today
+    if match['last']:
+        days = int(match['last'])
+        if days < 1:
+            raise ValueError("Неверный период")
+        try:
+            return today - timedelta(days=days - 1), today
+        except OverflowError:
+            # «последние 99999999 дней» уходят раньше 1 года нашей эры
+            raise ValueError("Слишком длинный период")
+
+    start_date, end_date = _match_date(match, 's_', today), _match_date(match, 'e_', today)
+    if start_date > end_date:
+        raise ValueError("Начало периода позже конца")
+    return start_date, end_date
+
+
+def parse_entries(text):
+    # «работа 2ч, учеба 45м» -> [('work', 120), ('study', 45)].
+    # None, если строка не целиком состоит из записей; ValueError, если
+    # продолжительность записи вне допустимого диапазона.
+    entries = []
+    pos = 0
+    end = len(text)
+    while pos < end:
+        match = ENTRY_RE.match(text, pos)
+        if match is None or match.end() == pos:
+            return None
+        minutes = _duration(match['minutes'], None, *match.group(*_DURATION_GROUPS[2:]))
+        if minutes is None:
+            return None
+        if not is_valid_duration(minutes):
+            raise ValueError(f"Некорректное время: {match['activity'].strip()}")
+        entries.append((ACTIVITY_ALIASES[match['activity'].lower()], minutes))
+        pos = match.end()
+        if not match['sep'] and pos < end:
+            return None
+    return entries or None
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+# Код ниже выполняется в процессах-воркерах
+def _warm_worker():
+    # Импортируем библиотеку графиков заранее, чтобы первый отчет
+    # не платил за импорт matplotlib и построение кэша шрифтов
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot  # noqa: F401
+    import charts  # noqa: F401
+
+
+def _ping():
+    return True
+
+
+def _render_daily_report(report_data, report_date):
+    # PNG строится в памяти (BytesIO), без временных файлов
+    from charts import daily_report_chart
+    return daily_report_chart(report_data, report_date)
+
+
+def _render_range_report(rows, start_date, end_date, bucket_days):
+    from charts import range_report_chart
+    return range_report_chart(rows, start_date, end_date, bucket_days)
+
+
+# Пул процессов для построения диаграмм вне цикла событий
+class ChartRenderPool:
+    def __init__(self, workers=2, max_queue=8, timeout=30.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.executor = None
+
+        # Задачи, отправленные в пул (выполняются или ждут в очереди).
+        # Задача после таймаута остается в счете, пока воркер ее не закончит:
+        # процесс занят ею, и новые задачи встают в очередь за ней
+        self.pending = 0
+
+        # Метрики
+        self.rendered_total = 0
+        self.rejected_total = 0
+        self.timeouts_total = 0
+        self.errors_total = 0
+        self.render_time_total = 0.0
+
+    def start(self):
+        if self.executor is not None:
+            return
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_warm_worker
+        )
+        # Запускаем все процессы сразу, чтобы они прогрелись до первого отчета
+        for _ in range(self.workers):
+            self.executor.submit(_ping)
+        logger.info(f"Пул отрисовки запущен (процессов: {self.workers})")
+
+    def shutdown(self):
+        if self.executor is None:
+            return
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        logger.info("Пул отрисовки остановлен")
+
+    async def close(self):
+        # При остановке бота дожидаемся процессов пула. В воркере супервизора
+        # multiprocessing при выходе ждет дочерние процессы раньше, чем
+        # concurrent.futures посылает им сигнал завершения, и процесс зависает
+        executor = self.executor
+        if executor is None:
+            return
+        self.executor = None
+        await asyncio.get_running_loop().run_in_executor(
+            None, partial(executor.shutdown, wait=True, cancel_futures=True)
+        )
+        logger.info("Пул отрисовки остановлен")
+
+    def is_saturated(self):
+        return self.pending >= self.workers + self.max_queue
+
+    def queue_position(self):
+        # Сколько задач будет перед новой задачей в очереди
+        return max(0, self.pending - self.workers + 1)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'pending': self.pending,
+            'queued': max(0, self.pending - self.workers),
+            'max_queue': self.max_queue,
+            'rendered_total': self.rendered_total,
+            'rejected_total': self.rejected_total,
+            'timeouts_total': self.timeouts_total,
+            'errors_total': self.errors_total,
+            'render_time_total': self.render_time_total,
+        }
+
+    async def _run(self, func, *args):
+        if self.executor is None:
+            self.start()
+        if self.is_saturated():
+            self.rejected_total += 1
+            raise RenderQueueFull("Очередь отрисовки переполнена")
+
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        job = self.executor.submit(func, *args)
+        self.pending += 1
+        job.add_done_callback(lambda _: self._job_done(loop))
+        try:
+            # При таймауте задача из очереди отменяется, а уже выполняемая
+            # дорабатывает в воркере
+            result = await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts_total += 1
+            raise RenderTimeout(f"Отрисовка не уложилась в {self.timeout} с")
+        except BrokenProcessPool:
+            # Процесс-воркер упал: пересоздаем пул для следующих задач
+            self.errors_total += 1
+            logger.error("Пул отрисовки сломан, перезапускаем")
+            self.shutdown()
+            self.start()
+            raise
+        except Exception:
+            self.errors_total += 1
+            raise
+
+        self.rendered_total += 1
+        self.render_time_total += time.monotonic() - started
+        return result
+
+    def _job_done(self, loop):
+        # Вызывается из потока пула, когда задача закончилась или отменена
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # Цикл событий уже закрыт (остановка бота)
+            pass
+
+    def _release(self):
+        self.pending -= 1
+
+    async def render_daily_report(self, report_data, report_date, user_id):
+        return await self._run(_render_daily_report, dict(report_data), report_date)
+
+    async def render_range_report(self, rows, start_date, end_date, bucket_days=1):
+        return await self._run(_render_range_report, rows, start_date, end_date, bucket_days)
@@ -0,0 +1,253 @@
+from operator import itemgetter
+
+from activities import ACTIVITY_MAP, MAX_DURATION
+from timezones import to_local
+
+# Тексты сообщений: общие для команд бота и автоматических сводок (digest.py).
+# Постоянные части собраны заранее, сообщение склеивается одним join.
+
+DAYS_RU = ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')
+MONTHS_RU = ('январь', 'февраль', 'март', 'апрель', 'май', 'июнь',
+             'июль', 'август', 'сентябрь', 'октябрь', 'ноябрь', 'декабрь')
+MONTHS_SHORT_RU = ('Янв', 'Фев', 'Мар', 'Апр', 'Май', 'Июн',
+                   'Июл', 'Авг', 'Сен', 'Окт', 'Ноя', 'Дек')
+
+
+class Activity:
+    __slots__ = ('activity_type', 'name', 'index')
+
+    def __init__(self, activity_type, name, index):
+        object.__setattr__(self, 'activity_type', activity_type)
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'index', index)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Activity is read-only")
+
+
+# Тип активности -> Activity; неизвестный тип показывается как есть
+ACTIVITIES = {
+    activity_type: Activity(activity_type, name, i)
+    for i, (name, activity_type) in enumerate(ACTIVITY_MAP.items())
+}
+
+
+def activity_name(activity_type):
+    activity = ACTIVITIES.get(activity_type)
+    return activity.name if activity else activity_type
+
+
+# Готовые строки для продолжительностей одной записи
+_FULL = tuple(f"{m // 60}ч {m % 60}м" for m in range(MAX_DURATION + 1))
+_COMPACT = tuple(f"{m // 60}ч {m % 60}м" if m >= 60 else f"{m}м" for m in range(MAX_DURATION + 1))
+
+
+def format_duration(minutes, compact=False):
+    # Минуты -> «Xч Yм»; compact опускает нулевые часы («45м»)
+    if 0 <= minutes <= MAX_DURATION:
+        return _COMPACT[minutes] if compact else _FULL[minutes]
+    if compact and minutes < 60:
+        return f"{minutes}м"
+    return f"{minutes // 60}ч {minutes % 60}м"
+
+
+def _clock(created_at):
+    # «ГГГГ-ММ-ДД ЧЧ:ММ:СС» (или datetime) -> «ЧЧ:ММ»
+    if not isinstance(created_at, str):
+        return created_at.strftime('%H:%M')
+    if len(created_at) >= 16 and created_at[10] == ' ':
+        return created_at[11:16]
+    return created_at.split(' ')[1][:5] if ' ' in created_at else created_at[:5]
+
+
+def _by_duration(totals):
+    # [(активность, минуты)] с ненулевым временем по убыванию
+    return sorted([item for item in totals.items() if item[1] > 0], key=itemgetter(1), reverse=True)
+
+
+def added_text(activity_type, minutes, when=None):
+    parts = [
+        "✅ <b>Добавлено!</b>\n\n<b>Активность:</b> ", activity_name(activity_type),
+        "\n<b>Время:</b> ", format_duration(minutes),
+    ]
+    if when is not None:
+        parts += ("\n<b>Когда:</b> ", when.strftime('%H:%M'))
+    return ''.join(parts)
+
+
+def today_text(entries, zone=None):
+    # entries — результат get_user_entries_by_date, время показывается в поясе zone
+    parts = ["📊 <b>Сегодняшние активности:</b>\n\n"]
+    append = parts.append
+    total_minutes = 0
+    for entry in entries:
+        duration = entry['duration_minutes']
+        total_minutes += duration
+        append(
+            f"• {activity_name(entry['activity_type'])}: <b>{format_duration(duration, True)}</b> "
+            f"(в {_clock(to_local(entry['created_at'], zone))})\n"
+        )
+    append(f"\n⏱️ <b>Всего:</b> {format_duration(total_minutes)}")
+    return ''.join(parts)
+
+
+def _report_lines(parts, totals, total_minutes):
+    for activity_type, duration in _by_duration(totals):
+        percentage = duration * 100 / total_minutes
+        parts.append(
+            f"{activity_name(activity_type)}: <b>{format_duration(duration, True)}</b> "
+            f"({percentage:.1f}%)\n"
+        )
+
+
+def daily_report_text(report_date, report_data):
+    # report_data — результат get_daily_report: {активность: минуты}
+    total_minutes = sum(report_data.values())
+    parts = [f"📊 <b>Отчет за {report_date.strftime('%d.%m.%Y')}</b>\n\n"]
+    _report_lines(parts, report_data, total_minutes)
+    parts.append(f"\n⏱️ <b>Всего:</b> {format_duration(total_minutes)}")
+    return ''.join(parts)
+
+
+# Не больше REPORT_MAX_BARS столбцов на диаграмме периода: длинные периоды
+# агрегируются в БД по несколько дней
+REPORT_MAX_BARS = 31
+
+
+def range_bucket_days(start_date, end_date, max_bars=REPORT_MAX_BARS):
+    days = (end_date - start_date).days + 1
+    return -(-days // max_bars)
+
+
+def range_totals(rows):
+    totals = dict.fromkeys(ACTIVITIES, 0)
+    for day_stats in rows:
+        for activity_type, minutes in day_stats.items():
+            if activity_type != 'date':
+                totals[activity_type] = totals.get(activity_type, 0) + minutes
+    return totals
+
+
+def range_report_text(start_date, end_date, rows):
+    # rows — результат get_range_report за период
+    totals = range_totals(rows)
+    total_minutes = sum(totals.values())
+    days = (end_date - start_date).days + 1
+    parts = [
+        f"📊 <b>Отчет за {start_date.strftime('%d.%m.%Y')} - "
+        f"{end_date.strftime('%d.%m.%Y')}</b> ({days} дн.)\n\n"
+    ]
+    _report_lines(parts, totals, total_minutes)
+    parts.append(f"\n📊 <b>Среднее в день:</b> {format_duration(total_minutes // days)}")
+    parts.append(f"\n⏱️ <b>Всего:</b> {format_duration(total_minutes)}")
+    return ''.join(parts)
+
+
+# Строки «активность: время (процент)» по убыванию времени
+def activity_breakdown(period):
+    percentages = period.percentages()
+    return ''.join(
+        f"{activity_name(activity_type)}: <b>{format_duration(duration, True)}</b> "
+        f"({percentages[activity_type]:.1f}%)\n"
+        for activity_type, duration in _by_duration(period.totals())
+    )
+
+
+def _period_footer(period, label):
+    return (
+        f"\n📊 <b>Среднее в день:</b> {format_duration(period.daily_average())}"
+        f"\n📅 <b>Активных дней:</b> {period.active_days()} из {period.days}"
+        f"\n⏱️ <b>Всего за {label}:</b> {format_duration(period.total)}"
+    )
+
+
+def _best_window_text(title, best):
+    if not best:
+        return ""
+    start, end, total = best
+    return (
+        f"\n🔥 <b>{title}:</b> {start.strftime('%d.%m')} - "
+        f"{end.strftime('%d.%m')} ({format_duration(total)})"
+    )
+
+
+def stats_text(period):
+    # period — PeriodStats за 30 дней
+    return ''.join((
+        "📈 <b>Статистика за 30 дней</b>\n\n",
+        activity_breakdown(period),
+        f"\n⏱️ <b>Всего за 30 дней:</b> {format_duration(period.total)}",
+        f"\n📅 <b>Период:</b> {period.start_date.strftime('%d.%m')} - "
+        f"{period.end_date.strftime('%d.%m.%Y')}",
+    ))
+
+
+def week_report_text(period, title="📅 <b>Недельная статистика</b>"):
+    # period — PeriodStats за 7 дней
+    parts = [f"{title}\n\n"]
+    for day_date, day_total in zip(period.dates(), period.daily_totals().tolist()):
+        day = f"<b>{DAYS_RU[day_date.weekday()]} {day_date.strftime('%d.%m')}:</b> "
+        parts.append(day + (format_duration(day_total) if day_total > 0 else "нет данных") + "\n")
+    parts.append(f"\n📊 <b>Среднее в день:</b> {format_duration(period.daily_average())}")
+    parts.append(f"\n⏱️ <b>Всего за неделю:</b> {format_duration(period.total)}")
+    return ''.join(parts)
+
+
+def month_report_text(period, month_date):
+    parts = [
+        f"🗓 <b>Статистика за {MONTHS_RU[month_date.month - 1]} {month_date.year}</b>\n\n",
+        activity_breakdown(period),
+        "\n<b>В среднем по дням недели:</b>\n",
+    ]
+    for day_name, day_avg in zip(DAYS_RU, period.weekday_average().tolist()):
+        parts.append(f"{day_name}: {format_duration(day_avg)}\n")
+    parts.append(_best_window_text("Лучшая неделя", period.best_window(7)))
+    parts.append(_period_footer(period, "месяц"))
+    return ''.join(parts)
+
+
+def year_report_text(period, year):
+    parts = [
+        f"📆 <b>Статистика за {year} год</b>\n\n",
+        activity_breakdown(period),
+        "\n<b>По месяцам:</b>\n",
+    ]
+    for (_, month), month_total in period.monthly_totals():
+        total = format_duration(month_total) if month_total > 0 else "нет данных"
+        parts.append(f"{MONTHS_SHORT_RU[month - 1]}: {total}\n")
+    parts.append(_best_window_text("Лучшие 30 дней", period.best_window(30)))
+    parts.append(_period_footer(period, "год"))
+    return ''.join(parts)
+
+
+def rank_text(users, total, activities, week_start):
+    # total — (минуты, процент пользователей с меньшим временем) из
+    # ActivityRanking.rank, activities — то же по каждой активности
+    parts = [f"🏆 <b>Рейтинг недели с {week_start.strftime('%d.%m')}</b>\n\n"]
+    minutes, percent = total
+    if not minutes:
+        parts.append("На этой неделе у вас пока нет записей.")
+        return ''.join(parts)
+    parts.append(f"⏱️ <b>Всего:</b> {format_duration(minutes)} — больше, чем у {percent:.0f}%\n\n")
+    for activity_type, _ in _by_duration({key: value[0] for key, value in activities.items()}):
+        minutes, percent = activities[activity_type]
+        parts.append(f"{activity_name(activity_type)}: {format_duration(minutes)} — "
+                     f"больше, чем у {percent:.0f}%\n")
+    parts.append(f"\n<i>Сравнение с {users} активными за неделю пользователями</i>")
+    return ''.join(parts)
+
+
+def team_text(team, rows, names, week_start):
+    # rows — [(user_id, {активность: минуты}, всего)] из team_leaderboard
+    parts = [f"👥 <b>Команда {team}</b>, неделя с {week_start.strftime('%d.%m')}\n\n"]
+    for place, (user_id, totals, total) in enumerate(rows, 1):
+        name = names.get(user_id) or str(user_id)
+        parts.append(f"{place}. {name} — <b>{format_duration(total)}</b>")
+        top = _by_duration(totals)[:2]
+        if top:
+            parts.append(" (" + ", ".join(
+                f"{activity_name(activity_type)} {format_duration(minutes, compact=True)}"
+                for activity_type, minutes in top
+            ) + ")")
+        parts.append("\n")
+    return ''.join(parts)
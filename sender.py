@@ -0,0 +1,333 @@
+import asyncio
+import contextvars
+import heapq
+import io
+import itertools
+import logging
+import os
+import time
+
+from aiogram import types
+from aiogram.utils.exceptions import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше — раньше
+PRIORITY_TEXT = 0
+PRIORITY_PHOTO = 1
+PRIORITY_DOCUMENT = 2
+# Рассылки (сводки) уступают ответам пользователям
+PRIORITY_BULK = 3
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'chat_id', 'method', 'kwargs', 'future',
+                 'key', 'not_before', 'enqueued', 'attempts', 'cancelled', 'started',
+                 'context')
+
+    def __init__(self, priority, seq, chat_id, method, kwargs, key, not_before):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.future = asyncio.get_running_loop().create_future()
+        self.key = key
+        self.not_before = not_before
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+        self.cancelled = False
+        self.started = False
+        # Контекст отправителя (например, трассировка обновления из metrics)
+        self.context = contextvars.copy_context()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+# Отложенное служебное сообщение («⏳ Генерирую отчет...»).
+# Если работа закончилась до задержки, сообщение так и не отправляется.
+class Placeholder:
+    def __init__(self, scheduler, job):
+        self.scheduler = scheduler
+        self.job = job
+
+    async def discard(self):
+        job, self.job = self.job, None
+        if job is None:
+            return
+        if not job.future.done() and not job.started:
+            job.cancelled = True
+            job.future.set_result(None)
+            self.scheduler.skipped_total += 1
+            return
+        try:
+            # Сообщение уже отправляется: дождемся его и удалим
+            message = await job.future
+        except Exception:
+            return
+        if message is not None:
+            await self.scheduler.delete_message(message.chat.id, message.message_id)
+
+
+# Единая очередь исходящих сообщений с учетом ограничений Telegram:
+# общий и поканальный token bucket, повтор после RetryAfter,
+# приоритет текста над фото и схлопывание устаревших сообщений по ключу.
+class OutboundScheduler:
+    def __init__(self, bot, global_rate=30, chat_rate=1.0, chat_burst=3,
+                 max_concurrency=20, max_retries=3):
+        self.bot = bot
+        # Всплеск не меньше одного сообщения, даже если лимит на процесс дробный
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+        self.heap = []
+        self.by_key = {}
+        self.seq = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.paused_until = 0.0
+        self.task = None
+        self.sending = set()
+
+        # Метрики
+        self.sent_total = 0
+        self.failed_total = 0
+        self.retries_total = 0
+        self.coalesced_total = 0
+        self.skipped_total = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self, timeout=10.0):
+        # Отправляем то, что уже в очереди, но не дольше timeout
+        deadline = time.monotonic() + timeout
+        while (self.heap or self.sending) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def queue_depth(self):
+        return sum(1 for job in self.heap if not job.cancelled)
+
+    def stats(self):
+        sent = self.sent_total
+        return {
+            'queue_depth': self.queue_depth(),
+            'in_flight': len(self.sending),
+            'sent_total': sent,
+            'failed_total': self.failed_total,
+            'retries_total': self.retries_total,
+            'coalesced_total': self.coalesced_total,
+            'skipped_total': self.skipped_total,
+            'latency_avg': self.latency_total / sent if sent else 0.0,
+            'latency_max': self.latency_max,
+        }
+
+    # --- Постановка в очередь ---
+
+    def _enqueue(self, priority, chat_id, method, kwargs, key=None, delay=0.0):
+        self.start()
+        if key is not None:
+            # Новое сообщение с тем же ключом заменяет еще не отправленное.
+            # Уже отправляемое не прервать, но после флуд-лимита оно не повторится
+            old = self.by_key.pop(key, None)
+            if old is not None and not old.future.done():
+                old.cancelled = True
+                if not old.started:
+                    old.future.set_result(None)
+                    self.coalesced_total += 1
+
+        job = _Job(priority, next(self.seq), chat_id, method, kwargs, key,
+                   time.monotonic() + delay)
+        if key is not None:
+            self.by_key[key] = job
+        heapq.heappush(self.heap, job)
+        self.wakeup.set()
+        return job
+
+    async def send_message(self, chat_id, text, key=None, priority=PRIORITY_TEXT, **kwargs):
+        kwargs.update(chat_id=chat_id, text=text)
+        job = self._enqueue(priority, chat_id, 'send_message', kwargs, key)
+        return await job.future
+
+    async def answer(self, message, text, key=None, **kwargs):
+        return await self.send_message(message.chat.id, text, key=key, **kwargs)
+
+    async def send_photo(self, chat_id, photo, key=None, priority=PRIORITY_PHOTO, **kwargs):
+        # photo — file_id или байты PNG; байты оборачиваются заново при каждой попытке
+        kwargs.update(chat_id=chat_id, photo=photo)
+        job = self._enqueue(priority, chat_id, 'send_photo', kwargs, key)
+        return await job.future
+
+    async def send_document(self, chat_id, document, key=None, **kwargs):
+        # document — file_id, байты или путь (pathlib.Path) к файлу на диске
+        kwargs.update(chat_id=chat_id, document=document)
+        job = self._enqueue(PRIORITY_DOCUMENT, chat_id, 'send_document', kwargs, key)
+        return await job.future
+
+    async def edit_message_text(self, chat_id, message_id, text, key=None, **kwargs):
+        kwargs.update(chat_id=chat_id, message_id=message_id, text=text)
+        job = self._enqueue(PRIORITY_TEXT, chat_id, 'edit_message_text', kwargs,
+                            key or ('edit', chat_id, message_id))
+        return await job.future
+
+    async def delete_message(self, chat_id, message_id):
+        job = self._enqueue(PRIORITY_TEXT, chat_id, 'delete_message',
+                            {'chat_id': chat_id, 'message_id': message_id})
+        return await job.future
+
+    def placeholder(self, chat_id, text, delay=1.0, **kwargs):
+        kwargs.update(chat_id=chat_id, text=text)
+        job = self._enqueue(PRIORITY_TEXT, chat_id, 'send_message', kwargs, delay=delay)
+        return Placeholder(self, job)
+
+    # --- Отправка ---
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= 10000:
+                self._prune_buckets()
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_buckets(self):
+        # Полные корзины ничем не отличаются от новых, их можно забыть
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self.chat_buckets.items()
+                        if bucket.wait_time(now) == 0 and bucket.tokens >= bucket.capacity]:
+            del self.chat_buckets[chat_id]
+
+    def _next_ready(self, now):
+        # Первая по приоритету задача, которую можно отправить сейчас,
+        # и время ожидания до ближайшей, если таких нет
+        skipped = []
+        ready = None
+        wait = None
+        while self.heap:
+            job = heapq.heappop(self.heap)
+            if job.cancelled:
+                continue
+            job_wait = max(job.not_before - now, self._chat_bucket(job.chat_id).wait_time(now))
+            if job_wait <= 0:
+                ready = job
+                break
+            skipped.append(job)
+            wait = job_wait if wait is None else min(wait, job_wait)
+        for job in skipped:
+            heapq.heappush(self.heap, job)
+        return ready, wait
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            pause = max(self.paused_until - now, self.global_bucket.wait_time(now))
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            job, wait = self._next_ready(now)
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.global_bucket.consume(now)
+            self._chat_bucket(job.chat_id).consume(now)
+            job.started = True
+            await self.semaphore.acquire()
+            task = job.context.run(asyncio.create_task, self._send(job))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    def _forget_key(self, job):
+        # Ключ помнит задачу, пока она в очереди или отправляется
+        if job.key is not None and self.by_key.get(job.key) is job:
+            del self.by_key[job.key]
+
+    async def _send(self, job):
+        try:
+            kwargs = dict(job.kwargs)
+            filename = kwargs.pop('filename', 'report.png')
+            for field in ('photo', 'document'):
+                value = kwargs.get(field)
+                if isinstance(value, bytes):
+                    kwargs[field] = types.InputFile(io.BytesIO(value), filename=filename)
+                elif isinstance(value, os.PathLike):
+                    # Файл на диске открывается заново при каждой попытке
+                    kwargs[field] = types.InputFile(os.fspath(value), filename=filename)
+            result = await getattr(self.bot, job.method)(**kwargs)
+        except RetryAfter as e:
+            job.attempts += 1
+            self.retries_total += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + e.timeout)
+            logger.warning(f"Флуд-лимит Telegram, пауза {e.timeout} с")
+            if job.cancelled:
+                # Пока шла попытка, поставлено более новое сообщение с тем же
+                # ключом: повторять устаревшее незачем
+                self.coalesced_total += 1
+                if not job.future.done():
+                    job.future.set_result(None)
+            elif job.attempts <= self.max_retries:
+                # Задача снова в очереди и по-прежнему заменяется по ключу
+                job.not_before = time.monotonic() + e.timeout
+                job.started = False
+                heapq.heappush(self.heap, job)
+                self.wakeup.set()
+                return
+            elif not job.future.done():
+                self.failed_total += 1
+                job.future.set_exception(e)
+            self._forget_key(job)
+            return
+        except Exception as e:
+            self.failed_total += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+            self._forget_key(job)
+            return
+        finally:
+            self.semaphore.release()
+
+        self._forget_key(job)
+        latency = time.monotonic() - job.enqueued
+        self.sent_total += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        if not job.future.done():
+            job.future.set_result(result)
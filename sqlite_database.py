@@ -0,0 +1,873 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from async_database import ACTIVITY_TYPES
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        timezone TEXT NULL,
+        team TEXT NULL,
+        created_at TEXT NOT NULL,
+        digest_daily INTEGER NOT NULL DEFAULT 0,
+        digest_weekly INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS time_entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        activity_type TEXT NOT NULL,
+        duration_minutes INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        local_date TEXT NOT NULL,
+        import_key TEXT NULL
+    )
+    """,
+    # Покрывающий индекс: записи за день и выгрузка читаются только из индекса,
+    # id сразу после created_at дает порядок выгрузки (created_at, id) без сортировки
+    """
+    CREATE INDEX IF NOT EXISTS idx_user_created
+    ON time_entries (user_id, created_at, id, activity_type, duration_minutes)
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_user_import
+    ON time_entries (user_id, import_key) WHERE import_key IS NOT NULL
+    """,
+    # Суточные агрегаты хранятся упорядоченными по ключу (WITHOUT ROWID):
+    # отчеты и статистика — один проход по диапазону ключа
+    """
+    CREATE TABLE IF NOT EXISTS daily_rollup (
+        user_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        activity_type TEXT NOT NULL,
+        total_minutes INTEGER NOT NULL DEFAULT 0,
+        entries_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day, activity_type)
+    ) WITHOUT ROWID
+    """,
+    # Недельные суммы всех пользователей (leaderboard.py) читаются по дням
+    """
+    CREATE INDEX IF NOT EXISTS idx_day
+    ON daily_rollup (day, user_id, activity_type, total_minutes)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS activity_sketches (
+        shard TEXT NOT NULL,
+        week TEXT NOT NULL,
+        sketch TEXT NOT NULL,
+        counts BLOB NOT NULL,
+        PRIMARY KEY (shard, week, sketch)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS running_timers (
+        user_id INTEGER PRIMARY KEY,
+        activity_type TEXT NOT NULL,
+        started_at TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS digest_deliveries (
+        kind TEXT NOT NULL,
+        period TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        claimed_by TEXT NULL,
+        claimed_at TEXT NULL,
+        sent_at TEXT NULL,
+        PRIMARY KEY (kind, period, user_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_run_status
+    ON digest_deliveries (kind, period, status, user_id)
+    """,
+)
+
+# Столбцы, появившиеся позже: (таблица, столбец, ALTER, заполнение старых строк)
+MIGRATIONS = (
+    ('users', 'timezone', "ALTER TABLE users ADD COLUMN timezone TEXT NULL", None),
+    ('users', 'team', "ALTER TABLE users ADD COLUMN team TEXT NULL", None),
+    # Старые записи получают день сервера
+    ('time_entries', 'local_date', "ALTER TABLE time_entries ADD COLUMN local_date TEXT NULL",
+     "UPDATE time_entries SET local_date = date(created_at)"),
+)
+
+# Индексы по столбцам из MIGRATIONS создаются после них
+LATE_INDEXES = (
+    # Записи за день в поясе пользователя читаются только из индекса, уже по порядку
+    """
+    CREATE INDEX IF NOT EXISTS idx_user_local
+    ON time_entries (user_id, local_date, created_at, id, activity_type, duration_minutes)
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_team ON users (team)",
+)
+
+# Прибавление к агрегату дня (как ON DUPLICATE KEY UPDATE в MySQL)
+ROLLUP_ADD = (
+    "INSERT INTO daily_rollup (user_id, day, activity_type, total_minutes, entries_count) "
+    "VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (user_id, day, activity_type) DO UPDATE SET "
+    "total_minutes = total_minutes + excluded.total_minutes, "
+    "entries_count = entries_count + excluded.entries_count"
+)
+
+
+def _timestamp(value):
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def _now():
+    # Локальное время, как NOW() в MySQL (CURRENT_TIMESTAMP в SQLite — UTC)
+    return datetime.now().replace(microsecond=0)
+
+
+# Реализация интерфейса AsyncDatabase поверх SQLite для одного узла и тестов.
+# - Журнал WAL: чтения не блокируются записью и идут параллельно в пуле
+#   из readers потоков, у каждого свое соединение.
+# - Все записи выполняются по очереди в одном потоке со своим соединением,
+#   поэтому транзакции не конкурируют за блокировку файла.
+# - SQL-тексты постоянные, и sqlite3 переиспользует подготовленные выражения
+#   из кэша соединения (cached_statements).
+# acquire() нет: общее хранилище FSM (FSM_STORAGE = 'mysql') требует MySQL.
+class SQLiteDatabase:
+    def __init__(self, path, readers=4, busy_timeout=5.0, cached_statements=256):
+        self.path = path
+        self.readers = readers
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+
+        self._writer = None
+        self._reader_pool = None
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        # Метрики
+        self._writes_pending = 0
+        self._writes_total = 0
+        self._reads_total = 0
+        self._write_time_total = 0.0
+
+    # --- Соединения и потоки ---
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        # В WAL synchronous=NORMAL не теряет целостность, только последние
+        # транзакции при отключении питания
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        self._local.conn = conn
+        with self._connections_lock:
+            self._connections.append(conn)
+
+    def _create_tables(self):
+        conn = self._local.conn
+        for statement in SCHEMA:
+            conn.execute(statement)
+        for table, column, alter, backfill in MIGRATIONS:
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+            if column not in columns:
+                conn.execute(alter)
+                if backfill:
+                    conn.execute(backfill)
+        for statement in LATE_INDEXES:
+            conn.execute(statement)
+
+    def _transaction(self, func, args):
+        conn = self._local.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _read_call(self, func, args):
+        return func(self._local.conn, *args)
+
+    async def _write(self, func, *args):
+        if self._writer is None:
+            raise RuntimeError("База данных не подключена")
+        started = time.monotonic()
+        self._writes_pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._writer, self._transaction, func, args
+            )
+        finally:
+            self._writes_pending -= 1
+            self._writes_total += 1
+            self._write_time_total += time.monotonic() - started
+
+    async def _read(self, func, *args):
+        if self._reader_pool is None:
+            raise RuntimeError("База данных не подключена")
+        self._reads_total += 1
+        return await asyncio.get_running_loop().run_in_executor(
+            self._reader_pool, self._read_call, func, args
+        )
+
+    async def connect(self):
+        if self._writer is not None:
+            return
+        loop = asyncio.get_running_loop()
+        writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='sqlite-writer', initializer=self._open
+        )
+        try:
+            # Схема создается соединением записи до запуска читателей
+            await loop.run_in_executor(writer, self._create_tables)
+        except BaseException:
+            writer.shutdown()
+            self._close_connections()
+            raise
+        self._writer = writer
+        self._reader_pool = ThreadPoolExecutor(
+            max_workers=self.readers, thread_name_prefix='sqlite-reader', initializer=self._open
+        )
+        logger.info(f"База SQLite открыта: {self.path} (читателей: {self.readers})")
+
+    async def close(self):
+        if self._writer is None:
+            return
+        writer, readers = self._writer, self._reader_pool
+        self._writer = self._reader_pool = None
+        # Дожидаемся начатых записей и чтений, затем закрываем соединения
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, writer.shutdown)
+        await loop.run_in_executor(None, readers.shutdown)
+        self._close_connections()
+        logger.info("База SQLite закрыта")
+
+    def _close_connections(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+    def pool_stats(self):
+        writes = self._writes_total
+        return {
+            'readers': self.readers,
+            'writes_pending': self._writes_pending,
+            'writes_total': writes,
+            'reads_total': self._reads_total,
+            'write_time_total': self._write_time_total,
+            'write_time_avg': self._write_time_total / writes if writes else 0.0,
+        }
+
+    # --- Пользователи и записи ---
+
+    # timezone сохраняется, только если у пользователя пояс еще не задан
+    async def create_user(self, user_id, username, timezone=None):
+        def run(conn):
+            conn.execute(
+                "INSERT INTO users (user_id, username, timezone, created_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET username = excluded.username, "
+                "timezone = COALESCE(timezone, excluded.timezone)",
+                (user_id, username, timezone, _timestamp(_now()))
+            )
+        try:
+            await self._write(run)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка создания пользователя {user_id}: {e}")
+            return False
+
+    async def get_user_timezone(self, user_id):
+        def run(conn):
+            return conn.execute(
+                "SELECT timezone FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        try:
+            row = await self._read(run)
+        except Exception as e:
+            logger.error(f"Ошибка чтения часового пояса {user_id}: {e}")
+            return None
+        return row[0] if row else None
+
+    # Пользователь уже должен существовать (create_user)
+    async def set_user_timezone(self, user_id, timezone):
+        def run(conn):
+            conn.execute(
+                "UPDATE users SET timezone = ? WHERE user_id = ?", (timezone, user_id)
+            )
+        try:
+            await self._write(run)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка изменения часового пояса {user_id}: {e}")
+            return False
+
+    # created_at задается для записей задним числом (например, часть таймера до полуночи).
+    # local_date — день записи в поясе пользователя; по умолчанию день сервера.
+    async def add_time_entry(self, user_id, activity_type, duration_minutes, created_at=None,
+                             local_date=None):
+        created_at = created_at or _now()
+        day = (local_date or created_at.date()).isoformat()
+
+        def run(conn):
+            cursor = conn.execute(
+                "INSERT INTO time_entries "
+                "(user_id, activity_type, duration_minutes, created_at, local_date) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user_id, activity_type, duration_minutes, _timestamp(created_at), day)
+            )
+            # Агрегат обновляется в той же транзакции, что и запись
+            conn.execute(ROLLUP_ADD, (user_id, day, activity_type, duration_minutes, 1))
+            return cursor.lastrowid
+        try:
+            return await self._write(run)
+        except Exception as e:
+            logger.error(f"Ошибка добавления записи для {user_id}: {e}")
+            return None
+
+    # Пакетная вставка: entries — список (user_id, activity_type, duration_minutes),
+    # local_dates — дни записей в поясах пользователей (по умолчанию день сервера).
+    # Все записи и их агрегаты фиксируются одной транзакцией.
+    # -> число сохраненных записей (0 при ошибке), как у AsyncDatabase
+    async def add_time_entries(self, entries, local_dates=None):
+        if not entries:
+            return 0
+        now = _now()
+        created_at = _timestamp(now)
+        if local_dates is None:
+            days = [now.date().isoformat()] * len(entries)
+        else:
+            days = [day.isoformat() for day in local_dates]
+
+        totals = {}
+        for (user_id, activity_type, duration_minutes), day in zip(entries, days):
+            key = (user_id, day, activity_type)
+            minutes, count = totals.get(key, (0, 0))
+            totals[key] = (minutes + duration_minutes, count + 1)
+
+        def run(conn):
+            conn.executemany(
+                "INSERT INTO time_entries "
+                "(user_id, activity_type, duration_minutes, created_at, local_date) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [entry + (created_at, day) for entry, day in zip(entries, days)]
+            )
+            conn.executemany(ROLLUP_ADD, [
+                (user_id, day, activity_type, minutes, count)
+                for (user_id, day, activity_type), (minutes, count) in totals.items()
+            ])
+
+        try:
+            await self._write(run)
+        except Exception as e:
+            logger.error(f"Ошибка пакетного добавления {len(entries)} записей: {e}")
+            return 0
+        return len(entries)
+
+    # Записи за день пользователя: проход по индексу idx_user_local; created_at — datetime
+    async def get_user_entries_by_date(self, user_id, day):
+        def run(conn):
+            return conn.execute(
+                "SELECT id, activity_type, duration_minutes, created_at FROM time_entries "
+                "WHERE user_id = ? AND local_date = ? "
+                "ORDER BY created_at",
+                (user_id, day.isoformat())
+            ).fetchall()
+        try:
+            rows = await self._read(run)
+        except Exception as e:
+            logger.error(f"Ошибка получения записей {user_id} за {day}: {e}")
+            return []
+
+        return [
+            {
+                'id': entry_id,
+                'activity_type': activity_type,
+                'duration_minutes': duration_minutes,
+                'created_at': datetime.fromisoformat(created_at),
+            }
+            for entry_id, activity_type, duration_minutes, created_at in rows
+        ]
+
+    async def get_daily_report(self, user_id, day):
+        def run(conn):
+            return conn.execute(
+                "SELECT activity_type, total_minutes FROM daily_rollup "
+                "WHERE user_id = ? AND day = ?",
+                (user_id, day.isoformat())
+            ).fetchall()
+        try:
+            rows = await self._read(run)
+        except Exception as e:
+            logger.error(f"Ошибка получения отчета {user_id} за {day}: {e}")
+            return {}
+
+        report = {activity_type: 0 for activity_type in ACTIVITY_TYPES}
+        for activity_type, total in rows:
+            report[activity_type] = int(total or 0)
+        return report
+
+    async def get_user_statistics(self, user_id, start_date, end_date):
+        def run(conn):
+            return conn.execute(
+                "SELECT day, activity_type, total_minutes FROM daily_rollup "
+                "WHERE user_id = ? AND day BETWEEN ? AND ? ORDER BY day",
+                (user_id, start_date.isoformat(), end_date.isoformat())
+            ).fetchall()
+        try:
+            rows = await self._read(run)
+        except Exception as e:
+            logger.error(f"Ошибка получения статистики {user_id}: {e}")
+            return []
+        return _group_by_day(rows)
+
+    # Отчет за период одним запросом: суммы по корзинам из bucket_days дней.
+    # Формат как у get_user_statistics; 'date' — первый день корзины.
+    async def get_range_report(self, user_id, start_date, end_date, bucket_days=1):
+        def run(conn):
+            return conn.execute(
+                "SELECT CAST(julianday(day) - julianday(?) AS INTEGER) / ? AS bucket, "
+                "activity_type, SUM(total_minutes) FROM daily_rollup "
+                "WHERE user_id = ? AND day BETWEEN ? AND ? "
+                "GROUP BY bucket, activity_type ORDER BY bucket",
+                (start_date.isoformat(), bucket_days, user_id,
+                 start_date.isoformat(), end_date.isoformat())
+            ).fetchall()
+        try:
+            rows = await self._read(run)
+        except Exception as e:
+            logger.error(f"Ошибка получения отчета {user_id} за {start_date} - {end_date}: {e}")
+            return []
+
+        stats = {}
+        for bucket, activity_type, total in rows:
+            day = start_date + timedelta(days=int(bucket) * bucket_days)
+            day_stats = stats.setdefault(day, {'date': day})
+            day_stats[activity_type] = int(total or 0)
+        return list(stats.values())
+
+    # Импорт истории: rows — список (activity_type, duration_minutes, created_at, import_key),
+    # local_dates — дни записей в поясе пользователя (по умолчанию дни created_at).
+    # Записи с уже известным import_key пропускаются; агрегаты за затронутые
+    # дни пересчитываются в той же транзакции. Возвращает число добавленных записей.
+    async def import_entries(self, user_id, rows, local_dates=None):
+        if not rows:
+            return 0
+        if local_dates is None:
+            local_dates = [created_at.date() for _, _, created_at, _ in rows]
+        days = [day.isoformat() for day in local_dates]
+
+        def run(conn):
+            changes = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO time_entries "
+                "(user_id, activity_type, duration_minutes, created_at, local_date, import_key) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (user_id, activity_type, duration_minutes, _timestamp(created_at), day,
+                     import_key)
+                    for (activity_type, duration_minutes, created_at, import_key), day
+                    in zip(rows, days)
+                ]
+            )
+            inserted = conn.total_changes - changes
+            if inserted:
+                conn.execute(
+                    "INSERT INTO daily_rollup "
+                    "(user_id, day, activity_type, total_minutes, entries_count) "
+                    "SELECT user_id, local_date, activity_type, "
+                    "SUM(duration_minutes), COUNT(*) FROM time_entries "
+                    "WHERE user_id = ? AND local_date BETWEEN ? AND ? "
+                    "GROUP BY user_id, local_date, activity_type "
+                    "ON CONFLICT (user_id, day, activity_type) DO UPDATE SET "
+                    "total_minutes = excluded.total_minutes, "
+                    "entries_count = excluded.entries_count",
+                    (user_id, min(days), max(days))
+                )
+            return inserted
+
+        return await self._write(run)
+
+    # Потоковое чтение всей истории пользователя для выгрузки: каждая пачка —
+    # отдельный запрос по индексу после последней прочитанной строки, поэтому
+    # соединение не удерживается между пачками.
+    async def iter_user_entries(self, user_id, chunk_size=1000):
+        def run(conn, after):
+            return conn.execute(
+                "SELECT id, activity_type, duration_minutes, created_at FROM time_entries "
+                "WHERE user_id = ? AND (created_at, id) > (?, ?) "
+                "ORDER BY created_at, id LIMIT ?",
+                (user_id,) + after + (chunk_size,)
+            ).fetchall()
+
+        after = ('', 0)
+        while True:
+            rows = await self._read(run, after)
+            if not rows:
+                break
+            after = (rows[-1][3], rows[-1][0])
+            yield [
+                (entry_id, activity_type, duration_minutes, datetime.fromisoformat(created_at))
+                for entry_id, activity_type, duration_minutes, created_at in rows
+            ]
+
+    # Записи пользователя по id (для импорта собственной выгрузки /export):
+    # {id: (activity_type, duration_minutes, created_at)}
+    async def get_entries_by_ids(self, user_id, entry_ids):
+        if not entry_ids:
+            return {}
+        placeholders = ', '.join(['?'] * len(entry_ids))
+
+        def run(conn):
+            return conn.execute(
+                "SELECT id, activity_type, duration_minutes, created_at FROM time_entries "
+                f"WHERE user_id = ? AND id IN ({placeholders})",
+                (user_id,) + tuple(entry_ids)
+            ).fetchall()
+        rows = await self._read(run)
+        return {entry_id: (activity_type, duration_minutes, datetime.fromisoformat(created_at))
+                for entry_id, activity_type, duration_minutes, created_at in rows}
+
+    # Агрегаты сразу для пачки пользователей одним запросом:
+    # {user_id: [{'date': d, 'work': 60, ...}, ...]} в формате get_user_statistics
+    async def get_users_statistics(self, user_ids, start_date, end_date):
+        if not user_ids:
+            return {}
+        placeholders = ', '.join(['?'] * len(user_ids))
+
+        def run(conn):
+            return conn.execute(
+                "SELECT user_id, day, activity_type, total_minutes FROM daily_rollup "
+                f"WHERE user_id IN ({placeholders}) AND day BETWEEN ? AND ? "
+                "ORDER BY user_id, day",
+                tuple(user_ids) + (start_date.isoformat(), end_date.isoformat())
+            ).fetchall()
+        rows = await self._read(run)
+
+        by_user = {}
+        for user_id, day, activity_type, total in rows:
+            by_user.setdefault(user_id, []).append((day, activity_type, total))
+        return {user_id: _group_by_day(user_rows) for user_id, user_rows in by_user.items()}
+
+    # Недельные суммы всех пользователей по суточным агрегатам (индекс idx_day):
+    # [(понедельник, user_id, activity_type, минуты)]
+    async def get_weekly_totals(self, start_date, end_date):
+        def run(conn):
+            # strftime('%w'): 0 — воскресенье; сдвиг назад до понедельника
+            return conn.execute(
+                "SELECT date(day, '-' || ((CAST(strftime('%w', day) AS INTEGER) + 6) % 7) "
+                "|| ' days') AS week, user_id, activity_type, SUM(total_minutes) "
+                "FROM daily_rollup WHERE day BETWEEN ? AND ? "
+                "GROUP BY week, user_id, activity_type",
+                (start_date.isoformat(), end_date.isoformat())
+            ).fetchall()
+        rows = await self._read(run)
+        return [(date.fromisoformat(week), user_id, activity_type, int(total or 0))
+                for week, user_id, activity_type, total in rows]
+
+    # --- Команды ---
+
+    async def get_user_team(self, user_id):
+        def run(conn):
+            return conn.execute("SELECT team FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        try:
+            row = await self._read(run)
+        except Exception as e:
+            logger.error(f"Ошибка чтения команды {user_id}: {e}")
+            return None
+        return row[0] if row else None
+
+    # team=None — выйти из команды; пользователь уже должен существовать (create_user)
+    async def set_user_team(self, user_id, team):
+        def run(conn):
+            conn.execute("UPDATE users SET team = ? WHERE user_id = ?", (team, user_id))
+        try:
+            await self._write(run)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка изменения команды {user_id}: {e}")
+            return False
+
+    async def get_team_members(self, team, limit=100):
+        def run(conn):
+            return conn.execute(
+                "SELECT user_id, username FROM users WHERE team = ? ORDER BY user_id LIMIT ?",
+                (team, limit)
+            ).fetchall()
+        return await self._read(run)
+
+    # --- Гистограммы рейтинга ---
+
+    # rows — список (понедельник, ключ гистограммы, counts); недели раньше keep_from удаляются
+    async def save_sketches(self, shard, rows, keep_from):
+        def run(conn):
+            conn.executemany(
+                "INSERT INTO activity_sketches (shard, week, sketch, counts) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (shard, week, sketch) DO UPDATE SET counts = excluded.counts",
+                [(shard, week.isoformat(), sketch, counts) for week, sketch, counts in rows]
+            )
+            conn.execute(
+                "DELETE FROM activity_sketches WHERE shard = ? AND week < ?",
+                (shard, keep_from.isoformat())
+            )
+        await self._write(run)
+
+    async def load_sketches(self, since):
+        # -> [(shard, понедельник, ключ гистограммы, counts)]
+        def run(conn):
+            return conn.execute(
+                "SELECT shard, week, sketch, counts FROM activity_sketches WHERE week >= ?",
+                (since.isoformat(),)
+            ).fetchall()
+        rows = await self._read(run)
+        return [(shard, date.fromisoformat(week), sketch, counts)
+                for shard, week, sketch, counts in rows]
+
+    # --- Таймеры ---
+
+    async def load_running_timers(self):
+        def run(conn):
+            return conn.execute(
+                "SELECT user_id, activity_type, started_at FROM running_timers"
+            ).fetchall()
+        rows = await self._read(run)
+        return [
+            (user_id, activity_type, datetime.fromisoformat(started_at))
+            for user_id, activity_type, started_at in rows
+        ]
+
+    async def save_running_timers(self, rows):
+        # rows — список (user_id, activity_type, started_at)
+        if not rows:
+            return
+
+        def run(conn):
+            conn.executemany(
+                "INSERT INTO running_timers (user_id, activity_type, started_at) "
+                "VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET "
+                "activity_type = excluded.activity_type, started_at = excluded.started_at",
+                [
+                    (user_id, activity_type, _timestamp(started_at))
+                    for user_id, activity_type, started_at in rows
+                ]
+            )
+        await self._write(run)
+
+    async def delete_running_timers(self, user_ids):
+        if not user_ids:
+            return
+        placeholders = ', '.join(['?'] * len(user_ids))
+
+        def run(conn):
+            conn.execute(
+                f"DELETE FROM running_timers WHERE user_id IN ({placeholders})",
+                tuple(user_ids)
+            )
+        await self._write(run)
+
+    # --- Подписка на сводки ---
+
+    async def get_digest_settings(self, user_id):
+        def run(conn):
+            return conn.execute(
+                "SELECT digest_daily, digest_weekly FROM users WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        try:
+            row = await self._read(run)
+        except Exception as e:
+            logger.error(f"Ошибка чтения подписки {user_id}: {e}")
+            return None
+        if row is None:
+            return {'daily': False, 'weekly': False}
+        return {'daily': bool(row[0]), 'weekly': bool(row[1])}
+
+    async def set_digest_settings(self, user_id, daily, weekly):
+        def run(conn):
+            return conn.execute(
+                "UPDATE users SET digest_daily = ?, digest_weekly = ? WHERE user_id = ?",
+                (int(daily), int(weekly), user_id)
+            ).rowcount
+        try:
+            return await self._write(run) > 0
+        except Exception as e:
+            logger.error(f"Ошибка изменения подписки {user_id}: {e}")
+            return False
+
+    # --- Доставка сводок ---
+    # Те же переходы состояний, что в AsyncDatabase; атомарность захвата
+    # обеспечивает единственный поток записи.
+
+    async def digest_prepare(self, kind, period, keep_days=30):
+        column = {'daily': 'digest_daily', 'weekly': 'digest_weekly'}[kind]
+
+        def run(conn):
+            added = conn.execute(
+                "INSERT OR IGNORE INTO digest_deliveries (kind, period, user_id) "
+                f"SELECT ?, ?, user_id FROM users WHERE {column} = 1",
+                (kind, period.isoformat())
+            ).rowcount
+            conn.execute(
+                "DELETE FROM digest_deliveries WHERE period < ?",
+                ((period - timedelta(days=keep_days)).isoformat(),)
+            )
+            return added
+        return await self._write(run)
+
+    async def digest_recover(self, kind, period, lease_seconds):
+        expired = _timestamp(_now() - timedelta(seconds=lease_seconds))
+
+        def run(conn):
+            conn.execute(
+                "UPDATE digest_deliveries SET status = 'pending', claimed_by = NULL "
+                "WHERE kind = ? AND period = ? AND status = 'claimed' AND claimed_at < ?",
+                (kind, period.isoformat(), expired)
+            )
+            conn.execute(
+                "UPDATE digest_deliveries SET status = 'failed' "
+                "WHERE kind = ? AND period = ? AND status = 'sending' AND claimed_at < ?",
+                (kind, period.isoformat(), expired)
+            )
+        await self._write(run)
+
+    async def digest_claim(self, kind, period, token, limit):
+        def run(conn):
+            params = (kind, period.isoformat())
+            # UPDATE ... LIMIT в SQLite по умолчанию нет — выбираем строки подзапросом
+            conn.execute(
+                "UPDATE digest_deliveries SET status = 'claimed', claimed_by = ?, claimed_at = ? "
+                "WHERE kind = ? AND period = ? AND user_id IN ("
+                "SELECT user_id FROM digest_deliveries "
+                "WHERE kind = ? AND period = ? AND status = 'pending' "
+                "ORDER BY user_id LIMIT ?)",
+                (token, _timestamp(_now())) + params + params + (limit,)
+            )
+            return conn.execute(
+                "SELECT user_id FROM digest_deliveries "
+                "WHERE kind = ? AND period = ? AND status = 'claimed' AND claimed_by = ? "
+                "ORDER BY user_id",
+                params + (token,)
+            ).fetchall()
+        rows = await self._write(run)
+        return [user_id for (user_id,) in rows]
+
+    async def digest_remaining(self, kind, period):
+        def run(conn):
+            return conn.execute(
+                "SELECT COUNT(*) FROM digest_deliveries "
+                "WHERE kind = ? AND period = ? AND status IN ('pending', 'claimed')",
+                (kind, period.isoformat())
+            ).fetchone()[0]
+        return await self._read(run)
+
+    async def digest_begin_send(self, kind, period, user_id, token):
+        def run(conn):
+            return conn.execute(
+                "UPDATE digest_deliveries SET status = 'sending' "
+                "WHERE kind = ? AND period = ? AND user_id = ? "
+                "AND status = 'claimed' AND claimed_by = ?",
+                (kind, period.isoformat(), user_id, token)
+            ).rowcount
+        return await self._write(run) > 0
+
+    async def digest_finish(self, kind, period, user_ids, status):
+        if not user_ids:
+            return
+        placeholders = ', '.join(['?'] * len(user_ids))
+
+        def run(conn):
+            conn.execute(
+                "UPDATE digest_deliveries SET status = ?, sent_at = ? "
+                f"WHERE kind = ? AND period = ? AND user_id IN ({placeholders})",
+                (status, _timestamp(_now()), kind, period.isoformat()) + tuple(user_ids)
+            )
+        await self._write(run)
+
+    # --- Агрегаты ---
+
+    async def rebuild_rollup(self, user_id=None):
+        where = "WHERE user_id = ?" if user_id is not None else ""
+        params = (user_id,) if user_id is not None else ()
+
+        def run(conn):
+            conn.execute(f"DELETE FROM daily_rollup {where}", params)
+            return conn.execute(
+                "INSERT INTO daily_rollup "
+                "(user_id, day, activity_type, total_minutes, entries_count) "
+                "SELECT user_id, local_date, activity_type, "
+                "SUM(duration_minutes), COUNT(*) "
+                f"FROM time_entries {where} "
+                "GROUP BY user_id, local_date, activity_type",
+                params
+            ).rowcount
+        rows = await self._write(run)
+        logger.info(f"Агрегаты пересобраны: {rows} строк")
+        return rows
+
+    # Расхождения агрегатов с сырыми записями:
+    # (user_id, day, activity_type, ожидалось, в агрегате)
+    async def check_rollup(self, user_id=None):
+        where = "WHERE user_id = ?" if user_id is not None else ""
+        rollup_where = "AND r.user_id = ?" if user_id is not None else ""
+        params = (user_id,) if user_id is not None else ()
+        aggregated = (
+            "SELECT user_id, local_date AS day, activity_type, "
+            "SUM(duration_minutes) AS total "
+            f"FROM time_entries {where} "
+            "GROUP BY user_id, local_date, activity_type"
+        )
+
+        def run(conn):
+            return conn.execute(
+                "SELECT r.user_id, r.day, r.activity_type, e.total, r.total_minutes "
+                f"FROM daily_rollup r LEFT JOIN ({aggregated}) e "
+                "ON e.user_id = r.user_id AND e.day = r.day "
+                "AND e.activity_type = r.activity_type "
+                "WHERE (e.total IS NULL OR e.total <> r.total_minutes) "
+                f"{rollup_where} "
+                "UNION ALL "
+                "SELECT e.user_id, e.day, e.activity_type, e.total, NULL "
+                f"FROM ({aggregated}) e LEFT JOIN daily_rollup r "
+                "ON e.user_id = r.user_id AND e.day = r.day "
+                "AND e.activity_type = r.activity_type "
+                "WHERE r.user_id IS NULL",
+                params + params + params
+            ).fetchall()
+        rows = await self._read(run)
+
+        return [
+            (row_user, date.fromisoformat(day), activity_type, int(expected or 0), int(actual or 0))
+            for row_user, day, activity_type, expected, actual in rows
+        ]
+
+
+def _group_by_day(rows):
+    # [(день 'ГГГГ-ММ-ДД', активность, минуты)] по порядку дней ->
+    # [{'date': date, 'work': 60, ...}, ...]
+    stats = {}
+    for day, activity_type, total in rows:
+        day_stats = stats.get(day)
+        if day_stats is None:
+            day_stats = stats[day] = {'date': date.fromisoformat(day)}
+        day_stats[activity_type] = int(total or 0)
+    return list(stats.values())
@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+import numpy as np
+
+from async_database import ACTIVITY_TYPES
+
+ACTIVITY_INDEX = {activity_type: i for i, activity_type in enumerate(ACTIVITY_TYPES)}
+
+
+# Статистика пользователя за период в виде матрицы «день × активность».
+# Все агрегаты считаются векторно, поэтому год стоит почти как неделя.
+class PeriodStats:
+    def __init__(self, start_date, end_date, matrix):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.matrix = matrix
+        self.days = matrix.shape[0]
+
+    @classmethod
+    def from_rows(cls, start_date, end_date, rows):
+        # rows — результат get_user_statistics: [{'date': d, 'work': 60, ...}, ...]
+        days = (end_date - start_date).days + 1
+        matrix = np.zeros((days, len(ACTIVITY_TYPES)), dtype=np.int32)
+        for day_stats in rows:
+            offset = (day_stats['date'] - start_date).days
+            if 0 <= offset < days:
+                for activity_type, column in ACTIVITY_INDEX.items():
+                    matrix[offset, column] = day_stats.get(activity_type, 0)
+        return cls(start_date, end_date, matrix)
+
+    def dates(self):
+        return [self.start_date + timedelta(days=i) for i in range(self.days)]
+
+    def is_empty(self):
+        return not self.matrix.any()
+
+    @property
+    def total(self):
+        return int(self.matrix.sum())
+
+    def totals(self):
+        # Минуты по каждой активности за весь период
+        return dict(zip(ACTIVITY_TYPES, self.matrix.sum(axis=0).tolist()))
+
+    def percentages(self):
+        sums = self.matrix.sum(axis=0)
+        total = sums.sum()
+        if total == 0:
+            return dict.fromkeys(ACTIVITY_TYPES, 0.0)
+        return dict(zip(ACTIVITY_TYPES, (sums * 100.0 / total).tolist()))
+
+    def daily_totals(self):
+        return self.matrix.sum(axis=1)
+
+    def daily_average(self):
+        return self.total // self.days if self.days else 0
+
+    def active_days(self):
+        return int(np.count_nonzero(self.daily_totals()))
+
+    def weekday_average(self):
+        # Среднее время в день для каждого дня недели (Пн..Вс)
+        weekdays = (np.arange(self.days) + self.start_date.weekday()) % 7
+        sums = np.bincount(weekdays, weights=self.daily_totals(), minlength=7)
+        counts = np.bincount(weekdays, minlength=7)
+        return np.divide(sums, counts, out=np.zeros(7), where=counts > 0).astype(np.int64)
+
+    def rolling(self, window):
+        # Скользящие суммы по окну из window дней; i-й элемент заканчивается днем i + window - 1
+        if self.days < window:
+            return np.zeros(0, dtype=np.int64)
+        cumulative = np.concatenate(([0], np.cumsum(self.daily_totals(), dtype=np.int64)))
+        return cumulative[window:] - cumulative[:-window]
+
+    def best_window(self, window):
+        # (первый день, последний день, минуты) окна с максимальной суммой
+        sums = self.rolling(window)
+        if sums.size == 0:
+            return None
+        i = int(sums.argmax())
+        start = self.start_date + timedelta(days=i)
+        return start, start + timedelta(days=window - 1), int(sums[i])
+
+    def monthly_totals(self):
+        # Суммы по календарным месяцам: [((год, месяц), минуты), ...]
+        dates = self.dates()
+        keys = sorted({(d.year, d.month) for d in dates})
+        index = {key: i for i, key in enumerate(keys)}
+        months = np.fromiter((index[(d.year, d.month)] for d in dates), dtype=np.int64, count=self.days)
+        sums = np.bincount(months, weights=self.daily_totals(), minlength=len(keys))
+        return list(zip(keys, sums.astype(np.int64).tolist()))
+
+
+async def load_period(db, user_id, start_date, end_date):
+    rows = await db.get_user_statistics(user_id, start_date, end_date)
+    return PeriodStats.from_rows(start_date, end_date, rows)
@@ -0,0 +1,321 @@
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+# Поля обновления, в которых лежит отправитель
+USER_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query',
+    'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+    'my_chat_member', 'chat_member', 'chat_join_request',
+)
+
+
+def update_user_id(update):
+    for field in USER_FIELDS:
+        payload = update.get(field)
+        if payload and payload.get('from'):
+            return payload['from']['id']
+    poll_answer = update.get('poll_answer')
+    if poll_answer and poll_answer.get('user'):
+        return poll_answer['user']['id']
+    return 0
+
+
+def shard_for(user_id, workers):
+    return user_id % workers
+
+
+# Приложение воркера по умолчанию: обработчики из bot.py
+class BotWorkerApp:
+    async def startup(self):
+        from aiogram import Bot, Dispatcher
+        import bot
+        self.bot = bot
+        Bot.set_current(bot.dp.bot)
+        Dispatcher.set_current(bot.dp)
+        await bot.on_startup(bot.dp)
+
+    async def process(self, update):
+        from aiogram import types
+        # Через updates_handler, чтобы сработали middleware уровня update
+        await self.bot.dp.updates_handler.notify(types.Update(**update))
+
+    async def shutdown(self):
+        await self.bot.on_shutdown(self.bot.dp)
+        await self.bot.dp.storage.close()
+        await self.bot.dp.storage.wait_closed()
+        session = await self.bot.bot.get_session()
+        await session.close()
+
+
+def load_app(app_path):
+    module_name, _, class_name = app_path.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+# --- Процесс-воркер ---
+
+def worker_main(index, workers, app_path, updates, status, concurrency, heartbeat_interval):
+    # Номер шарда для фоновых задач приложения (таймеры в bot.py)
+    os.environ['BOT_WORKER_SHARD'] = f"{index}/{workers}"
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - worker-{index} - %(name)s - %(levelname)s - %(message)s'
+    )
+    try:
+        asyncio.run(_worker_loop(index, app_path, updates, status,
+                                 concurrency, heartbeat_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_loop(index, app_path, updates, status, concurrency, heartbeat_interval):
+    app = load_app(app_path)
+    await app.startup()
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    # user_id -> [замок, число ожидающих обновлений]
+    user_locks = {}
+    tasks = set()
+    counters = {'processed': 0, 'failed': 0}
+
+    async def process(user_id, update):
+        # Обновления одного пользователя обрабатываются строго по порядку
+        entry = user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], semaphore:
+                try:
+                    await app.process(update)
+                    counters['processed'] += 1
+                except Exception as e:
+                    counters['failed'] += 1
+                    logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}")
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del user_locks[user_id]
+
+    def report():
+        status.put({
+            'worker': index,
+            'pid': os.getpid(),
+            'processed': counters['processed'],
+            'failed': counters['failed'],
+            'in_flight': len(tasks),
+            'ts': time.time(),
+        })
+
+    async def heartbeat():
+        while True:
+            report()
+            await asyncio.sleep(heartbeat_interval)
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    while True:
+        item = await loop.run_in_executor(None, updates.get)
+        if item is None:
+            break
+        user_id, update = item
+        task = asyncio.create_task(process(user_id, update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.wait(set(tasks))
+    heartbeat_task.cancel()
+    report()
+    await app.shutdown()
+
+
+# --- Супервизор ---
+
+class Supervisor:
+    def __init__(self, workers=None, app_path='supervisor:BotWorkerApp', concurrency=50,
+                 queue_size=1000, heartbeat_interval=5.0, health_file=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.app_path = app_path
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.heartbeat_interval = heartbeat_interval
+        self.health_file = health_file
+
+        self.ctx = multiprocessing.get_context('spawn')
+        self.queues = [self.ctx.Queue(queue_size) for _ in range(self.workers)]
+        self.status = self.ctx.Queue()
+        self.processes = [None] * self.workers
+        self.health = {}
+        self.dispatched = [0] * self.workers
+
+    def _spawn(self, index):
+        process = self.ctx.Process(
+            target=worker_main,
+            args=(index, self.workers, self.app_path, self.queues[index], self.status,
+                  self.concurrency, self.heartbeat_interval),
+            name=f"bot-worker-{index}",
+            # Не daemon: воркер запускает свой пул процессов отрисовки, а у
+            # daemon-процессов не может быть дочерних. Останавливает их stop()
+            daemon=False
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Воркер {index} запущен (pid {process.pid})")
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    async def dispatch(self, update):
+        user_id = update_user_id(update)
+        index = shard_for(user_id, self.workers)
+        self.dispatched[index] += 1
+        try:
+            self.queues[index].put_nowait((user_id, update))
+        except queue.Full:
+            # Воркер не успевает: ждем места в очереди вне цикла событий
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.queues[index].put, (user_id, update)
+            )
+
+    def collect_status(self):
+        while True:
+            try:
+                item = self.status.get_nowait()
+            except queue.Empty:
+                break
+            self.health[item['worker']] = item
+
+    def check_workers(self):
+        self.collect_status()
+        now = time.time()
+        report = []
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logger.error(f"Воркер {index} завершился (код {process.exitcode}), перезапускаем")
+                self._spawn(index)
+            state = dict(self.health.get(index, {}))
+            state['worker'] = index
+            state['alive'] = self.processes[index].is_alive()
+            state['dispatched'] = self.dispatched[index]
+            state['queue_size'] = _queue_size(self.queues[index])
+            state['stale'] = now - state.get('ts', 0) > self.heartbeat_interval * 3
+            report.append(state)
+
+        if self.health_file:
+            with open(self.health_file, 'w') as f:
+                json.dump({'ts': now, 'workers': report}, f, ensure_ascii=False, indent=2)
+        return report
+
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            report = self.check_workers()
+            processed = sum(state.get('processed', 0) for state in report)
+            unhealthy = [state['worker'] for state in report if state['stale'] or not state['alive']]
+            logger.info(
+                f"Воркеров: {self.workers}, обработано: {processed}, "
+                f"проблемные: {unhealthy or 'нет'}"
+            )
+
+    def stop(self, timeout=30.0):
+        for worker_queue in self.queues:
+            worker_queue.put(None)
+        # Пока ждем, разбираем очередь статусов: процесс не завершится,
+        # пока его поток очереди не допишет последние heartbeat в канал
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            while process is not None and process.is_alive() and time.monotonic() < deadline:
+                self.collect_status()
+                process.join(0.1)
+        for index, process in enumerate(self.processes):
+            if process is not None and process.is_alive():
+                logger.warning(f"Воркер {index} не остановился за {timeout} с, завершаем")
+                process.terminate()
+                process.join(5.0)
+                if process.is_alive():
+                    process.kill()
+                    process.join()
+        self.collect_status()
+        logger.info("Все воркеры остановлены")
+
+
+def _queue_size(worker_queue):
+    try:
+        return worker_queue.qsize()
+    except NotImplementedError:
+        # macOS не поддерживает qsize у multiprocessing.Queue
+        return None
+
+
+async def poll_updates(supervisor, skip_updates=True):
+    from aiogram import Bot
+    from aiogram.bot.api import TelegramAPIServer
+    import config
+
+    api_server = getattr(config, 'TELEGRAM_API_SERVER', None)
+    if api_server:
+        bot = Bot(token=config.BOT_TOKEN, server=TelegramAPIServer.from_base(api_server))
+    else:
+        bot = Bot(token=config.BOT_TOKEN)
+
+    offset = None
+    if skip_updates:
+        skipped = await bot.get_updates(offset=-1, timeout=1)
+        if skipped:
+            offset = skipped[-1].update_id + 1
+
+    monitor_task = asyncio.create_task(supervisor.monitor())
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=20)
+            except Exception as e:
+                logger.error(f"Ошибка получения обновлений: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                await supervisor.dispatch(update.to_python())
+    finally:
+        monitor_task.cancel()
+        session = await bot.get_session()
+        await session.close()
+
+
+def main():
+    import config
+
+    parser = argparse.ArgumentParser(description="Запуск бота в нескольких процессах")
+    parser.add_argument('--workers', type=int, default=getattr(config, 'WORKERS', None))
+    parser.add_argument('--health-file', default=getattr(config, 'SUPERVISOR_HEALTH_FILE', None))
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - supervisor - %(name)s - %(levelname)s - %(message)s'
+    )
+    supervisor = Supervisor(
+        workers=args.workers,
+        concurrency=getattr(config, 'WORKER_CONCURRENCY', 50),
+        health_file=args.health_file
+    )
+    supervisor.start()
+    try:
+        asyncio.run(poll_updates(supervisor))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from async_database import ACTIVITY_TYPES
+from timezones import to_local, to_server
+
+logger = logging.getLogger(__name__)
+
+# Индекс активности хранится в младших битах метки старта
+ACTIVITY_BITS = 3
+ACTIVITY_MASK = (1 << ACTIVITY_BITS) - 1
+ACTIVITY_INDEX = {activity_type: i for i, activity_type in enumerate(ACTIVITY_TYPES)}
+
+
+def pack(activity_type, started):
+    return (int(started) << ACTIVITY_BITS) | ACTIVITY_INDEX[activity_type]
+
+
+def unpack(packed):
+    # -> (activity_type, время старта в секундах epoch)
+    return ACTIVITY_TYPES[packed & ACTIVITY_MASK], packed >> ACTIVITY_BITS
+
+
+def split_by_midnight(started_at, stopped_at, zone=None):
+    # Интервал (время сервера) -> [(created_at, local_date, минуты)] по
+    # календарным дням в поясе zone. Части до полуночи записываются на
+    # 23:59:59 своего дня, последняя — на stopped_at; created_at — снова
+    # время сервера, local_date — день в поясе пользователя.
+    segments = []
+    start = to_local(started_at, zone)
+    stop = to_local(stopped_at, zone)
+    while start < stop:
+        midnight = datetime.combine(start.date() + timedelta(days=1), datetime.min.time())
+        if zone is not None:
+            midnight = midnight.replace(tzinfo=zone)
+        end = min(midnight, stop)
+        # По меткам epoch: разность времени в одном поясе не учитывает перевод часов
+        minutes = round((end.timestamp() - start.timestamp()) / 60)
+        if minutes > 0:
+            created_at = stopped_at if end == stop else to_server(midnight - timedelta(seconds=1))
+            segments.append((created_at, start.date(), minutes))
+        start = end
+    return segments
+
+
+class StoppedTimer:
+    __slots__ = ('activity_type', 'started_at', 'stopped_at', 'segments')
+
+    def __init__(self, activity_type, started_at, stopped_at, segments):
+        self.activity_type = activity_type
+        self.started_at = started_at
+        self.stopped_at = stopped_at
+        self.segments = segments
+
+    @property
+    def minutes(self):
+        return sum(minutes for _, _, minutes in self.segments)
+
+
+# Запущенные таймеры (/start_timer, /stop_timer).
+# Индекс в памяти: user_id -> одно int (метка старта и индекс активности),
+# так что десятки тысяч таймеров занимают единицы мегабайт. Новые таймеры
+# сохраняются в running_timers пачкой раз в checkpoint_interval секунд;
+# при остановке строка удаляется до записи времени, поэтому после сбоя
+# время не запишется дважды (потерять можно только таймер, запущенный
+# за последние checkpoint_interval секунд). Если запись времени не удалась,
+# таймер возвращается в индекс с начала незаписанной части. Забытые таймеры раз в
+# sweep_interval ищутся по индексу в памяти, без запросов к БД, и
+# останавливаются с продолжительностью max_duration.
+# owns(user_id) отбирает таймеры своего процесса при запуске через supervisor.py,
+# zone_for(user_id) возвращает пояс пользователя для деления по полуночи.
+class TimerService:
+    def __init__(self, db, checkpoint_interval=10.0, sweep_interval=3600,
+                 max_duration=16 * 3600, on_expired=None, owns=None, zone_for=None):
+        self.db = db
+        self.checkpoint_interval = checkpoint_interval
+        self.sweep_interval = sweep_interval
+        self.max_duration = max_duration
+        self.on_expired = on_expired
+        self.owns = owns or (lambda user_id: True)
+        self.zone_for = zone_for
+
+        self.timers = {}
+        # Запущенные, но еще не сохраненные в running_timers
+        self.unsaved = set()
+        # Удаление строки не должно обгонять идущее сохранение той же строки
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.next_sweep_at = 0.0
+
+        # Метрики
+        self.started_total = 0
+        self.stopped_total = 0
+        self.expired_total = 0
+        self.checkpoints_total = 0
+
+    async def load(self):
+        try:
+            rows = await self.db.load_running_timers()
+        except Exception as e:
+            logger.error(f"Ошибка загрузки таймеров: {e}")
+            return
+        for user_id, activity_type, started_at in rows:
+            if self.owns(user_id) and activity_type in ACTIVITY_INDEX:
+                self.timers[user_id] = pack(activity_type, started_at.timestamp())
+        if self.timers:
+            logger.info(f"Загружено запущенных таймеров: {len(self.timers)}")
+
+    def start(self):
+        if self.task is None:
+            self.next_sweep_at = time.monotonic() + self.sweep_interval
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.checkpoint()
+
+    def stats(self):
+        return {
+            'running': len(self.timers),
+            'unsaved': len(self.unsaved),
+            'started_total': self.started_total,
+            'stopped_total': self.stopped_total,
+            'expired_total': self.expired_total,
+            'checkpoints_total': self.checkpoints_total,
+        }
+
+    def get(self, user_id):
+        # -> (activity_type, started_at) или None
+        packed = self.timers.get(user_id)
+        if packed is None:
+            return None
+        activity_type, started = unpack(packed)
+        return activity_type, datetime.fromtimestamp(started)
+
+    async def start_timer(self, user_id, activity_type, now=None):
+        # Запуск поверх идущего таймера сначала останавливает его
+        now = now or datetime.now()
+        previous = await self.stop_timer(user_id, now) if user_id in self.timers else None
+        self.timers[user_id] = pack(activity_type, now.timestamp())
+        self.unsaved.add(user_id)
+        self.started_total += 1
+        return previous
+
+    async def stop_timer(self, user_id, now=None, max_duration=None):
+        packed = self.timers.pop(user_id, None)
+        if packed is None:
+            return None
+        activity_type, started = unpack(packed)
+        started_at = datetime.fromtimestamp(started)
+        stopped_at = now or datetime.now()
+        if max_duration is not None:
+            stopped_at = min(stopped_at, started_at + timedelta(seconds=max_duration))
+
+        if user_id in self.unsaved:
+            self.unsaved.discard(user_id)
+        else:
+            try:
+                async with self.lock:
+                    await self.db.delete_running_timers([user_id])
+            except Exception:
+                # Таймер остается запущенным: время не записано
+                self.timers[user_id] = packed
+                raise
+
+        zone = await self.zone_for(user_id) if self.zone_for else None
+        segments = split_by_midnight(started_at, stopped_at, zone)
+        resume_at = started_at
+        for created_at, day, minutes in segments:
+            entry_id = await self.db.add_time_entry(user_id, activity_type, minutes, created_at,
+                                                    local_date=day)
+            if not entry_id:
+                # Записанные части не повторяем: таймер снова идет с начала
+                # незаписанной и сохранится при следующей контрольной точке
+                if user_id not in self.timers:
+                    self.timers[user_id] = pack(activity_type, resume_at.timestamp())
+                    self.unsaved.add(user_id)
+                raise RuntimeError("Время таймера не записано")
+            # Следующая часть начинается в полночь, через секунду после created_at
+            resume_at = created_at + timedelta(seconds=1)
+        self.stopped_total += 1
+        return StoppedTimer(activity_type, started_at, stopped_at, segments)
+
+    async def checkpoint(self):
+        if not self.unsaved:
+            return
+        async with self.lock:
+            await self._checkpoint()
+
+    async def _checkpoint(self):
+        user_ids = [user_id for user_id in self.unsaved if user_id in self.timers]
+        self.unsaved.clear()
+        rows = []
+        for user_id in user_ids:
+            activity_type, started = unpack(self.timers[user_id])
+            rows.append((user_id, activity_type, datetime.fromtimestamp(started)))
+        try:
+            await self.db.save_running_timers(rows)
+            self.checkpoints_total += 1
+        except Exception as e:
+            logger.error(f"Ошибка сохранения таймеров: {e}")
+            # Повторим при следующей контрольной точке (если таймер еще идет)
+            self.unsaved.update(user_id for user_id in user_ids if user_id in self.timers)
+
+    async def sweep(self, now=None):
+        now = now or datetime.now()
+        deadline = now.timestamp() - self.max_duration
+        expired = [
+            user_id for user_id, packed in self.timers.items()
+            if packed >> ACTIVITY_BITS <= deadline
+        ]
+        for user_id in expired:
+            try:
+                stopped = await self.stop_timer(user_id, now, max_duration=self.max_duration)
+            except Exception as e:
+                logger.error(f"Ошибка остановки забытого таймера {user_id}: {e}")
+                continue
+            if stopped is None:
+                continue
+            self.expired_total += 1
+            if self.on_expired:
+                try:
+                    await self.on_expired(user_id, stopped)
+                except Exception as e:
+                    logger.warning(f"Уведомление о таймере для {user_id} не отправлено: {e}")
+        return len(expired)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.checkpoint()
+                if time.monotonic() >= self.next_sweep_at:
+                    self.next_sweep_at = time.monotonic() + self.sweep_interval
+                    await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка обслуживания таймеров: {e}")
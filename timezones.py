@@ -0,0 +1,83 @@
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# «UTC+3», «GMT-4», «+05:30», «+3»
+OFFSET_RE = re.compile(r'(?:utc|gmt)?\s*([+-])(\d{1,2})(?::?(\d{2}))?', re.IGNORECASE)
+
+MAX_NAME_LENGTH = 64
+
+
+# Часовые пояса пользователей.
+# В users.timezone хранится имя IANA («Europe/Moscow») или постоянное
+# смещение «+05:30»; NULL — пояс по умолчанию (DEFAULT_TIMEZONE, иначе
+# время сервера). created_at в БД по-прежнему локальное время сервера,
+# а день записи в поясе пользователя (local_date) вычисляется при вставке.
+
+def parse_timezone(text):
+    # Ввод пользователя -> имя для users.timezone; ValueError при ошибке
+    text = text.strip()
+    if text.lower() in ('utc', 'gmt', 'z'):
+        return 'UTC'
+    match = OFFSET_RE.fullmatch(text)
+    if match:
+        sign, hours, minutes = match[1], int(match[2]), int(match[3] or 0)
+        if hours > 14 or minutes >= 60:
+            raise ValueError("Смещение вне диапазона")
+        return f"{sign}{hours:02d}:{minutes:02d}"
+    if not text or len(text) > MAX_NAME_LENGTH:
+        raise ValueError("Неизвестный часовой пояс")
+    try:
+        get_zone(text)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError("Неизвестный часовой пояс")
+    return text
+
+
+@lru_cache(maxsize=1024)
+def get_zone(name):
+    # Имя из users.timezone -> tzinfo; None — время сервера
+    if not name:
+        return None
+    if name[0] in '+-':
+        hours, minutes = map(int, name[1:].split(':'))
+        offset = timedelta(hours=hours, minutes=minutes)
+        return timezone(-offset if name[0] == '-' else offset, f"UTC{name}")
+    return ZoneInfo(name)
+
+
+def to_local(moment, zone):
+    # Наивное время сервера (как created_at в БД) -> время в поясе zone
+    if zone is None:
+        return moment
+    return moment.astimezone(zone)
+
+
+def to_server(moment):
+    # Время с поясом -> наивное время сервера
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone().replace(tzinfo=None)
+
+
+def local_date(moment, zone):
+    return to_local(moment, zone).date()
+
+
+def local_now(zone):
+    return to_local(datetime.now(), zone)
+
+
+def local_today(zone):
+    return local_now(zone).date()
+
+
+def zone_label(zone):
+    # Подпись для сообщений: «Europe/Moscow, UTC+03:00»
+    if zone is None:
+        return "время сервера"
+    offset = datetime.now(zone).strftime('%z')
+    offset = f"UTC{offset[:3]}:{offset[3:]}"
+    name = str(zone)
+    return offset if name == offset else f"{name}, {offset}"
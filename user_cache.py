@@ -0,0 +1,374 @@
+import sys
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+from async_database import ACTIVITY_TYPES
+from timezones import get_zone, local_date, to_local
+
+
+class _DayData:
+    __slots__ = ('totals', 'entries')
+
+    def __init__(self, totals=None, entries=None):
+        # totals: активность -> минуты; entries: записи дня или None, если не загружены
+        self.totals = totals if totals is not None else {}
+        self.entries = entries
+
+    @property
+    def cost(self):
+        return 1 + (len(self.entries) if self.entries is not None else 0)
+
+
+# Кэш последних дней активных пользователей поверх базы данных.
+# Повторяет методы AsyncDatabase, остальные атрибуты берет у самой базы.
+# Новые записи попадают в кэш сразу после сохранения (write-through),
+# поэтому данные не устаревают и TTL не нужен. Память ограничена общим
+# числом элементов (дни + записи), лишние пользователи вытесняются по LRU.
+# Дни — в поясе пользователя: пояс читается из БД один раз и хранится
+# отдельно (не больше max_items пользователей), по нему же вычисляется
+# local_date новых записей; default_timezone — пояс пользователей без своего.
+# on_entry(user_id, activity_type, minutes, day) вызывается после каждой
+# сохраненной записи (и при выключенном кэше) — так рейтинг (leaderboard.py)
+# ведет недельные суммы без чтения БД; on_import(user_id) ждется после импорта.
+# Промах читает БД, а запись тем временем может пройти мимо еще не
+# закэшированного дня, поэтому прочитанный снимок сохраняется, только если
+# у пользователя за время чтения не было записей (номер последней записи
+# в last_write не больше номера на начало чтения) и нет записей в полете.
+class UserDataCache:
+    def __init__(self, db, days=31, max_items=200000, enabled=True, default_timezone=None,
+                 on_entry=None, on_import=None):
+        self.db = db
+        self.days = days
+        self.max_items = max_items
+        self.enabled = enabled
+        self.default_timezone = default_timezone
+        self.on_entry = on_entry
+        self.on_import = on_import
+
+        self.users = OrderedDict()
+        self.items = 0
+        # user_id -> имя пояса из users.timezone (None — пояс по умолчанию)
+        self.zones = OrderedDict()
+
+        # Номер последней записи пользователя; нужен, только пока идут чтения
+        self.write_seq = 0
+        self.last_write = {}
+        # Снимки, начатые до cleared_at, не сохраняются (last_write очищен)
+        self.cleared_at = 0
+        self.writing = {}
+        self.reads_in_flight = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    # --- Служебное ---
+
+    # Сегодня в поясе пользователя может отличаться от даты сервера на день,
+    # поэтому окно на день шире с обеих сторон
+    def _window_start(self):
+        return date.today() - timedelta(days=self.days)
+
+    def _in_window(self, day):
+        return self._window_start() <= day <= date.today() + timedelta(days=1)
+
+    def _user_days(self, user_id, create=False):
+        days = self.users.get(user_id)
+        if days is None:
+            if not create:
+                return None
+            days = {}
+            self.users[user_id] = days
+        self.users.move_to_end(user_id)
+
+        # Дни, выпавшие из окна после смены даты, больше не нужны
+        window_start = self._window_start()
+        for day in [day for day in days if day < window_start]:
+            self.items -= days.pop(day).cost
+        return days
+
+    def _store(self, user_id, day, day_data):
+        days = self._user_days(user_id, create=True)
+        old = days.get(day)
+        if old is not None:
+            self.items -= old.cost
+        days[day] = day_data
+        self.items += day_data.cost
+        self._evict(keep=user_id)
+
+    def _begin_read(self):
+        self.reads_in_flight += 1
+        return self.write_seq
+
+    def _end_read(self, user_id, token):
+        # -> можно ли сохранить прочитанный с номера token снимок
+        self.reads_in_flight -= 1
+        fresh = (token >= self.cleared_at and user_id not in self.writing
+                 and self.last_write.get(user_id, 0) <= token)
+        if not self.reads_in_flight:
+            self.last_write.clear()
+        return fresh
+
+    def _mark_written(self, user_id):
+        self.write_seq += 1
+        if len(self.last_write) >= self.max_items:
+            self.last_write.clear()
+            self.cleared_at = self.write_seq
+        self.last_write[user_id] = self.write_seq
+
+    def _begin_write(self, user_id):
+        self.writing[user_id] = self.writing.get(user_id, 0) + 1
+
+    def _end_write(self, user_id):
+        if self.writing[user_id] == 1:
+            del self.writing[user_id]
+        else:
+            self.writing[user_id] -= 1
+        self._mark_written(user_id)
+
+    def _evict(self, keep=None):
+        while self.items > self.max_items and len(self.users) > 1:
+            user_id, days = next(iter(self.users.items()))
+            if user_id == keep:
+                self.users.move_to_end(user_id)
+                continue
+            del self.users[user_id]
+            self.items -= sum(day_data.cost for day_data in days.values())
+            self.evictions += 1
+
+    def _lookup(self, user_id, day):
+        if not self.enabled or not self._in_window(day):
+            self.bypassed += 1
+            return None, False
+        days = self._user_days(user_id)
+        return (days.get(day) if days is not None else None), True
+
+    def _apply(self, user_id, activity_type, duration_minutes, entry_id, created_at, day):
+        if not self.enabled:
+            return
+        days = self._user_days(user_id)
+        if days is None:
+            return
+        day_data = days.get(day)
+        if day_data is None:
+            return
+        day_data.totals[activity_type] = day_data.totals.get(activity_type, 0) + duration_minutes
+        if day_data.entries is not None:
+            day_data.entries.append({
+                'id': entry_id,
+                'activity_type': activity_type,
+                'duration_minutes': duration_minutes,
+                'created_at': created_at,
+            })
+            self.items += 1
+            self._evict(keep=user_id)
+
+    def invalidate(self, user_id=None):
+        if user_id is None:
+            self.users.clear()
+            self.zones.clear()
+            self.items = 0
+            self.write_seq += 1
+            self.last_write.clear()
+            self.cleared_at = self.write_seq
+            return
+        self._mark_written(user_id)
+        days = self.users.pop(user_id, None)
+        if days:
+            self.items -= sum(day_data.cost for day_data in days.values())
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'users': len(self.users),
+            'zones': len(self.zones),
+            'items': self.items,
+            'max_items': self.max_items,
+            'approx_bytes': self._approx_bytes(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'bypassed': self.bypassed,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _approx_bytes(self):
+        # Оценка по одному среднему дню, чтобы не обходить весь кэш
+        for days in self.users.values():
+            for day_data in days.values():
+                sample = sys.getsizeof(day_data.totals)
+                if day_data.entries:
+                    sample += sum(sys.getsizeof(entry) for entry in day_data.entries[:1])
+                return sample * self.items
+        return 0
+
+    # --- Часовые пояса ---
+
+    async def user_zone(self, user_id):
+        # -> tzinfo пояса пользователя или None (время сервера)
+        if user_id in self.zones:
+            self.zones.move_to_end(user_id)
+            name = self.zones[user_id]
+        else:
+            name = await self.db.get_user_timezone(user_id)
+            self.zones[user_id] = name
+            if len(self.zones) > self.max_items:
+                self.zones.popitem(last=False)
+        return get_zone(name or self.default_timezone)
+
+    async def create_user(self, user_id, username, timezone=None):
+        # Новому пользователю сразу записывается пояс по умолчанию
+        return await self.db.create_user(user_id, username, timezone or self.default_timezone)
+
+    async def set_user_timezone(self, user_id, timezone):
+        updated = await self.db.set_user_timezone(user_id, timezone)
+        if updated:
+            # Дни в кэше были посчитаны в прежнем поясе
+            self.invalidate(user_id)
+            self.zones[user_id] = timezone
+        return updated
+
+    # --- Чтение ---
+
+    async def get_user_entries_by_date(self, user_id, day):
+        day_data, cacheable = self._lookup(user_id, day)
+        if day_data is not None and day_data.entries is not None:
+            self.hits += 1
+            return list(day_data.entries)
+
+        token = self._begin_read()
+        try:
+            entries = await self.db.get_user_entries_by_date(user_id, day)
+        finally:
+            fresh = self._end_read(user_id, token)
+        if cacheable and fresh:
+            self.misses += 1
+            totals = {}
+            for entry in entries:
+                activity_type = entry['activity_type']
+                totals[activity_type] = totals.get(activity_type, 0) + entry['duration_minutes']
+            self._store(user_id, day, _DayData(totals, list(entries)))
+        return entries
+
+    async def get_daily_report(self, user_id, day):
+        day_data, cacheable = self._lookup(user_id, day)
+        if day_data is not None:
+            self.hits += 1
+            report = dict.fromkeys(ACTIVITY_TYPES, 0)
+            report.update(day_data.totals)
+            return report
+
+        token = self._begin_read()
+        try:
+            report = await self.db.get_daily_report(user_id, day)
+        finally:
+            fresh = self._end_read(user_id, token)
+        if cacheable and fresh and report:
+            self.misses += 1
+            self._store(user_id, day, _DayData({k: v for k, v in report.items() if v}))
+        return report
+
+    async def get_user_statistics(self, user_id, start_date, end_date):
+        cacheable = (self.enabled and self._in_window(start_date)
+                     and self._in_window(end_date))
+        if not cacheable:
+            self.bypassed += 1
+            return await self.db.get_user_statistics(user_id, start_date, end_date)
+
+        days = self._user_days(user_id) or {}
+        range_days = [start_date + timedelta(days=i)
+                      for i in range((end_date - start_date).days + 1)]
+        if all(day in days for day in range_days):
+            self.hits += 1
+            stats = []
+            for day in range_days:
+                totals = days[day].totals
+                if any(totals.values()):
+                    day_stats = {'date': day}
+                    day_stats.update(totals)
+                    stats.append(day_stats)
+            return stats
+
+        self.misses += 1
+        token = self._begin_read()
+        try:
+            stats = await self.db.get_user_statistics(user_id, start_date, end_date)
+        finally:
+            fresh = self._end_read(user_id, token)
+        if not fresh:
+            return stats
+        days = self._user_days(user_id) or {}
+        by_day = {day_stats['date']: day_stats for day_stats in stats}
+        for day in range_days:
+            if day in days:
+                continue
+            totals = {k: v for k, v in by_day.get(day, {}).items() if k != 'date'}
+            self._store(user_id, day, _DayData(totals))
+        return stats
+
+    async def get_range_report(self, user_id, start_date, end_date, bucket_days=1):
+        # По дням — те же строки, что и у статистики (и тот же кэш)
+        if bucket_days == 1:
+            return await self.get_user_statistics(user_id, start_date, end_date)
+        return await self.db.get_range_report(user_id, start_date, end_date, bucket_days)
+
+    # --- Запись (write-through) ---
+
+    # Время записи ставит БД; день в поясе пользователя считаем
+    # по локальному времени того же сервера
+
+    async def add_time_entry(self, user_id, activity_type, duration_minutes, created_at=None,
+                             local_date=None):
+        moment = created_at or datetime.now()
+        day = local_date or to_local(moment, await self.user_zone(user_id)).date()
+        self._begin_write(user_id)
+        try:
+            entry_id = await self.db.add_time_entry(
+                user_id, activity_type, duration_minutes, created_at, day
+            )
+        finally:
+            self._end_write(user_id)
+        if entry_id:
+            self._apply(user_id, activity_type, duration_minutes, entry_id, moment, day)
+            if self.on_entry is not None:
+                self.on_entry(user_id, activity_type, duration_minutes, day)
+        return entry_id
+
+    async def add_time_entries(self, entries):
+        zones = {}
+        for user_id, _, _ in entries:
+            if user_id not in zones:
+                zones[user_id] = await self.user_zone(user_id)
+        now = datetime.now()
+        days = [local_date(now, zones[user_id]) for user_id, _, _ in entries]
+
+        for user_id in zones:
+            self._begin_write(user_id)
+        try:
+            inserted = await self.db.add_time_entries(entries, days)
+        finally:
+            for user_id in zones:
+                self._end_write(user_id)
+        if inserted:
+            # Пакет пишется одной транзакцией: сохранены все записи или ни одной.
+            # id записей пакета база не возвращает
+            for (user_id, activity_type, duration_minutes), day in zip(entries, days):
+                self._apply(user_id, activity_type, duration_minutes, None, now, day)
+                if self.on_entry is not None:
+                    self.on_entry(user_id, activity_type, duration_minutes, day)
+        return inserted
+
+    async def import_entries(self, user_id, rows):
+        zone = await self.user_zone(user_id)
+        days = [local_date(created_at, zone) for _, _, created_at, _ in rows]
+        # Импорт может затронуть любые дни: проще забыть пользователя целиком
+        inserted = await self.db.import_entries(user_id, rows, days)
+        self.invalidate(user_id)
+        if inserted and self.on_import is not None:
+            await self.on_import(user_id)
+        return inserted
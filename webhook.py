@@ -0,0 +1,143 @@
+import asyncio
+import hmac
+import logging
+import secrets
+import signal
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+# Встроенный HTTP-сервер для приема обновлений через webhook
+class WebhookServer:
+    def __init__(self, dp, url, path='/webhook', secret_token=None,
+                 host='0.0.0.0', port=8080, max_concurrency=100, drain_timeout=30.0):
+        self.dp = dp
+        self.url = url.rstrip('/') + path
+        self.path = path
+        # Telegram допускает в токене только A-Z, a-z, 0-9, _ и -
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self.host = host
+        self.port = port
+        self.max_concurrency = max_concurrency
+        self.drain_timeout = drain_timeout
+
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.tasks = set()
+        self.runner = None
+        self.accepting = False
+
+        # Метрики
+        self.received_total = 0
+        self.rejected_total = 0
+        self.failed_total = 0
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request):
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token, self.secret_token):
+            self.rejected_total += 1
+            logger.warning(f"Отклонен запрос без верного секрета от {request.remote}")
+            return web.Response(status=403)
+
+        if not self.accepting:
+            # Во время остановки просим Telegram повторить позже
+            return web.Response(status=503)
+
+        try:
+            update = types.Update(**(await request.json()))
+        except Exception as e:
+            logger.error(f"Некорректное обновление: {e}")
+            return web.Response(status=400)
+
+        # Ограничиваем число одновременно обрабатываемых обновлений.
+        # Пока слотов нет, ответ задерживается, и Telegram не шлет новые.
+        await self.semaphore.acquire()
+        self.received_total += 1
+        task = asyncio.create_task(self._process(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.Response()
+
+    async def _process(self, update):
+        try:
+            # Через updates_handler, чтобы сработали middleware уровня update
+            await self.dp.updates_handler.notify(update)
+        except Exception as e:
+            self.failed_total += 1
+            logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+        finally:
+            self.semaphore.release()
+
+    async def start(self):
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+
+        self.runner = web.AppRunner(self.make_app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.accepting = True
+
+        await self.dp.bot.set_webhook(
+            self.url,
+            secret_token=self.secret_token,
+            max_connections=min(self.max_concurrency, 100)
+        )
+        logger.info(f"Webhook запущен: {self.url} (порт {self.port})")
+
+    async def stop(self):
+        # Не удаляем webhook: Telegram придержит обновления до перезапуска
+        self.accepting = False
+        if self.tasks:
+            logger.info(f"Ожидаем завершения {len(self.tasks)} обновлений")
+            done, pending = await asyncio.wait(set(self.tasks), timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"Прервано необработанных обновлений: {len(pending)}")
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def stats(self):
+        return {
+            'in_flight': len(self.tasks),
+            'max_concurrency': self.max_concurrency,
+            'received_total': self.received_total,
+            'rejected_total': self.rejected_total,
+            'failed_total': self.failed_total,
+        }
+
+
+async def _serve(server, on_startup, on_shutdown):
+    dp = server.dp
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await on_startup(dp)
+    await server.start()
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await on_shutdown(dp)
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        session = await dp.bot.get_session()
+        await session.close()
+
+
+# Аналог executor.start_polling для режима webhook
+def start_webhook(server, on_startup, on_shutdown):
+    asyncio.run(_serve(server, on_startup, on_shutdown))
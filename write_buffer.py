@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingEntry:
+    __slots__ = ('values', 'future')
+
+    def __init__(self, values, future):
+        self.values = values
+        self.future = future
+
+
+# Буфер отложенной записи: собирает записи времени из разных обработчиков
+# и сбрасывает их в БД одним многострочным INSERT по размеру или по времени.
+# add() возвращает истинное значение только после фиксации транзакции
+# (id записи или True для записи из пакета), поэтому пользователь видит
+# «Добавлено» лишь для реально сохраненных данных.
+class WriteBehindBuffer:
+    def __init__(self, db, max_batch=200, flush_interval=0.05):
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.closing = False
+
+        # Метрики
+        self.batches_total = 0
+        self.entries_total = 0
+        self.failed_batches_total = 0
+        self.batch_size_max = 0
+        self.flush_latency_total = 0.0
+        self.flush_latency_max = 0.0
+        self.last_flush_latency = 0.0
+
+    def start(self):
+        if self.task is None:
+            self.closing = False
+            self.task = asyncio.create_task(self._run())
+            logger.info(
+                f"Буфер записи запущен (пакет до {self.max_batch}, "
+                f"интервал {self.flush_interval} с)"
+            )
+
+    async def close(self):
+        if self.task is None:
+            return
+        # Дожидаемся сброса всего, что уже поставлено в очередь
+        self.closing = True
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+        logger.info("Буфер записи остановлен, все записи сохранены")
+
+    async def add(self, user_id, activity_type, duration_minutes):
+        if self.task is None or self.closing:
+            # Буфер не работает: пишем напрямую
+            return await self.db.add_time_entry(user_id, activity_type, duration_minutes)
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(_PendingEntry((user_id, activity_type, duration_minutes), future))
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+
+            # Добираем пакет до max_batch или до истечения интервала
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+        # Остаток очереди после сигнала остановки
+        remaining = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not None:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.max_batch):
+            await self._flush(remaining[start:start + self.max_batch])
+
+    async def _flush(self, batch):
+        started = time.monotonic()
+        try:
+            inserted = await self.db.add_time_entries([item.values for item in batch])
+        except Exception as e:
+            logger.error(f"Ошибка записи пакета из {len(batch)} записей: {e}")
+            inserted = 0
+        if not inserted:
+            self.failed_batches_total += 1
+
+        latency = time.monotonic() - started
+        self.batches_total += 1
+        self.entries_total += len(batch)
+        self.batch_size_max = max(self.batch_size_max, len(batch))
+        self.last_flush_latency = latency
+        self.flush_latency_total += latency
+        self.flush_latency_max = max(self.flush_latency_max, latency)
+
+        for item in batch:
+            if not item.future.done():
+                item.future.set_result(True if inserted else None)
+
+    def stats(self):
+        batches = self.batches_total
+        return {
+            'queue_size': self.queue.qsize(),
+            'batches_total': batches,
+            'entries_total': self.entries_total,
+            'failed_batches_total': self.failed_batches_total,
+            'batch_size_avg': self.entries_total / batches if batches else 0.0,
+            'batch_size_max': self.batch_size_max,
+            'flush_latency_last': self.last_flush_latency,
+            'flush_latency_avg': self.flush_latency_total / batches if batches else 0.0,
+            'flush_latency_max': self.flush_latency_max,
+        }